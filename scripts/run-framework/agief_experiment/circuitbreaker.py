@@ -0,0 +1,116 @@
+import time
+import threading
+from collections import deque
+
+
+class CircuitBreaker:
+    """
+        Tracks the outcome of recent requests to one Compute endpoint, and
+        'trips' (opens) when too many of them fail or are too slow, so that
+        a flaky node is given up on quickly, rather than each caller waiting
+        out its own retries.
+
+        While open, requests are refused without being sent. Once
+        'reset_seconds' have passed, the next request (or health check) is
+        let through: if it succeeds the breaker closes again, otherwise it
+        stays open for another 'reset_seconds'.
+
+        Health checks (probes, e.g. while waiting for a node to start) don't
+        count towards tripping, they can only close a breaker that is due to
+        be tried again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, max_error_rate=0.5, slow_seconds=None, window=20,
+                 min_requests=5, reset_seconds=30, clock=time.time):
+        """
+        :param max_error_rate: trip when at least this fraction of the last
+                               'window' requests failed. 0 to never trip.
+        :param slow_seconds: requests expected to be fast (see record()) that
+                             take longer than this count as failed
+        :param min_requests: don't trip on fewer requests than this
+        :param reset_seconds: time from tripping until requests are tried
+                              again
+        """
+        self.max_error_rate = max_error_rate
+        self.slow_seconds = slow_seconds
+        self.min_requests = min_requests
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+
+        self.state = self.CLOSED
+        self.trips = 0
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def _due(self):
+        return self.clock() - self._opened_at >= self.reset_seconds
+
+    def allow(self):
+        """ True if a request may be sent now """
+        with self._lock:
+            if self.state == self.OPEN and self._due():
+                self.state = self.HALF_OPEN
+            return self.state != self.OPEN
+
+    def record(self, latency, is_error, fast=False, probe=False):
+        """
+        Record the outcome of a request.
+
+        :param fast: the node should have answered right away, so its latency
+                     is checked against slow_seconds
+        :param probe: a health check, see the class description
+        """
+        if fast and self.slow_seconds and latency > self.slow_seconds:
+            is_error = True
+
+        with self._lock:
+            if probe and self.state == self.OPEN and self._due():
+                self.state = self.HALF_OPEN
+
+            if self.state == self.HALF_OPEN:
+                # the trial request decides
+                if is_error:
+                    self._open()
+                else:
+                    self._close()
+                return
+
+            if probe or self.state == self.OPEN:
+                # a health check, or a request sent before it tripped
+                return
+
+            self._outcomes.append(is_error)
+            num_errors = sum(self._outcomes)
+            if self.max_error_rate and (
+                    len(self._outcomes) >= self.min_requests) and (
+                    num_errors >= self.max_error_rate * len(self._outcomes)):
+                self._open()
+                self.trips += 1
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = self.clock()
+
+    def _close(self):
+        self.state = self.CLOSED
+        self._outcomes.clear()
+
+    def reset(self):
+        """ Forget all outcomes, e.g. once the node has been relaunched """
+        with self._lock:
+            self._close()
+
+    def is_open(self):
+        with self._lock:
+            return self.state == self.OPEN
+
+    def describe(self):
+        with self._lock:
+            return "%s, %d of the last %d requests failed, tripped %d " \
+                   "time(s)" % (self.state, sum(self._outcomes),
+                                len(self._outcomes), self.trips)
@@ -33,7 +33,9 @@ class Cloud:
     network_interface_id = 'eni - b2acd4d4'
 
     def __init__(self):
-        pass
+        # contents uploaded to s3 in this session, (bucket, key) by content
+        # key, see upload_file_s3
+        self._uploaded = {}
 
     def sync_experiment(self, remote):
         """
@@ -285,7 +287,12 @@ class Cloud:
         cmd += str(no_compress) + " " + str(csv_output)
         utils.run_bashscript_repeat(cmd, 3, 3)
 
-    def upload_folder_s3(self, bucket_name, key, source_folderpath):
+    def upload_folder_s3(self, bucket_name, key, source_folderpath,
+                         content_key=None):
+        """
+        :param content_key: function(filepath) that returns the key of the
+                            contents of a file, or None, see upload_file_s3
+        """
 
         if not os.path.exists(source_folderpath):
             logging.warning("folder does not exist, cannot upload: " +
@@ -302,10 +309,18 @@ class Cloud:
                 filepath = os.path.join(source_folderpath, f)
                 filekey = os.path.join(key, f)
 
-                self.upload_file_s3(bucket_name, filekey, filepath)
+                self.upload_file_s3(
+                    bucket_name, filekey, filepath,
+                    content_key(filepath) if content_key else None)
 
-    @staticmethod
-    def upload_file_s3(bucket_name, key, source_filepath):
+    def upload_file_s3(self, bucket_name, key, source_filepath,
+                       content_key=None):
+        """
+        :param content_key: identifies the contents of the file, e.g. its
+                            GeneratedInputs entry. Contents that have been
+                            uploaded before are copied within s3, rather than
+                            uploaded again.
+        """
 
         try:
             if os.stat(source_filepath).st_size == 0:
@@ -334,10 +349,29 @@ class Cloud:
                             " does not exist, creating it now.")
             s3.create_bucket(Bucket=bucket_name)
 
+        uploaded = self._uploaded.get(content_key)
+        if content_key is not None and uploaded is not None:
+            print(" ... file = " + source_filepath + ", to bucket = " +
+                  bucket_name + ", key = " + key + ", copied from key = " +
+                  uploaded[1])
+            try:
+                response = s3.Object(bucket_name=bucket_name,
+                                     key=key).copy_from(
+                    CopySource={'Bucket': uploaded[0], 'Key': uploaded[1]})
+                logging.debug("Response = : %s", response)
+                return
+            except botocore.exceptions.ClientError as e:
+                logging.warning("Could not copy %s within s3 (%s), "
+                                "uploading it.", uploaded[1], e)
+
         print(" ... file = " + source_filepath + ", to bucket = " +
               bucket_name + ", key = " + key)
-        response = s3.Object(bucket_name=bucket_name,
-                             key=key).put(Body=open(source_filepath, 'rb'))
+        with open(source_filepath, 'rb') as source_file:
+            response = s3.Object(bucket_name=bucket_name,
+                                 key=key).put(Body=source_file)
+
+        if content_key is not None:
+            self._uploaded[content_key] = (bucket_name, key)
 
         logging.debug("Response = : ", response)
 
@@ -1,38 +1,243 @@
 import os
+import copy
+import gzip
 import time
 import json
+import socket
 import logging
+import threading
+import uuid
 import requests
 import dpath.util
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 from agief_experiment import utils
+from agief_experiment import httpsession
+from agief_experiment import waitstrategy
+from agief_experiment import upload
+from agief_experiment import jsonstream
+from agief_experiment import exportshards
+from agief_experiment import metrics
+from agief_experiment.launchlog import LaunchLog
+from agief_experiment.progress import RunProgress, ComputeStalled
+from agief_experiment.configcache import ConfigCache
+from agief_experiment.entitydocument import EntityDocument
 from agief_experiment.experiment import Experiment
 
 
 class Compute:
+
+    # how input files are sent to /import, see _import_file()
+    UPLOAD_MODES = ('multipart', 'stream', 'stream-gzip')
+
+    # how exported files are written, see export_root_entity()
+    EXPORT_MODES = ('pretty', 'stream', 'stream-gzip')
+    DEFAULT_EXPORT_MODE = 'pretty'
+
+    EXPORT_CHUNK_SIZE = 1024 * 1024
+
+    # (connect, read) timeout of the polls in wait_till_param, so a hung
+    # node can't block the wait loop
+    POLL_TIMEOUT = (10, 60)
+
+    # (connect, read) timeout of a health check, see healthy()
+    HEALTH_TIMEOUT = (5, 30)
+
     def __init__(self,
                  host_node,
-                 port=8491):
+                 port=8491,
+                 pool_size=10,
+                 max_retries=3,
+                 keep_alive=True,
+                 wait_strategy=None,
+                 config_workers=8,
+                 upload_mode='stream',
+                 import_workers=1,
+                 export_mode=DEFAULT_EXPORT_MODE,
+                 stall_multiple=0,
+                 stall_min_seconds=300,
+                 config_cache=True,
+                 export_shards=False,
+                 export_workers=4,
+                 breaker_error_rate=0.5,
+                 breaker_slow_seconds=None,
+                 breaker_reset_seconds=30):
 
         """
         If remote_node is unspecified, then assumes use of a local Compute node
+
+        :param pool_size: max number of pooled connections to the node
+        :param max_retries: transport level retries (connection errors, and
+                            5xx responses to idempotent requests)
+        :param keep_alive: if False, close the connection after each request
+        :param wait_strategy: a WaitStrategy deciding how to poll for the end
+                              of a run (default: AdaptiveWaitStrategy)
+        :param config_workers: max concurrent requests when setting many
+                               parameters with set_parameters_db
+        :param upload_mode: 'multipart' reads each input file into memory
+                            before posting it, 'stream' sends it in chunks as
+                            it is read, 'stream-gzip' also gzip compresses
+                            it (if the node advertises 'gzip-request')
+        :param import_workers: max number of data files imported at the same
+                               time (the entity file is always imported
+                               first, on its own)
+        :param export_mode: 'pretty' parses the exported json and writes it
+                            indented, 'stream' writes the response to file as
+                            it arrives, 'stream-gzip' also gzip compresses it
+        :param stall_multiple: a run is stalled if its age hasn't advanced
+                               for this multiple of its usual step interval
+                               (0, the default, to never consider a run
+                               stalled)
+        :param stall_min_seconds: but not before this many seconds
+        :param config_cache: if True, parameters that are known to have the
+                             value already are not sent, see ConfigCache
+        :param export_shards: if True, export the data of each entity of the
+                              subtree separately, see export_subtree()
+        :param export_workers: max concurrent exports of data shards
+        :param breaker_error_rate: the node's circuit breaker trips when at
+                                   least this fraction of recent requests
+                                   failed (0 to never trip), see
+                                   CircuitBreaker
+        :param breaker_slow_seconds: requests the node should answer right
+                                     away that take longer count as failed
+        :param breaker_reset_seconds: time a tripped breaker refuses
+                                      requests, before trying again
         """
 
+        if upload_mode not in self.UPLOAD_MODES:
+            raise ValueError("ERROR: unknown upload mode '" +
+                             str(upload_mode) + "'")
+        if export_mode not in self.EXPORT_MODES:
+            raise ValueError("ERROR: unknown export mode '" +
+                             str(export_mode) + "'")
+
         self.port = port
         self.host_node = host_node
         self.container_id = ''
-        self.runtime = 0
+        self.task_arn = None
+
+        # state of the run in progress on the current thread (runtime,
+        # progress and wait strategy), as a node can run several at once
+        self._run = threading.local()
+
+        # number of runs this node takes at the same time, see ComputePool
+        self.slots = 1
+
+        # InputCache on the node's host for large data files, or None to
+        # always upload them
+        self.input_cache = None
+
+        # GeneratedInputs that the input files are made from, if any, so
+        # that copies of its entries are found in the input cache by entry
+        self.generated_inputs = None
+
+        self.session_options = {'pool_size': pool_size,
+                                'max_retries': max_retries,
+                                'keep_alive': keep_alive,
+                                'breaker_error_rate': breaker_error_rate,
+                                'breaker_slow_seconds': breaker_slow_seconds,
+                                'breaker_reset_seconds': breaker_reset_seconds}
+
+        if wait_strategy is None:
+            wait_strategy = waitstrategy.AdaptiveWaitStrategy()
+        self.wait_strategy = wait_strategy
+        self.config_workers = config_workers
+        self.upload_mode = upload_mode
+        self.import_workers = import_workers
+        self.export_mode = export_mode
+        self.stall_multiple = stall_multiple
+        self.stall_min_seconds = stall_min_seconds
+
+        self.export_shards = export_shards
+        self.export_workers = export_workers
+
+        # last known entity configs, or None to always send parameters
+        self.config_cache = ConfigCache() if config_cache else None
+
+        # optional features advertised by the node, see capabilities()
+        self._capabilities = None
+
+    @property
+    def runtime(self):
+        """ Formatted runTime of the last run waited on by this thread """
+        return getattr(self._run, 'runtime', 0)
+
+    @runtime.setter
+    def runtime(self, runtime):
+        self._run.runtime = runtime
+
+    @property
+    def progress(self):
+        """ RunProgress of the last run waited on by this thread """
+        if not hasattr(self._run, 'progress'):
+            self._run.progress = RunProgress()
+        return self._run.progress
+
+    @progress.setter
+    def progress(self, progress):
+        self._run.progress = progress
+
+    def _thread_wait_strategy(self):
+        """
+        This thread's copy of the wait strategy, so that the runs in
+        progress at the same time each have their own polling state
+        """
+        if getattr(self._run, 'wait_strategy', None) is None:
+            self._run.wait_strategy = copy.copy(self.wait_strategy)
+        return self._run.wait_strategy
 
     def remote(self):
         return self.host_node.remote()
 
+    def host_resources(self):
+        """
+        :return: (number of cores, memory in GB) of the machine the node
+                 runs on
+        """
+        cmd = "nproc && grep MemTotal /proc/meminfo"
+        if self.remote():
+            output = "".join(utils.remote_run(self.host_node, cmd))
+        else:
+            output = subprocess.check_output(cmd, shell=True,
+                                             executable="/bin/bash")
+            output = output.decode('utf-8')
+
+        lines = output.split()
+        cores = int(lines[0])
+        # MemTotal: <n> kB
+        memory_gb = int(lines[2]) / (1024.0 * 1024.0)
+        return cores, memory_gb
+
+    def concurrent_runs(self, cores_per_run, memory_gb_per_run):
+        """
+        Number of runs the node's machine has the cores and memory for
+        """
+        cores, memory_gb = self.host_resources()
+        runs = min(cores // cores_per_run, int(memory_gb // memory_gb_per_run))
+        print("Compute at " + self.base_url() + ": %d cores, %.1f GB, room "
+              "for %d concurrent run(s)" % (cores, memory_gb, max(runs, 1)))
+        return max(runs, 1)
+
     def base_url(self):
         return utils.getbaseurl(self.host_node.host, self.port)
 
-    def get_entity_config(self, entity_name):
+    def session(self):
+        """
+        The pooled session shared by all Compute objects for this host/port.
+        Looked up on each call, as the host can change after construction
+        (e.g. once the ip of an ec2 instance is known).
+        """
+        return httpsession.session_for(self.base_url(),
+                                       **self.session_options)
+
+    def session_stats(self):
+        return self.session().stats()
+
+    def get_entity_config(self, entity_name, timeout=None):
         param_dic = {'entity': entity_name}
-        r = requests.get(self.base_url() + '/config', params=param_dic)
+        r = self.session().get('/config', params=param_dic, timeout=timeout,
+                               fast=True)
 
         logging.debug("Get config: /config with params " +
                       json.dumps(param_dic))
@@ -40,8 +245,31 @@ class Compute:
         logging.debug("  url: " + r.url)
 
         config = r.json()
+
+        if self.config_cache is not None and 'value' in config:
+            self.config_cache.refresh(entity_name, config['value'])
+
         return config
 
+    def _long_poll_entity_config(self, entity_name, param_path, value,
+                                 timeout):
+        """
+        Get the entity config, but ask the node to hold the request until
+        'param_path' has reached 'value' or 'timeout' seconds have passed.
+        """
+        param_dic = {'entity': entity_name,
+                     'wait-path': param_path,
+                     'wait-value': json.dumps(value),
+                     'wait-timeout': timeout}
+        r = self.session().get('/config', params=param_dic,
+                               timeout=(10, timeout + 30))
+
+        logging.debug("Long-poll config: /config with params " +
+                      json.dumps(param_dic))
+        logging.debug("  response text = " + r.text)
+
+        return r.json()
+
     def wait_till_param(self, entity_name, param_path, value, max_tries=-1):
         """
         Return when the the config parameter has achieved the value specified
@@ -49,18 +277,27 @@ class Compute:
         delimited by '.'
 
         If there are too many connection errors, exit the whole program.
+        Raises ComputeStalled if the entity's age stops advancing, see
+        RunProgress.stalled(), and httpsession.CircuitOpen as soon as the
+        node's circuit breaker trips.
         """
 
         max_connection_error = 5
 
-        wait_period = 10
+        strategy = self._thread_wait_strategy()
+        strategy.reset()
+
+        long_poll = strategy.long_poll and 'long-poll' in self.capabilities()
+
         age = None
         i = 0
         param_runtime = 0
         connection_error_count = 0
+        progress = RunProgress()
+        self.progress = progress
 
-        print("... Waiting for param to achieve value (try every " +
-              str(wait_period) + "s): " + entity_name +
+        print("... Waiting for param to achieve value (" +
+              strategy.describe() + "): " + entity_name +
               "." + param_path + " = " + str(value))
 
         def print_age(idx, age_str):
@@ -73,7 +310,8 @@ class Compute:
 
             age_string = ""
             if age is not None:
-                age_string = ", " + entity_name + ".age = " + str(age)
+                age_string = ", " + entity_name + ".age = " + str(age) + \
+                             progress.describe()
 
             if 0 < max_tries < i:
                 print_age(i, age_string)
@@ -89,13 +327,22 @@ class Compute:
             if i % 5 == 0:
                 print_age(i, age_string)
 
+            config = None
             try:
-                config = self.get_entity_config(entity_name)
+                if long_poll:
+                    config = self._long_poll_entity_config(
+                        entity_name, param_path, value, strategy.timeout)
+                else:
+                    config = self.get_entity_config(entity_name,
+                                                    self.POLL_TIMEOUT)
 
                 if 'value' in config:
                     age = dpath.util.get(config, 'value.age', '.')
                     param_runtime = dpath.util.get(config, 'value.runTime',
                                                    '.')
+                    termination_age = config['value'].get('terminationAge')
+                    strategy.observe(age, param_runtime, termination_age)
+                    progress.sample(age, param_runtime, termination_age)
                     parameter = dpath.util.get(config, 'value.' + param_path,
                                                '.')
                     if parameter == value:
@@ -108,13 +355,30 @@ class Compute:
                 logging.warning("KeyError Exception: Trying to access a " +
                                 "keypath in config object, that DOES NOT " +
                                 "exist!")
+            except httpsession.CircuitOpen:
+                print_age(i, age_string)
+                raise
             except requests.exceptions.ConnectionError:
                 logging.error("Oops, ConnectionError exception")
                 connection_error_count += 1
             except requests.exceptions.RequestException:
                 logging.error("Oops, request exception")
 
-            time.sleep(wait_period)  # sleep for n seconds
+            stalled = progress.stalled(self.stall_multiple,
+                                       self.stall_min_seconds)
+            if stalled is not None:
+                print_age(i, age_string)
+                raise ComputeStalled(
+                    "ERROR: " + entity_name + ".age has not advanced for "
+                    "%d s, at %s, the run is considered stalled." %
+                    (stalled, self.base_url()))
+
+            # a long-poll request has already waited on the node, unless
+            # it failed
+            if not long_poll or config is None:
+                time.sleep(strategy.next_interval())
+
+        strategy.finished()
 
         # successfully reached value
         print_age(i, age_string)
@@ -124,11 +388,25 @@ class Compute:
         if param_runtime > 0:
             self.runtime = utils.format_runtime(param_runtime)
 
-    def import_experiment(self, entity_filepath=None, data_filepaths=None):
-        """setup the running instance of AGIEF with the input files"""
+    def import_experiment(self, entity_filepath=None, data_filepaths=None,
+                          data_sources=None):
+        """
+        setup the running instance of AGIEF with the input files
+
+        :param data_sources: substitution.SubstitutedFile by data filepath,
+                             for the data files that are not on disk, but
+                             made from their base file as they are uploaded
+        """
+
+        data_sources = data_sources or {}
+
+        if data_filepaths:
+            # the index of a sharded export stands for its shards
+            data_filepaths = exportshards.expand_data_filepaths(
+                data_filepaths)
 
         is_entity_file = entity_filepath is not None
-        is_data_files = data_filepaths is not None or len(data_filepaths) != 0
+        is_data_files = data_filepaths is not None and len(data_filepaths) != 0
 
         print("\n....... Import experiment")
 
@@ -147,30 +425,175 @@ class Compute:
             if not os.path.isfile(entity_filepath):
                 raise Exception("ERROR: entity file does not exist.")
 
-            with open(entity_filepath, 'rb') as entity_data_file:
-                files = {'entity-file': entity_data_file}
-                response = requests.post(self.base_url() + '/import',
-                                         files=files)
+            response = self._import_file('entity-file', entity_filepath)
 
-                logging.debug("Import entity file")
-                logging.debug("  response text = " + response.text)
-                logging.debug("  url: " + response.url)
-                logging.debug("  post body = " + str(files))
+            if self.config_cache is not None and response.status_code < 400:
+                self.config_cache.seed_from_entity_file(entity_filepath)
 
         if is_data_files:
             for data_filepath in data_filepaths:
-                if not os.path.isfile(data_filepath):
+                source = data_sources.get(data_filepath)
+                if not os.path.isfile(data_filepath if source is None else
+                                      source.source_filepath):
                     raise Exception("ERROR: data file does not exist.")
 
-                with open(data_filepath, 'rb') as data_data_file:
-                    files = {'data-file': data_data_file}
-                    response = requests.post(self.base_url() + '/import',
-                                             files=files)
+            if self.input_cache is not None:
+                data_filepaths = self._import_cached(data_filepaths,
+                                                     data_sources)
+
+            results = self._run_imports(
+                lambda data_filepath: self._import_file(
+                    'data-file', data_filepath,
+                    data_sources.get(data_filepath)),
+                data_filepaths)
+
+            for data_filepath, response, _ in results:
+                if response.status_code >= 400:
+                    logging.error("Compute error response from /import for "
+                                  "%s: %s", data_filepath, response.text)
+
+    def _import_cached(self, data_filepaths, data_sources):
+        """
+        Import the data files that the input cache applies to from the cache
+        on the Compute host (with /import-local), transferring them there
+        first if they are not there yet.
+
+        :return: the data files that are left to upload
+        """
+
+        cached = []
+        upload_filepaths = []
+        for data_filepath in data_filepaths:
+            # files made as they are uploaded have the prefix of the run in
+            # them, they would never be found in the cache again, unless
+            # there is no prefix to replace in their base file
+            source = data_sources.get(data_filepath)
+            content_filepath = (data_filepath if source is None else
+                                source.source_filepath)
+            # a hard link to a generated input is hashed once, as its entry,
+            # rather than under the name of each prefix
+            if source is None and self.generated_inputs is not None:
+                content_filepath = (
+                    self.generated_inputs.entry(data_filepath) or
+                    content_filepath)
+            if (source is not None and not source.is_identity()) or (
+                    not self.input_cache.applies(content_filepath)):
+                upload_filepaths.append(data_filepath)
+                continue
+
+            start = time.time()
+            try:
+                cached_filepath, transferred = self.input_cache.place(
+                    content_filepath)
+            except (IOError, OSError, ValueError) as e:
+                # ValueError: a remote command failed, see utils.remote_run
+                logging.warning("Could not put %s in the input cache (%s), "
+                                "upload it instead.", data_filepath, e)
+                upload_filepaths.append(data_filepath)
+                continue
+            print("        %s: %s input cache as %s (%.2f s)" %
+                  (os.path.basename(data_filepath),
+                   "copied to" if transferred else "already in",
+                   os.path.basename(cached_filepath), time.time() - start))
+            cached.append((data_filepath, cached_filepath))
+
+        if cached:
+            results = self._run_imports(
+                lambda filepath: self._import_local(filepath, 'data'),
+                [cached_filepath for _, cached_filepath in cached])
+
+            # e.g. the cache folder is not where Compute sees it (docker)
+            for (data_filepath, _), (cached_filepath, response, _) in zip(
+                    cached, results):
+                if response.status_code >= 400:
+                    logging.warning("Compute could not load %s from the "
+                                    "input cache (status %d), upload it "
+                                    "instead.", cached_filepath,
+                                    response.status_code)
+                    upload_filepaths.append(data_filepath)
+
+        return upload_filepaths
+
+    def _run_imports(self, import_file, filepaths):
+        """
+        Call import_file(filepath) for each file, at most self.import_workers
+        at a time, and print how long each took.
+
+        :return: list of (filepath, response, seconds), in the order of
+                 'filepaths'
+        """
+
+        def timed_import(filepath):
+            start = time.time()
+            response = import_file(filepath)
+            return filepath, response, time.time() - start
+
+        num_workers = max(min(self.import_workers, len(filepaths)), 1)
+
+        start = time.time()
+        if num_workers == 1:
+            results = [timed_import(filepath) for filepath in filepaths]
+        else:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                results = list(executor.map(metrics.propagate(timed_import),
+                                            filepaths))
+        duration = time.time() - start
+
+        if len(results) > 1:
+            print("        Imported %d files in %.2f s (%d at a time):" %
+                  (len(results), duration, num_workers))
+            for filepath, response, seconds in results:
+                print("          %s: status %d, %.2f s" %
+                      (os.path.basename(filepath), response.status_code,
+                       seconds))
+
+        return results
+
+    def _import_file(self, field_name, filepath, source=None):
+        """
+        Post one input file to /import, as multipart form field 'field_name'
+        ('entity-file' or 'data-file'), using self.upload_mode.
+
+        :param source: substitution.SubstitutedFile that the file is made
+                       from as it is uploaded, if it is not on disk
+        """
+
+        if self.upload_mode == 'multipart':
+            if source is not None:
+                files = {field_name: (os.path.basename(filepath),
+                                      b''.join(source.chunks()))}
+                response = self.session().post('/import', files=files)
+            else:
+                with open(filepath, 'rb') as input_file:
+                    files = {field_name: input_file}
+                    response = self.session().post('/import', files=files)
+
+            logging.debug("Import " + field_name)
+            logging.debug("  response text = " + response.text)
+            logging.debug("  url: " + response.url)
+            logging.debug("  post body = " + field_name + ": " + filepath)
+            return response
+
+        compress = (self.upload_mode == 'stream-gzip' and
+                    'gzip-request' in self.capabilities())
+        if compress:
+            stream = upload.GzipMultipartFileStream(field_name, filepath,
+                                                    source=source)
+        else:
+            stream = upload.MultipartFileStream(field_name, filepath,
+                                                source=source)
+
+        timer = upload.UploadTimer(stream)
+        response = self.session().post('/import', data=stream,
+                                       headers=stream.headers())
+        timer.stop()
 
-                    logging.debug("Import data file")
-                    logging.debug("  response text = " + response.text)
-                    logging.debug("  url: " + response.url)
-                    logging.debug("  post body = " + str(files))
+        print("        Uploaded " + timer.summary())
+
+        logging.debug("Import " + field_name)
+        logging.debug("  response text = " + response.text)
+        logging.debug("  url: " + response.url)
+        return response
 
     def import_compute_experiment(self, filepaths, is_data):
         """
@@ -188,7 +611,7 @@ class Compute:
         if is_data:
             import_type = 'data'
 
-        is_data_files = filepaths is not None or len(filepaths) != 0
+        is_data_files = filepaths is not None and len(filepaths) != 0
 
         if is_data_files:
             print("     Input files: ")
@@ -197,26 +620,34 @@ class Compute:
             print("      No files to import")
             return
 
-        for filepath in filepaths:
-            payload = {'type': import_type, 'file': filepath}
-            response = requests.get(self.base_url() + '/import-local',
-                                    params=payload)
+        results = self._run_imports(
+            lambda filepath: self._import_local(filepath, import_type),
+            filepaths)
 
-            if response.status_code == 400:
-                msg = "Compute error response from /import-local - import " \
-                      "experiment from Data files on Compute"
-                raise Exception(msg)
+        failed = [filepath for filepath, response, _ in results
+                  if response.status_code == 400]
+        if failed:
+            msg = "Compute error response from /import-local - import " \
+                  "experiment from Data files on Compute: " + \
+                  json.dumps(failed)
+            raise Exception(msg)
 
-            logging.debug("Import data file")
-            logging.debug("  response text = " + response.text)
-            logging.debug("  url: " + response.url)
+    def _import_local(self, filepath, import_type):
+        """ Ask Compute to load a file on its machine, 'data' or 'entity' """
+        payload = {'type': import_type, 'file': filepath}
+        response = self.session().get('/import-local', params=payload)
+
+        logging.debug("Import data file")
+        logging.debug("  response text = " + response.text)
+        logging.debug("  url: " + response.url)
+        return response
 
     def run_experiment(self, experiment_entity):
 
         print("\n....... Run experiment")
 
         payload = {'entity': experiment_entity, 'event': 'update'}
-        response = requests.get(self.base_url() + '/update', params=payload)
+        response = self.session().get('/update', params=payload)
 
         if response.status_code == 400:
             msg = "Compute error response from /update"
@@ -228,7 +659,7 @@ class Compute:
         self.wait_till_param(experiment_entity, 'terminated', True)
 
     def export_root_entity(self, filepath, root_entity, export_type,
-                           is_compute_save=False):
+                           is_compute_save=False, timeout=None):
         """
         Export the subtree specified by root entity - either we save locally,
         or specify the Compute node to save it itself
@@ -241,7 +672,9 @@ class Compute:
                                 if true then 'Compute' saves the file, using
                                 the path to a folder (for the compute machine)
                                 specified by filepath
-        :return:
+        :param timeout: requests timeout, e.g. to give up on a hung node
+        :return: the path of the file written locally (with '.gz' appended
+                 in export mode 'stream-gzip'), or None
         """
 
         if not is_compute_save:
@@ -253,13 +686,21 @@ class Compute:
                 'export-location': filepath
             }
 
-        response = requests.get(self.base_url() + '/export', params=payload)
+        is_stream = not is_compute_save and self.export_mode != 'pretty'
+
+        response = self.session().get('/export', params=payload,
+                                      stream=is_stream, timeout=timeout)
 
         if response.status_code == 400:
             logging.error("Could not export type '%s' for the entity tree " +
                           "with root node '%s'", export_type, root_entity)
+            response.close()
             return
 
+        if is_stream:
+            logging.debug("  Response url = " + response.url)
+            return self._export_to_file(response, filepath)
+
         if is_compute_save:
             print("Saved file response: ", response.text)
 
@@ -272,49 +713,236 @@ class Compute:
             utils.create_folder(filepath)
             with open(filepath, 'w') as data_file:
                 data_file.write(json.dumps(output_json, indent=4))
+            return filepath
+
+    def _export_to_file(self, response, filepath):
+        """
+        Write a streamed /export response to file chunk by chunk, checking
+        that it is well formed json as it goes, so that memory use does not
+        depend on the size of the export.
+        """
+
+        is_gzip = self.export_mode == 'stream-gzip'
+        if is_gzip and not filepath.endswith('.gz'):
+            filepath += '.gz'
+
+        utils.create_folder(filepath)
+
+        checker = jsonstream.JsonStreamChecker()
+        start = time.time()
+
+        # only renamed to 'filepath' once it is known to be complete
+        part_filepath = filepath + '.' + uuid.uuid4().hex + '.part'
+        open_file = gzip.open if is_gzip else open
+        try:
+            with open_file(part_filepath, 'wb') as export_file:
+                for chunk in response.iter_content(
+                        chunk_size=self.EXPORT_CHUNK_SIZE):
+                    checker.feed(chunk)
+                    export_file.write(chunk)
+
+            metrics.record_transfer('GET', '/export', time.time() - start,
+                                    checker.num_bytes)
+
+            error = checker.finish()
+            if error is not None:
+                raise Exception("ERROR: exported file is not valid json, " +
+                                error + ": " + filepath)
+        except Exception:
+            utils.remove_file(part_filepath, True)
+            raise
+        os.rename(part_filepath, filepath)
+
+        print("        Exported %s: %.2f MB in %.2f s" %
+              (os.path.basename(filepath),
+               checker.num_bytes / (1024.0 * 1024.0), time.time() - start))
+
+        return filepath
 
     def export_subtree(self, root_entity, entity_filepath, data_filepath,
-                       is_export_compute=False):
+                       is_export_compute=False, timeout=None):
         """
         Export the full state of a subtree from the running instance of AGIEF
         that consists of entity graph and the data
+
+        With self.export_shards (and a node that advertises
+        'export-shallow'), the data is exported as one shard file per entity,
+        see _export_data_shards().
         """
 
         print("\n....... Export Experiment")
         logging.debug("Exporting data for root entity: %s", root_entity)
 
-        self.export_root_entity(entity_filepath, root_entity, 'entity',
-                                is_export_compute)
+        entity_filepath = self.export_root_entity(entity_filepath,
+                                                  root_entity, 'entity',
+                                                  is_export_compute, timeout)
+
+        if self.export_shards and not is_export_compute and (
+                entity_filepath is not None):
+            if 'export-shallow' in self.capabilities():
+                self._export_data_shards(root_entity, entity_filepath,
+                                         data_filepath, timeout)
+                return
+            logging.warning("Compute can't export the data of single "
+                            "entities, exporting it in one file.")
+
         self.export_root_entity(data_filepath, root_entity, 'data',
-                                is_export_compute)
+                                is_export_compute, timeout)
+
+    def _export_data_shards(self, root_entity, entity_filepath,
+                            data_filepath, timeout=None):
+        """
+        Export the data of each entity in the exported entity file on its
+        own (at most self.export_workers at a time), to a shard file next to
+        'data_filepath'. Then write an index of the shards, which can be
+        imported in place of a data file, see exportshards.
+
+        :return: path of the index file
+        """
+
+        entity_names = exportshards.entity_names(entity_filepath)
+
+        def export_shard(shard):
+            index, entity_name = shard
+            filepath = exportshards.shard_filepath(data_filepath, index)
+            payload = {'entity': entity_name, 'type': 'data',
+                       'export-shallow': 'true'}
+            response = self.session().get('/export', params=payload,
+                                          stream=True, timeout=timeout)
+            if response.status_code == 400:
+                response.close()
+                raise Exception("ERROR: could not export the data of " +
+                                entity_name)
+            return entity_name, self._export_to_file(response, filepath)
+
+        start = time.time()
+        num_workers = max(min(self.export_workers, len(entity_names)), 1)
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            shards = list(executor.map(metrics.propagate(export_shard),
+                                       enumerate(entity_names)))
+
+        # entities without data have nothing to import
+        for _, filepath in shards:
+            if exportshards.is_empty(filepath):
+                os.remove(filepath)
+        shards = [(entity_name, filepath) for entity_name, filepath in shards
+                  if os.path.isfile(filepath)]
+
+        index_filepath = exportshards.write_index(data_filepath, root_entity,
+                                                  shards)
+        print("        Exported data of %d entities to %d shards in %.2f s, "
+              "index: %s" % (len(entity_names), len(shards),
+                             time.time() - start,
+                             os.path.basename(index_filepath)))
+        return index_filepath
+
+    def unload_subtree(self, root_entity):
+        """
+        Remove the subtree of 'root_entity' (the entities and their data) from
+        the running Compute, e.g. once a run is over and has been exported.
+
+        Only nodes that advertise the 'delete' capability can remove
+        entities.
+
+        :return: True if the node removed it, False if it failed or does not
+                 support removing entities
+        """
+
+        if 'delete' not in self.capabilities():
+            logging.warning("Compute can't unload entities, %s is left "
+                            "loaded.", root_entity)
+            return False
+
+        print("\n....... Unload " + root_entity)
+
+        payload = {'entity': root_entity}
+        try:
+            response = self.session().get('/delete', params=payload)
+        except requests.exceptions.RequestException as e:
+            logging.error("Could not unload %s: %s", root_entity, e)
+            return False
+
+        logging.debug("Unload, response text = " + response.text)
+
+        if response.status_code >= 400:
+            logging.warning("Compute could not unload %s (status %d)",
+                            root_entity, response.status_code)
+            return False
+
+        if self.config_cache is not None:
+            prefix = root_entity.split(Experiment.PREFIX_DELIMITER)[0]
+            self.config_cache.forget_prefix(prefix +
+                                            Experiment.PREFIX_DELIMITER)
+
+        return True
+
+    def _port_open(self, timeout=1):
+        """ Cheap check that something is listening on the Compute port """
+        try:
+            connection = socket.create_connection(
+                (self.host_node.host, int(self.port)), timeout=timeout)
+        except (socket.error, ValueError):
+            return False
+        connection.close()
+        return True
+
+    def _wait_up(self, launch_log=None, timeout=360, min_wait_period=0.1,
+                 max_wait_period=3):
+        """
+        Wait until Compute answers /version. Each try first checks that the
+        port accepts connections, and only then asks for the version. The
+        wait between tries starts short and backs off.
 
-    def _wait_up(self):
-        wait_period = 3
+        :param launch_log: LaunchLog of a local launch, to fail as soon as
+                           the launch shows a fatal error
+        :param timeout: seconds before giving up
+        """
 
-        print("\n....... Wait till framework has started (try every {} "
-              "seconds),   at = {}".format(str(wait_period), self.base_url()))
+        print("\n....... Wait till framework has started (try every {}-{} "
+              "seconds),   at = {}".format(str(min_wait_period),
+                                          str(max_wait_period),
+                                          self.base_url()))
 
+        start = time.time()
+        wait_period = min_wait_period
         i = 0
         while True:
             i += 1
-            if i > 120:
-                raise Exception("Error: could not start framework.")
 
-            version = self.version(True)
+            if launch_log is not None:
+                error = launch_log.fatal_error()
+                if error is not None:
+                    raise Exception("Error: could not start framework, " +
+                                    error)
 
-            if version is None:
+            version = None
+            if self._port_open():
+                version = self.version(True)
+            if version is not None:
+                break
+
+            elapsed = time.time() - start
+            if elapsed > timeout:
+                raise Exception("Error: could not start framework.")
+
+            if i % 10 == 0:
                 # utils.restart_line()
                 # add comma at the end to remove newline
-                print("Try = [%d / 120]" % i)
-                time.sleep(wait_period)
+                print("Try = [%d], %.0f / %d s" % (i, elapsed, timeout))
+
+            time.sleep(wait_period)
+            if launch_log is not None and launch_log.started:
+                # the log says the server is up, it should answer shortly
+                wait_period = min_wait_period
             else:
-                break
+                wait_period = min(wait_period * 1.5, max_wait_period)
 
-        print("\n  - framework is up, running version: " + version)
+        print("\n  - framework is up, running version: " + version +
+              " (after %.1f s)" % (time.time() - start))
 
     def terminate(self):
         print("\n...... Terminate framework")
-        response = requests.get(self.base_url() + '/stop')
+        response = self.session().get('/stop')
 
         logging.debug("Response text = " + response.text)
 
@@ -324,16 +952,145 @@ class Compute:
         'entity_name' is the fully qualified name WITH the prefix
         """
 
-        payload = {'entity': entity_name, 'path': param_path, 'value': value}
-        response = requests.post(self.base_url() + '/config', params=payload)
+        if self.config_cache is not None and self.config_cache.is_current(
+                entity_name, param_path, value):
+            logging.debug("set_parameter_db: %s.%s is already %s",
+                          entity_name, param_path, value)
+            return
 
-        if response.status_code == 400:
-            raise Exception(response.text)
+        error = self._set_parameter_db(entity_name, param_path, value)
+        if error is not None:
+            raise Exception(error)
+
+    def _set_parameter_db(self, entity_name, param_path, value):
+        """ Set one parameter, return the error message if it failed """
+
+        error = self._post_parameter_db(entity_name, param_path, value)
+
+        if self.config_cache is not None:
+            if error is None:
+                self.config_cache.set(entity_name, param_path, value)
+            else:
+                self.config_cache.invalidate(entity_name, param_path)
+
+        return error
+
+    def _post_parameter_db(self, entity_name, param_path, value):
+        payload = {'entity': entity_name, 'path': param_path, 'value': value}
+        try:
+            response = self.session().post('/config', params=payload)
+        except requests.exceptions.RequestException as e:
+            return str(e)
 
         logging.debug("set_parameter_db: entity_name = " + entity_name +
-                      ", param_path = " + param_path + ', value = ' + value)
+                      ", param_path = " + param_path +
+                      ', value = ' + str(value))
         logging.debug("response = " + response.text)
 
+        if response.status_code == 400:
+            return response.text
+
+        return None
+
+    def set_parameters_db(self, updates):
+        """
+        Set many parameters in the DB, e.g. all the parameters for one run.
+        If the node advertises 'config-batch', they are sent as one request,
+        otherwise as /config requests. Compute updates an entity's config by
+        read-modify-write, so the updates of one entity are sent one after
+        the other, in order, and different entities concurrently (at most
+        self.config_workers at a time).
+
+        Failures don't stop the other updates from being sent. Updates to
+        values that the config cache knows are set already are skipped.
+
+        :param updates: list of (entity_name, param_path, value), with
+                        fully qualified entity names (WITH the prefix)
+        :return: list of (entity_name, param_path, value, error message)
+                 for the updates that failed, empty if all succeeded
+        """
+
+        updates = list(updates)
+
+        if self.config_cache is not None:
+            num_updates = len(updates)
+            updates = [update for update in updates
+                       if not self.config_cache.is_current(*update)]
+            if len(updates) < num_updates:
+                print("        %d of %d parameters already set, skipped" %
+                      (num_updates - len(updates), num_updates))
+
+        if len(updates) == 0:
+            return []
+
+        if 'config-batch' in self.capabilities():
+            errors = self._set_parameters_db_batch(updates)
+        else:
+            by_entity = []
+            entity_updates = {}
+            for update in updates:
+                if update[0] not in entity_updates:
+                    entity_updates[update[0]] = []
+                    by_entity.append(entity_updates[update[0]])
+                entity_updates[update[0]].append(update)
+
+            def set_entity_parameters(updates_of_entity):
+                entity_errors = []
+                for update in updates_of_entity:
+                    error = self._set_parameter_db(*update)
+                    if error is not None:
+                        entity_errors.append(update + (error,))
+                return entity_errors
+
+            num_workers = max(min(self.config_workers, len(by_entity)), 1)
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                results = list(executor.map(
+                    metrics.propagate(set_entity_parameters), by_entity))
+            errors = [error for entity_errors in results
+                      for error in entity_errors]
+
+        for error in errors:
+            logging.error("Could not set %s.%s = %s: %s", *error)
+
+        return errors
+
+    def _set_parameters_db_batch(self, updates):
+        """
+        Send all updates as a json list in the body of one POST to /config.
+        On failure the node replies 400, with a json list of
+        {'index': i, 'error': message} for the updates that failed.
+        """
+
+        body = [{'entity': entity_name, 'path': param_path, 'value': value}
+                for entity_name, param_path, value in updates]
+        try:
+            response = self.session().post('/config', json=body)
+        except requests.exceptions.RequestException as e:
+            return [update + (str(e),) for update in updates]
+
+        logging.debug("set_parameters_db: batch of %d, response = %s",
+                      len(updates), response.text)
+
+        if response.status_code != 400:
+            errors = []
+        else:
+            try:
+                errors = [updates[item['index']] + (item['error'],)
+                          for item in response.json()]
+            except (ValueError, KeyError, IndexError, TypeError):
+                # not a per-update report, so blame the whole batch
+                errors = [update + (response.text,) for update in updates]
+
+        if self.config_cache is not None:
+            failed = set(error[:2] for error in errors)
+            for entity_name, param_path, value in updates:
+                if (entity_name, param_path) in failed:
+                    self.config_cache.invalidate(entity_name, param_path)
+                else:
+                    self.config_cache.set(entity_name, param_path, value)
+
+        return errors
+
     @staticmethod
     def set_parameter_inputfile(entity_filepath, entity_name, param_path,
                                 value):
@@ -345,55 +1102,15 @@ class Compute:
         :param entity_name: the fully qualified entity name, WITH Prefix
         :param param_path: set parameter at this path
         :param value:
-        :return:
+        :return: description of the parameter set
         """
 
-        set_param = entity_name + "." + param_path + " = " + str(value)
-
         logging.debug("in file: " + entity_filepath)
 
-        # open the entity input file
-        with open(entity_filepath) as data_file:
-            data = json.load(data_file)
-
-        # get the first element in the array with dictionary field
-        # "entity-name" = entity_name
-        entity = dict()
-        for entity_i in data:
-            if not entity_i["name"] == entity_name:
-                continue
-            entity = entity_i
-            break
-
-        if not entity:
-            msg = "\nERROR: Could not find an entity in the input file " \
-                  "matching the entity name specified in the " \
-                  "experiment file in field 'file-entities'.\n"
-            msg += "\tEntity input file: " + entity_filepath + "\n"
-            msg += "\tEntity name: " + entity_name
-            raise Exception(msg)
-
-        config = utils.get_entityfile_config(entity)
-
-        logging.debug("config(t)   = " + json.dumps(config, indent=4))
-
-        changed = dpath.util.set(config, param_path, value, '.')
-
-        if changed == 0:
-            msg = "\nERROR: Could not set the config in entity at param " \
-                  "path.\n"
-            msg += "\tEntity = " + entity_name + "\n"
-            msg += "\tParam_path = " + param_path
-            raise Exception(msg)
-
-        logging.debug("config(t+1) = " + json.dumps(config, indent=4))
-
-        utils.set_entityfile_config(entity, config)
-
-        # write back to file
-        with open(entity_filepath, 'w') as data_file:
-            data_file.write(json.dumps(data, indent=4))
-
+        entity_document = EntityDocument.from_file(entity_filepath)
+        set_param = entity_document.set_parameter(entity_name, param_path,
+                                                  value)
+        entity_document.write()
         return set_param
 
     def version(self, is_suppress_console_output=False):
@@ -404,12 +1121,15 @@ class Compute:
 
         version = None
         try:
-            response = requests.get(self.base_url() + '/version')
+            response = self.session().get('/version',
+                                          probe=is_suppress_console_output,
+                                          fast=True)
             logging.debug("response = " + response.text)
 
             response_json = response.json()
             if 'version' in response_json:
                 version = response_json['version']
+            self._capabilities = set(response_json.get('capabilities', []))
 
         except requests.ConnectionError:
             version = None
@@ -420,6 +1140,31 @@ class Compute:
 
         return version
 
+    def healthy(self):
+        """
+        Health check of the node: True if it answers /version in time, and
+        its circuit breaker is not open (a check can close a breaker that
+        is due to be tried again).
+        """
+        try:
+            response = self.session().get('/version', probe=True, fast=True,
+                                          timeout=self.HEALTH_TIMEOUT)
+        except requests.exceptions.RequestException:
+            return False
+
+        return response.status_code < 400 and (
+            not self.session().breaker.is_open())
+
+    def capabilities(self):
+        """
+        The optional features that the node advertises in the 'capabilities'
+        list of its /version response (e.g. 'long-poll'). Nodes that don't
+        advertise any, or can't be reached, have none.
+        """
+        if self._capabilities is None:
+            self.version(True)
+        return self._capabilities or set()
+
     def launch(self, experiment, cloud=None, use_ecs=False, ecs_task_name=None,
                main_class=None, no_local_docker=False):
         """
@@ -446,7 +1191,15 @@ class Compute:
 
         print("\n....... Launch Compute")
 
+        # a new process may be a different version of Compute, and starts
+        # without any of the entities of the previous one
+        self._capabilities = None
+        if self.config_cache is not None:
+            self.config_cache.clear()
+        self.session().breaker.reset()
+
         task_arn = None
+        launch_log = None
         if cloud and self.remote():
             if use_ecs:
                 # Using ECS - the elastic container service
@@ -488,13 +1241,16 @@ class Compute:
 
             # we can't hold on to the stdout and stderr streams for logging,
             # because it will hang on this line instead, logging to a file
-            subprocess.Popen("%s > run_stdout.log 2> run_stderr.log" % cmd,
-                             shell=True, executable="/bin/bash")
-
-        # TODO: fail if there are hard errors?
+            log_filepaths = ['run_stdout.log', 'run_stderr.log']
+            LaunchLog.remove_logs(log_filepaths)
+            process = subprocess.Popen(
+                "%s > run_stdout.log 2> run_stderr.log" % cmd,
+                shell=True, executable="/bin/bash")
+            launch_log = LaunchLog(process, log_filepaths)
 
-        self._wait_up()
+        self._wait_up(launch_log)
 
+        self.task_arn = task_arn
         return task_arn
 
     def shutdown_compute(self, cloud, args, task_arn):
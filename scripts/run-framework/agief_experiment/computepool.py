@@ -0,0 +1,182 @@
+import logging
+from collections import deque
+from concurrent.futures import (ThreadPoolExecutor, Future, wait,
+                                FIRST_COMPLETED)
+
+from agief_experiment.runstatus import RunStatus
+
+
+class ComputePool:
+    """
+        A set of Compute nodes that parameter sets are handed out to, as
+        nodes become idle. Each node takes up to Compute.slots runs at a
+        time (each under its own prefix). Each run happens on a thread of its
+        own, so a sweep runs on all nodes at once.
+
+        If a node fails during a run (RunStatus.node_failed, e.g. when its
+        circuit breaker trips), it is retired from the pool and the run is
+        requeued on one of the remaining nodes, as are the other runs that
+        were in progress on it. A standby node that passes a health check
+        (Compute.healthy()) takes the place of the retired node. The retired
+        node becomes a standby itself, in case it recovers. If nodes are
+        launched for each run, standbys are not up until then, and are not
+        checked.
+
+        The last node is never retired if there is no standby to take its
+        place: the run counts as failed, and the sweep goes on with the next
+        parameter set on the same node.
+    """
+
+    def __init__(self, computes, max_attempts=2, standbys=(),
+                 check_standbys=True):
+        """
+        :param computes: list of Compute objects, one per node
+        :param max_attempts: number of nodes a run is tried on before it is
+                             given up as failed
+        :param standbys: Compute objects that only take runs once a node has
+                         failed
+        :param check_standbys: False if each run launches its node
+                               (LaunchMode.per_experiment), so a standby can't
+                               be checked for health before it takes a run
+        """
+        self.standbys = list(standbys)
+        self.check_standbys = check_standbys
+        self.computes = list(computes) + self.standbys
+        self.max_attempts = max_attempts
+        self.alive = list(computes)
+
+    def __len__(self):
+        return len(self.computes)
+
+    def __iter__(self):
+        return iter(self.computes)
+
+    def run(self, jobs, run_job):
+        """
+        Run every job on a node of the pool.
+
+        :param jobs: iterable of jobs. It is consumed lazily, on the calling
+                     thread, one job each time a node becomes idle.
+        :param run_job: function(compute, job) that does the run and returns
+                        a RunStatus. Called on a worker thread.
+        :return: list of (job, RunStatus), in the order of 'jobs'
+        """
+
+        results = {}
+        retries = deque()
+        # one entry per free slot, the first slot of every node first
+        max_slots = max([compute.slots for compute in self.alive] or [1])
+        idle = [compute for slot in range(max_slots)
+                for compute in self.alive if slot < compute.slots]
+        in_flight = {}
+
+        jobs = iter(jobs)
+        num_jobs = 0
+        is_exhausted = False
+
+        # enough threads for standbys too (they are only started when used)
+        executor = ThreadPoolExecutor(max_workers=max(
+            sum(compute.slots for compute in self.computes), 1))
+        try:
+            while True:
+                # hand out retries first, then new jobs, to the idle nodes
+                while idle and (retries or not is_exhausted):
+                    if retries:
+                        index, job, attempt = retries.popleft()
+                    else:
+                        try:
+                            job = next(jobs)
+                        except StopIteration:
+                            is_exhausted = True
+                            break
+                        index, attempt = num_jobs, 1
+                        num_jobs += 1
+
+                    compute = idle.pop(0)
+                    if len(self.computes) == 1 and compute.slots == 1:
+                        # nothing to run alongside, so stay on this thread
+                        future = self._run_inline(run_job, compute, job)
+                    else:
+                        future = executor.submit(run_job, compute, job)
+                    in_flight[future] = (compute, index, job, attempt)
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    compute, index, job, attempt = in_flight.pop(future)
+
+                    try:
+                        status = future.result()
+                    except Exception as e:  # pylint: disable=W0703
+                        logging.error("Run failed on %s: %s",
+                                      compute.base_url(), e)
+                        status = RunStatus.failed
+
+                    if status is not RunStatus.node_failed:
+                        results[index] = (job, status)
+                        if compute in self.alive:
+                            idle.append(compute)
+                        continue
+
+                    if compute in self.alive:
+                        standby = self._take_standby()
+                        if standby is None and self.alive == [compute]:
+                            logging.error("Compute node %s failed, it is the "
+                                          "only node, so keep it for the "
+                                          "next parameter set.",
+                                          compute.base_url())
+                            results[index] = (job, RunStatus.failed)
+                            idle.append(compute)
+                            continue
+
+                        self.alive.remove(compute)
+                        idle = [c for c in idle if c is not compute]
+                        logging.error("Compute node %s failed, removed it "
+                                      "from the pool (%d left).",
+                                      compute.base_url(), len(self.alive))
+
+                        self.standbys.append(compute)
+                        if standby is not None:
+                            self.alive.append(standby)
+                            idle.extend([standby] * standby.slots)
+
+                    if attempt < self.max_attempts and self.alive:
+                        print("Requeue run that was in progress on " +
+                              compute.base_url())
+                        retries.append((index, job, attempt + 1))
+                    else:
+                        results[index] = (job, status)
+        finally:
+            executor.shutdown(wait=True)
+
+        for index, job, _ in retries:
+            results[index] = (job, RunStatus.node_failed)
+
+        if not is_exhausted:
+            logging.error("All Compute nodes have failed, the remaining "
+                          "parameter sets were not run.")
+
+        return [results[index] for index in sorted(results)]
+
+    def _take_standby(self):
+        """ The first healthy standby, taken off the list, or None """
+        for standby in list(self.standbys):
+            if not self.check_standbys or standby.healthy():
+                self.standbys.remove(standby)
+                print("Fail over to standby Compute node " +
+                      standby.base_url())
+                return standby
+            logging.warning("Standby Compute node %s is not healthy.",
+                            standby.base_url())
+        return None
+
+    @staticmethod
+    def _run_inline(run_job, compute, job):
+        future = Future()
+        try:
+            future.set_result(run_job(compute, job))
+        except Exception as e:  # pylint: disable=W0703
+            future.set_exception(e)
+        return future
@@ -0,0 +1,101 @@
+import json
+import numbers
+import threading
+
+import dpath.util
+import dpath.exceptions
+
+from agief_experiment import utils
+
+
+class ConfigCache:
+    """
+        Client side copy of the last known config of each entity on a Compute
+        node, so that parameters that already have the value to be set don't
+        need a round trip to /config.
+
+        Seeded from the imported entity files, refreshed whenever a config is
+        read from the node, and updated by every successful set. It only
+        has to be right about values that the node does not change by
+        itself, i.e. parameters, not state such as age.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._configs = {}
+
+    def seed_from_entity_file(self, entity_filepath):
+        """ Cache the configs of all entities in an imported entity file """
+        with open(entity_filepath) as entity_file:
+            entities = json.load(entity_file)
+
+        configs = {}
+        for entity in entities:
+            try:
+                configs[entity['name']] = utils.get_entityfile_config(entity)
+            except (KeyError, TypeError, ValueError):
+                # unknown config, so it will always be sent
+                continue
+
+        with self._lock:
+            self._configs.update(configs)
+
+    def refresh(self, entity_name, config):
+        """ The config of the entity, as just read from the node """
+        with self._lock:
+            self._configs[entity_name] = config
+
+    def set(self, entity_name, param_path, value):
+        with self._lock:
+            config = self._configs.get(entity_name)
+            if config is not None:
+                dpath.util.new(config, param_path, value, '.')
+
+    def invalidate(self, entity_name, param_path=None):
+        """ Forget the parameter, or the whole entity if no path is given """
+        with self._lock:
+            config = self._configs.get(entity_name)
+            if config is None:
+                return
+            if param_path is None:
+                del self._configs[entity_name]
+            else:
+                try:
+                    dpath.util.delete(config, param_path, '.')
+                except (KeyError, dpath.exceptions.PathNotFound):
+                    pass
+
+    def forget_prefix(self, prefix):
+        """ Forget all entities named with this prefix, e.g. once unloaded """
+        with self._lock:
+            for entity_name in list(self._configs):
+                if entity_name.startswith(prefix):
+                    del self._configs[entity_name]
+
+    def clear(self):
+        with self._lock:
+            self._configs.clear()
+
+    def is_current(self, entity_name, param_path, value):
+        """ True if the parameter is known to have this value already """
+        with self._lock:
+            config = self._configs.get(entity_name)
+            if config is None:
+                return False
+            try:
+                cached = dpath.util.get(config, param_path, '.')
+            except (KeyError, ValueError, TypeError):
+                return False
+
+        return self.same_value(cached, value)
+
+    @staticmethod
+    def same_value(cached, value):
+        # numbers may come back as int or float, but anything else has to be
+        # of the same type (e.g. "10" is sent as is, so is not the same as 10)
+        if isinstance(cached, bool) or isinstance(value, bool):
+            return type(cached) is type(value) and cached == value
+        if isinstance(cached, numbers.Number) and isinstance(
+                value, numbers.Number):
+            return cached == value
+        return type(cached) is type(value) and cached == value
@@ -0,0 +1,109 @@
+import os
+import glob
+import uuid
+import shutil
+import hashlib
+import logging
+
+from agief_experiment.jsonstream import JsonArraySplitter
+
+# chunks of 'data.json' are in a folder 'data-chunks-<key>' next to it
+CHUNKS_INFIX = '-chunks-'
+
+READ_SIZE = 1024 * 1024
+
+
+def chunk_folder(data_filepath, max_bytes):
+    """
+    The folder of the chunks of this version of the data file. The key
+    changes with the size and modification time of the file and the chunk
+    size, so that chunks are made again whenever either changes.
+    """
+    stat = os.stat(data_filepath)
+    key = hashlib.sha1(("%d:%r:%d" % (stat.st_size, stat.st_mtime,
+                                      max_bytes)).encode('utf-8'))
+    return (os.path.splitext(data_filepath)[0] + CHUNKS_INFIX +
+            key.hexdigest()[:12])
+
+
+def chunk_filepaths(data_filepath, max_bytes):
+    """
+    The data file split along the items of its json array, into chunks of
+    at most about 'max_bytes' each (an item larger than that is a chunk on
+    its own). The chunks are made on first use, and reused for as long as
+    the data file is unchanged.
+
+    :return: paths of the chunks, in order, or [data_filepath] if it is too
+             small to be split, or is not a json array
+    """
+    if max_bytes <= 0 or os.path.getsize(data_filepath) <= max_bytes:
+        return [data_filepath]
+
+    folder = chunk_folder(data_filepath, max_bytes)
+    if not os.path.isdir(folder):
+        try:
+            split(data_filepath, folder, max_bytes)
+        except ValueError as e:
+            logging.warning("Could not split %s into chunks, it is imported "
+                            "as it is: %s", data_filepath, e)
+            return [data_filepath]
+        remove_stale_chunks(data_filepath, folder)
+
+    return sorted(glob.glob(os.path.join(folder, '*.json')))
+
+
+def split(data_filepath, folder, max_bytes):
+    """
+    Stream the json array in the data file into chunk files in 'folder'.
+    The chunks are written to a temporary folder that is then renamed, so
+    'folder' only ever exists complete.
+    """
+    name = os.path.splitext(os.path.basename(data_filepath))[0]
+    part_folder = folder + '.' + uuid.uuid4().hex + '.part'
+    os.makedirs(part_folder)
+
+    chunks = []
+    items = []
+    items_size = [0]
+
+    def write_chunk():
+        filepath = os.path.join(part_folder, "%s-%04d.json" %
+                                (name, len(chunks)))
+        with open(filepath, 'wb') as chunk_file:
+            chunk_file.write(b'[' + b','.join(items) + b']')
+        chunks.append(filepath)
+        del items[:]
+        items_size[0] = 0
+
+    try:
+        splitter = JsonArraySplitter()
+        with open(data_filepath, 'rb') as data_file:
+            for block in iter(lambda: data_file.read(READ_SIZE), b''):
+                for item in splitter.feed(block):
+                    if items and items_size[0] + len(item) + 1 > max_bytes:
+                        write_chunk()
+                    items.append(item)
+                    items_size[0] += len(item) + 1
+        splitter.finish()
+        if items or not chunks:
+            write_chunk()
+
+        try:
+            os.rename(part_folder, folder)
+        except OSError:
+            # split at the same time elsewhere, keep the one already there
+            if not os.path.isdir(folder):
+                raise
+    finally:
+        shutil.rmtree(part_folder, ignore_errors=True)
+
+    logging.info("Split %s into %d chunks of at most %d bytes in %s",
+                 data_filepath, len(chunks), max_bytes, folder)
+
+
+def remove_stale_chunks(data_filepath, current_folder):
+    """ Remove the chunks of previous versions of the data file """
+    pattern = os.path.splitext(data_filepath)[0] + CHUNKS_INFIX + '*'
+    for folder in glob.glob(pattern):
+        if folder != current_folder and not folder.endswith('.part'):
+            shutil.rmtree(folder, ignore_errors=True)
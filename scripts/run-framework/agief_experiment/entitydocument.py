@@ -0,0 +1,161 @@
+import os
+import json
+import uuid
+import logging
+
+import dpath.util
+
+from agief_experiment import utils
+
+
+class EntityDocument:
+    """
+        An entity input file, held in memory while the input files of a
+        parameter set are made: the swept parameters are recorded, then set
+        in the entities' configs and the prefix substituted in the text when
+        the file is written, once.
+
+        The json is only parsed if a parameter is set, and each entity's
+        config is decoded once, however many of its parameters are set. If
+        the document has a GeneratedInputs cache, and the same parameters
+        have been set in the same base file before, the file is made from
+        the cache instead.
+    """
+
+    def __init__(self, text, filepath, template_prefix=None, prefix=None,
+                 is_new=True, source_filepath=None, generated_inputs=None):
+        """
+        :param text: the json text of the entity file, with the template
+                     prefix in it
+        :param filepath: where the document is written
+        :param template_prefix: replaced by 'prefix' when it is written
+        :param is_new: False if it is already at 'filepath' as it is
+        :param source_filepath: the base file that 'text' is read from
+        :param generated_inputs: GeneratedInputs to make the file from
+        """
+        self.filepath = filepath
+        self.template_prefix = template_prefix
+        self.prefix = prefix
+        self.source_filepath = source_filepath
+        self.generated_inputs = generated_inputs
+        self._text = text
+        self._needs_write = is_new
+
+        # (entity_name, param_path, value), in the order they were set
+        self.parameters = []
+
+    @classmethod
+    def from_file(cls, filepath, template_prefix=None, prefix=None,
+                  dest_filepath=None, generated_inputs=None):
+        """
+        :param template_prefix: replaced by 'prefix', if given
+        :param dest_filepath: where the document is written, by default
+                              back to 'filepath'
+        """
+        with open(filepath) as entity_file:
+            text = entity_file.read()
+
+        return cls(text, filepath if dest_filepath is None else dest_filepath,
+                   template_prefix, prefix,
+                   is_new=(dest_filepath is not None or prefix is not None),
+                   source_filepath=filepath,
+                   generated_inputs=generated_inputs)
+
+    def _with_prefix(self, text):
+        if self.prefix is None:
+            return text
+        return text.replace(self.template_prefix, self.prefix)
+
+    def set_parameter(self, entity_name, param_path, value):
+        """
+        Set the parameter at 'param_path' in the config of the entity, when
+        the document is written (see template_text for the errors).
+
+        :param entity_name: the fully qualified entity name, WITH Prefix
+        :return: description of the parameter set, 'name.path = value'
+        """
+        self.parameters.append((entity_name, param_path, value))
+        self._needs_write = True
+        return entity_name + "." + param_path + " = " + str(value)
+
+    def template_parameters(self):
+        """ The parameters, with the template prefix in the entity names """
+        if self.prefix is None:
+            return list(self.parameters)
+        return [(entity_name.replace(self.prefix, self.template_prefix),
+                 param_path, value)
+                for entity_name, param_path, value in self.parameters]
+
+    def template_text(self):
+        """
+        The json text with the parameters set, before the template prefix is
+        replaced.
+
+        :raises Exception: if an entity or parameter path is not found
+        """
+        if not self.parameters:
+            return self._text
+
+        entities = json.loads(self._text)
+        index = {}
+        for entity in entities:
+            # the first entity of a name, as set_parameter_inputfile did
+            index.setdefault(self._with_prefix(entity["name"]), entity)
+
+        configs = {}
+        for entity_name, param_path, value in self.parameters:
+            entity = index.get(entity_name)
+            if entity is None:
+                msg = "\nERROR: Could not find an entity in the input file " \
+                      "matching the entity name specified in the " \
+                      "experiment file in field 'file-entities'.\n"
+                msg += "\tEntity input file: " + self.filepath + "\n"
+                msg += "\tEntity name: " + entity_name
+                raise Exception(msg)
+
+            config = configs.get(entity_name)
+            if config is None:
+                config = utils.get_entityfile_config(entity)
+                configs[entity_name] = config
+
+            changed = dpath.util.set(config, param_path, value, '.')
+
+            if changed == 0:
+                msg = "\nERROR: Could not set the config in entity at " \
+                      "param path.\n"
+                msg += "\tEntity = " + entity_name + "\n"
+                msg += "\tParam_path = " + param_path
+                raise Exception(msg)
+
+        for entity_name, config in configs.items():
+            utils.set_entityfile_config(index[entity_name], config)
+
+        return json.dumps(entities, indent=4)
+
+    def text(self):
+        """ The json text of the document, as it is written """
+        return self._with_prefix(self.template_text())
+
+    def write(self):
+        """ Write the document to its file, unless it is there already """
+        if not self._needs_write:
+            return self.filepath
+
+        if self.generated_inputs is not None and self.prefix is not None:
+            self.generated_inputs.place(
+                self.filepath, self.source_filepath, self.template_prefix,
+                self.prefix, self.template_parameters(),
+                lambda entity_file: entity_file.write(
+                    self.template_text().encode('utf-8')))
+        else:
+            text = self.text()
+            # replaced rather than truncated, in case it is a hard link
+            utils.create_folder(self.filepath)
+            part_filepath = self.filepath + '.' + uuid.uuid4().hex + '.part'
+            with open(part_filepath, 'w') as entity_file:
+                entity_file.write(text)
+            os.rename(part_filepath, self.filepath)
+        self._needs_write = False
+
+        logging.debug("Wrote entity file %s", self.filepath)
+        return self.filepath
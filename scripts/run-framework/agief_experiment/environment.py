@@ -0,0 +1,114 @@
+import os
+import logging
+import threading
+import subprocess
+
+from agief_experiment import utils
+
+
+class VariablesResolver:
+    """
+        The variables of a variables file (e.g. variables.sh, see
+        VARIABLES_FILE), and paths built from them.
+
+        The file is sourced once, by a single bash process, and all the
+        variables it sets are kept. They are sourced again only when the
+        file's modification time changes. Paths are memoised, as the same
+        few are looked up for every parameter set.
+    """
+
+    def __init__(self, variables_filepath):
+        self.variables_filepath = variables_filepath
+
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._variables = None
+        self._paths = {}
+
+        # number of times the file was sourced, and of path lookups
+        self.loads = 0
+        self.lookups = 0
+
+    def _load(self):
+        """ Source the file, and return all the variables it leaves set """
+
+        # 'set -a' exports the variables that the file sets without
+        # 'export', as 'source ... && echo $VAR' would also see those
+        cmd = "set -a && source " + self.variables_filepath + " && env -0"
+        output, error = subprocess.Popen(cmd,
+                                         shell=True,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE,
+                                         executable="/bin/bash").communicate()
+        if error:
+            logging.debug("Sourcing %s: %s", self.variables_filepath, error)
+
+        if isinstance(output, bytes):
+            output = output.decode('utf-8')
+
+        variables = {}
+        for entry in output.split('\0'):
+            name, separator, value = entry.partition('=')
+            if separator:
+                variables[name] = value
+        return variables
+
+    def _current_variables(self):
+        """ The variables, sourcing the file again if it has changed """
+        try:
+            mtime = os.stat(self.variables_filepath).st_mtime
+        except OSError:
+            mtime = None
+
+        if self._variables is None or mtime != self._mtime:
+            self._variables = self._load()
+            self._mtime = mtime
+            self._paths = {}
+            self.loads += 1
+        return self._variables
+
+    def variables(self):
+        with self._lock:
+            return dict(self._current_variables())
+
+    def value(self, expression):
+        """
+        The value of '$' + expression in a shell that sourced the file, e.g.
+        'AGI_HOME' or 'AGI_HOME/bin/'
+        """
+        with self._lock:
+            return utils.expand_variable(expression,
+                                         self._current_variables())
+
+    def path(self, filename, path_env):
+        """ Full path of 'filename' in the folder variable 'path_env' """
+        with self._lock:
+            self.lookups += 1
+            variables = self._current_variables()
+
+            key = (filename, path_env)
+            file_path = self._paths.get(key)
+            if file_path is None:
+                file_path = utils.cleanpath(
+                    utils.expand_variable(path_env, variables), filename)
+                self._paths[key] = file_path
+            return file_path
+
+
+_resolvers = {}
+_resolvers_lock = threading.Lock()
+
+
+def resolver_for(variables_filepath):
+    """ The VariablesResolver shared by all users of the variables file """
+    with _resolvers_lock:
+        resolver = _resolvers.get(variables_filepath)
+        if resolver is None:
+            resolver = VariablesResolver(variables_filepath)
+            _resolvers[variables_filepath] = resolver
+    return resolver
+
+
+def all_resolvers():
+    with _resolvers_lock:
+        return list(_resolvers.values())
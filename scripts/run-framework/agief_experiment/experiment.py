@@ -1,16 +1,21 @@
 import datetime
-import functools
 import json
 import os
 import logging
 import time
+import threading
 
 
 import dpath
 
-from agief_experiment.valueseries import ValueSeries
 from agief_experiment.experimentutils import ExperimentUtils
+from agief_experiment.generatedinputs import GeneratedInputs
 from agief_experiment.launchmode import LaunchMode
+from agief_experiment.runstatus import RunStatus
+from agief_experiment.progress import ComputeStalled
+from agief_experiment import datachunks
+from agief_experiment import exportshards
+from agief_experiment import metrics
 from agief_experiment import utils
 
 
@@ -33,21 +38,44 @@ class Experiment:
 
     LOG_FILENAME = "log4j2.log"
     PREFIXES_FILENAME = "prefixes.txt"
+    PROGRESS_FILENAME = "progress.csv"
+    METRICS_FILENAME = "compute-metrics.json"
+
+    # (connect, read) timeout of the export of a stalled run, the node may
+    # not answer at all
+    STALLED_EXPORT_TIMEOUT = (10, 120)
 
     def __init__(self, debug_no_run, launch_mode, exps_file, no_compress,
-                 csv_output):
+                 csv_output, data_chunk_size=0,
+                 generated_inputs_max_size=GeneratedInputs.DEFAULT_MAX_SIZE):
+        """
+        :param data_chunk_size: base data files larger than this (in bytes)
+                                are split into chunks of about this size,
+                                which are imported as separate data files.
+                                0 to import them whole.
+        :param generated_inputs_max_size: bytes the cache of generated input
+                                          files is kept to, see
+                                          GeneratedInputs
+        """
         self.exps_file = exps_file
         self.debug_no_run = debug_no_run
         self.launch_mode = launch_mode
         self.no_compress = no_compress
         self.csv_output = csv_output
+        self.data_chunk_size = data_chunk_size
 
-        self.experiment_utils = ExperimentUtils(exps_file)
+        self.experiment_utils = ExperimentUtils(exps_file,
+                                                generated_inputs_max_size)
 
         self.prefix_base = self.TEMPLATE_PREFIX
         self.prefixes_history = ""
         self.prefix_modifier = ""
 
+        # prefix of the run in progress on the current thread, see
+        # bind_prefix(), used when several runs are in progress at once
+        self._run = threading.local()
+        self._history_lock = threading.Lock()
+
     def reset_prefix(self):
 
         print("-------------- RESET_PREFIX -------------")
@@ -76,10 +104,22 @@ class Experiment:
                 self.prefix_modifier += "i"
 
     def prefix(self):
+        bound_prefix = getattr(self._run, 'prefix', None)
+        if bound_prefix is not None:
+            return bound_prefix
         return self.prefix_base + self.prefix_modifier
 
+    def bind_prefix(self, prefix):
+        """
+        Use 'prefix' as the prefix on the current thread, until bound to
+        None. The runs of a ComputePool are in progress at the same time,
+        each on its own thread, while the next prefixes are generated.
+        """
+        self._run.prefix = prefix
+
     def remember_prefix(self):
-        self.prefixes_history += self.prefix() + "\n"
+        with self._history_lock:
+            self.prefixes_history += self.prefix() + "\n"
 
     def persist_prefix_history(self, cloud, filename=PREFIXES_FILENAME):
         """ Save prefix history to a file """
@@ -94,7 +134,7 @@ class Experiment:
                                     self.PREFIXES_FILENAME,
                                     filename)
 
-    def info(self, sweep_param_vals):
+    def info(self, sweep_param_vals, compute_node=None):
 
         message = ""
         message += "==============================================\n"
@@ -109,6 +149,8 @@ class Experiment:
         message += ("Variables file: " +
                     self.experiment_utils.variables_filepath() + "\n")
         message += "Prefix: " + self.prefix() + "\n"
+        if compute_node is not None:
+            message += "Compute: " + compute_node.base_url() + "\n"
         message += "==============================================\n"
 
         if sweep_param_vals:
@@ -174,7 +216,7 @@ class Experiment:
 
     def run_parameterset(self, compute_node, cloud, args, entity_filepath,
                          data_filepaths, compute_data_filepaths,
-                         sweep_param_vals=''):
+                         sweep_param_vals='', data_sources=None):
         """
         Import input files
         Run Experiment and Export experiment
@@ -190,13 +232,15 @@ class Experiment:
         :param compute_data_filepaths: data files on the compute machine,
                                        relative to run folder
         :param sweep_param_vals:
-        :return:
+        :param data_sources: substitution.SubstitutedFile by data filepath,
+                             of the data files made as they are uploaded
+        :return: RunStatus of the run
         """
 
         print("........ Run parameter set.")
 
         # print and save experiment info
-        info = self.info(sweep_param_vals)
+        info = self.info(sweep_param_vals, compute_node)
         print(info)
 
         info_filepath = self.experiment_utils.outputfile(
@@ -207,10 +251,18 @@ class Experiment:
             data.write(info)
 
         failed = False
+        node_failed = False
+        stalled = False
         task_arn = None
+        # None until Compute is launched for this run, then whether it was
+        is_launched = None
         try:
+            data_sources = data_sources or {}
             is_valid = utils.check_validity([entity_filepath]) and (
-                            utils.check_validity(data_filepaths))
+                            utils.check_validity(
+                                [data_sources[filepath].source_filepath
+                                 if filepath in data_sources else filepath
+                                 for filepath in data_filepaths]))
 
             if not is_valid:
                 msg = "ERROR: One of the input files are not valid:\n"
@@ -220,11 +272,14 @@ class Experiment:
 
             if (self.launch_mode is LaunchMode.per_experiment) and (
                     args.launch_compute):
+                is_launched = False
                 task_arn = compute_node.launch(self,
                                                cloud=cloud,
                                                no_local_docker=args.no_docker)
+                is_launched = True
 
-            compute_node.import_experiment(entity_filepath, data_filepaths)
+            compute_node.import_experiment(entity_filepath, data_filepaths,
+                                           data_sources)
             compute_node.import_compute_experiment(compute_data_filepaths,
                                                    is_data=True)
 
@@ -238,6 +293,7 @@ class Experiment:
                 self.append_runtime(compute_node.runtime)
                 print("Parameter Sweeps finished in %d days, %d hr, %d min, "
                       "%d s" % tuple(compute_node.runtime))
+                self.write_progress(compute_node)
 
             self.remember_prefix()
 
@@ -264,50 +320,189 @@ class Experiment:
                     self.experiment_utils.outputfile_remote(self.prefix()),
                     True
                 )
+        except ComputeStalled as e:
+            failed = True
+            stalled = True
+            logging.error(e)
+            self.export_stalled(compute_node, entity_filepath, data_filepaths)
         except Exception as e:
             failed = True
             logging.error("Experiment failed for some reason, shut down " +
                           "Compute and continue.")
             logging.error(e)
 
+            # was it the run, or the node that failed? (a node whose circuit
+            # breaker has tripped counts as failed). A node that is launched
+            # for every run is launched afresh for the next one anyway, it
+            # has only failed if it could not be launched.
+            if (self.launch_mode is LaunchMode.per_experiment) and (
+                    args.launch_compute):
+                node_failed = is_launched is False
+            else:
+                node_failed = not compute_node.healthy()
+
         if (self.launch_mode is LaunchMode.per_experiment) and (
                 args.launch_compute):
             compute_node.shutdown_compute(cloud, args, task_arn)
+        elif stalled:
+            node_failed = not self.clear_stalled(compute_node, cloud, args)
+        elif (self.launch_mode is LaunchMode.warm_reset) and (
+                args.launch_compute):
+            # a node that has been relaunched can take the next run
+            node_failed = not self.reset_compute(compute_node, cloud, args)
+
+        self.write_metrics()
 
         if not failed and args.upload:
             self.upload_results(cloud, compute_node, args.export_compute)
 
+        if node_failed:
+            return RunStatus.node_failed
+        if stalled:
+            return RunStatus.stalled
+        if failed:
+            return RunStatus.failed
+        return RunStatus.succeeded
+
+    def reset_compute(self, compute_node, cloud, args):
+        """
+        Clear the Compute node of the current run's entities and data, ready
+        for the next run (LaunchMode.warm_reset). If the node is unhealthy or
+        can't be cleared, relaunch it instead. A node that can't remove
+        entities at all (no 'delete' capability) is left as it is, as with
+        LaunchMode.per_session, rather than relaunched for every run.
+
+        :return: True if the node is ready for the next run
+        """
+
+        if compute_node.version(True) is not None:
+            if 'delete' not in compute_node.capabilities():
+                logging.warning("Compute can't unload entities, the run is "
+                                "left loaded (as with --launch_per_session).")
+                return True
+
+            if compute_node.unload_subtree(
+                    self.entity_with_prefix("experiment")):
+                return True
+
+            if compute_node.slots > 1:
+                # relaunching would end the other runs in progress on it
+                logging.warning("Could not clear the run from Compute, it "
+                                "is left loaded.")
+                return True
+
+        print("\n....... Relaunch Compute, it is unhealthy or could not be "
+              "cleared")
+        return self.relaunch_compute(compute_node, cloud, args)
+
+    def clear_stalled(self, compute_node, cloud, args):
+        """
+        Stop a stalled run before the next parameter set, as it would
+        otherwise go on alongside it: relaunch Compute (stall_action
+        'relaunch'), or unload the run ('skip', or if Compute can't be
+        relaunched). If the run can't be unloaded, Compute is relaunched
+        after all, where it can be.
+
+        :return: True if the node is ready for the next run
+        """
+
+        can_relaunch = args.launch_compute and compute_node.slots == 1
+        if args.stall_action == 'relaunch':
+            if can_relaunch:
+                return self.relaunch_compute(compute_node, cloud, args)
+            if not args.launch_compute:
+                logging.warning("Can't relaunch a Compute node that was not "
+                                "launched by run-framework, unloading the "
+                                "stalled run instead.")
+            else:
+                logging.warning("Not relaunching Compute, other runs are in "
+                                "progress on it, unloading the stalled run "
+                                "instead.")
+
+        if compute_node.unload_subtree(self.entity_with_prefix("experiment")):
+            return True
+
+        if can_relaunch:
+            print("\n....... Relaunch Compute, the stalled run could not be "
+                  "unloaded")
+            return self.relaunch_compute(compute_node, cloud, args)
+
+        logging.warning("The stalled run is left running on %s.",
+                        compute_node.base_url())
+        return True
+
+    def relaunch_compute(self, compute_node, cloud, args):
+        """
+        Shut down the Compute node (as far as it still responds) and launch
+        it again.
+
+        :return: True if the node is up again
+        """
+
+        try:
+            try:
+                compute_node.shutdown_compute(cloud, args,
+                                              compute_node.task_arn)
+            except Exception as e:  # pylint: disable=W0703
+                logging.warning("Could not shut down Compute: %s", e)
+
+            compute_node.launch(self, cloud=cloud,
+                                no_local_docker=args.no_docker)
+        except Exception as e:  # pylint: disable=W0703
+            logging.error("Could not relaunch Compute: %s", e)
+            return False
+
+        return True
+
+    def export_stalled(self, compute_node, entity_filepath, data_filepaths):
+        """
+        Export what there is of a stalled run, to look into why it stalled.
+        Written with the usual export names, to the run's output folder.
+        """
+
+        out_entity_file_path, out_data_file_path = (
+            self.experiment_utils.output_names_from_input_names(
+                self.prefix(),
+                entity_filepath,
+                data_filepaths)
+        )
+
+        try:
+            compute_node.export_subtree(
+                self.entity_with_prefix("experiment"),
+                out_entity_file_path,
+                out_data_file_path,
+                timeout=self.STALLED_EXPORT_TIMEOUT
+            )
+        except Exception as e:  # pylint: disable=W0703
+            logging.error("Could not export the stalled run: %s", e)
+
     @staticmethod
     def setup_parameter_sweepers(param_sweep):
         """
-        For each 'param' in a set, get details and setup counter
+        For each 'param' in a set (a list of SweepParameter), setup counter
         The result is an array of counters
         Each counter represents one parameter
         """
         val_sweepers = []
         # set of params for one 'sweep'
-        for param in param_sweep['parameter-set']:
-            if 'val-series' in param:
-                value_series = ValueSeries(param['val-series'])
-            else:
-                value_series = ValueSeries.from_range(minv=param['val-begin'],
-                                                      maxv=param['val-end'],
-                                                      deltav=param['val-inc'])
-            val_sweepers.append({'value-series': value_series,
-                                 'entity-name': param['entity-name'],
-                                 'param-path': param['parameter-path']})
+        for param in param_sweep:
+            val_sweepers.append({'value-series': param.value_series(),
+                                 'entity-name': param.entity_name,
+                                 'param-path': param.param_path})
         return val_sweepers
 
-    def inc_parameter_set(self, compute_node, args, entity_filepath,
+    def inc_parameter_set(self, compute_node, args, entity_document,
                           val_sweepers):
         """
         Iterate through counters, incrementing each parameter in the set
-        Set the new values in the input file, and then run the experiment
+        Set the new values in the entity document, and write it to the input
+        file, ready to run the experiment
         First counter to reset, return False
 
         :param compute_node:
         :param args:
-        :param entity_filepath:
+        :param entity_document: EntityDocument of the input file
         :param val_sweepers:
         :return: reset (True if any counter has reached above max),
                        description of parameters (string)
@@ -340,8 +535,7 @@ class Experiment:
                 reset = True
                 break
 
-            set_param = compute_node.set_parameter_inputfile(
-                            entity_filepath,
+            set_param = entity_document.set_parameter(
                             self.entity_with_prefix(
                                 val_sweeper['entity-name']
                             ),
@@ -364,129 +558,244 @@ class Experiment:
                           "conduct, reset should be True.")
             exit(1)
 
+        if not reset:
+            entity_document.write()
+
         return reset, sweep_param_vals
 
     def create_all_input_files(self, base_entity_filename,
-                               base_data_filenames):
+                               base_data_filenames, write_data=True):
+        """
+        :param write_data: False to make the data input files from the base
+                           files as they are uploaded, rather than writing
+                           a copy of them for each parameter set
+        :return: EntityDocument of the entity input file, which is written
+                 once the sweep parameters are set in it, the data input
+                 filepaths, and the SubstitutedFile of each data input file
+                 that is not written
+        """
         self.reset_prefix()
+        base_data_filenames = self.data_filenames_in_chunks(
+            base_data_filenames)
+        data_sources = None if write_data else {}
         return (
-            self.experiment_utils.create_input_files(
+            self.experiment_utils.create_entity_document(
                 self.prefix(),
                 self.TEMPLATE_PREFIX,
-                [base_entity_filename]
-            )[0],
+                base_entity_filename
+            ),
             self.experiment_utils.create_input_files(
                 self.prefix(),
                 self.TEMPLATE_PREFIX,
-                base_data_filenames
-            )
+                base_data_filenames,
+                data_sources
+            ),
+            data_sources or {}
         )
 
-    def run_sweeps(self, compute_node, cloud, args):
+    def data_filenames_in_chunks(self, base_data_filenames):
+        """
+        Replace each base data file larger than data_chunk_size by its
+        chunks (see datachunks), as filenames relative to the input folder.
+        Files are only split once, then the chunks are used for every
+        parameter set, each getting its own copy with its prefix.
+        """
+
+        if not self.data_chunk_size:
+            return base_data_filenames
+
+        input_folder = self.experiment_utils.inputfile_base('')
+
+        filenames = []
+        for base_data_filename in base_data_filenames:
+            base_filepath = self.experiment_utils.inputfile_base(
+                base_data_filename)
+
+            # output of previous runs is imported as it is, not copied
+            if not os.path.isfile(base_filepath) or (
+                    self.experiment_utils.is_output_file(base_filepath)):
+                filenames.append(base_data_filename)
+                continue
+
+            filenames.extend(
+                os.path.relpath(chunk_filepath, input_folder)
+                for chunk_filepath in datachunks.chunk_filepaths(
+                    base_filepath, self.data_chunk_size))
+        return filenames
+
+    def run_sweeps(self, compute_pool, cloud, args):
         """
         Perform parameter sweep steps, and run experiment for each step.
+        Each step is run on the next idle node of the ComputePool.
+
+        :return: list of (parameter set, RunStatus), in the order of the sweep
         """
 
         print("\n........ Run Sweeps")
 
-        exps_filename = self.experiment_utils.experiment_def_file()
-
-        if not os.path.exists(exps_filename):
-            msg = "Experiment file does not exist at: " + exps_filename
-            raise Exception(msg)
+        definition = self.experiment_utils.definition()
 
         # Silently remove older log file if exists
         log_filepath = self.experiment_utils.runpath(self.LOG_FILENAME)
-        if compute_node.remote():
-            utils.remote_run(compute_node.host_node, 'rm ' + log_filepath)
-        else:
-            utils.remove_file(log_filepath, True)
-
-        with open(exps_filename) as exps_file:
-            filedata = json.load(exps_file)
-
-        for exp_i in filedata['experiments']:
-            import_files = exp_i['import-files']  # import files dictionary
-
-            logging.debug("Import Files Dictionary = \n" +
-                          json.dumps(import_files, indent=4))
-
-            base_entity_filename = import_files['file-entities']
-            base_data_filenames = import_files['file-data']
-
-            exp_ll_data_filepaths = []
-            if 'load-local-files' in exp_i:
-                load_local_files = exp_i['load-local-files']
-                if 'file-data' in load_local_files:
-                    exp_ll_data_filepaths = list(
-                        map(self.experiment_utils.runpath,
-                            load_local_files['file-data'])
-                    )
-
-            run_parameterset_partial = (
-                functools.partial(
-                    self.run_parameterset,
-                    compute_node=compute_node,
-                    cloud=cloud,
-                    args=args,
-                    compute_data_filepaths=exp_ll_data_filepaths)
+        for compute_node in compute_pool:
+            if compute_node.remote():
+                utils.remote_run(compute_node.host_node, 'rm ' + log_filepath)
+            else:
+                utils.remove_file(log_filepath, True)
+
+        # steps/s of each successful run, by node
+        throughputs = {}
+        # requests to Compute of all runs, see metrics
+        session_metrics = metrics.RequestMetrics()
+
+        def run_job(compute_node, parameter_set):
+            self.bind_prefix(parameter_set['prefix'])
+            try:
+                with metrics.scope() as run_metrics:
+                    status = self.run_parameterset(
+                        compute_node, cloud, args,
+                        entity_filepath=parameter_set['entity-filepath'],
+                        data_filepaths=parameter_set['data-filepaths'],
+                        compute_data_filepaths=(
+                            parameter_set['compute-data-filepaths']),
+                        sweep_param_vals=parameter_set['sweep-param-vals'],
+                        data_sources=parameter_set['data-sources'])
+            finally:
+                self.bind_prefix(None)
+                session_metrics.merge(run_metrics)
+
+            rate = compute_node.progress.steps_per_second()
+            if status is RunStatus.succeeded and rate is not None:
+                throughputs.setdefault(compute_node.base_url(),
+                                       []).append(rate)
+            return status
+
+        results = compute_pool.run(
+            self.parameter_sets(compute_pool.computes[0], args, definition),
+            run_job)
+
+        failed = [parameter_set['prefix'] for parameter_set, status in results
+                  if status is not RunStatus.succeeded]
+        if failed:
+            logging.warning("%d of %d parameter sets failed, prefixes: %s",
+                            len(failed), len(results), ", ".join(failed))
+
+        for base_url in sorted(throughputs):
+            rates = throughputs[base_url]
+            print("Throughput of %s: %.2f steps/s (mean of %d runs)" %
+                  (base_url, sum(rates) / len(rates), len(rates)))
+
+        generated_inputs = self.experiment_utils.generated_inputs()
+        if generated_inputs.hits + generated_inputs.misses:
+            print("Generated input files: %d made from the cache, %d "
+                  "generated (%s)" % (generated_inputs.hits,
+                                      generated_inputs.misses,
+                                      generated_inputs.cache_dir))
+
+        self.write_session_metrics(session_metrics)
+
+        return results
+
+    def parameter_sets(self, compute_node, args, definition):
+        """
+        Generate the input files for each parameter set of the sweeps in the
+        experiments definition, one at a time, and yield a description of it.
+        """
+
+        def parameter_set(exp_entity_filepath, exp_data_filepaths,
+                          data_sources, compute_data_filepaths,
+                          sweep_param_vals=''):
+            return {'prefix': self.prefix(),
+                    'entity-filepath': exp_entity_filepath,
+                    'data-filepaths': exp_data_filepaths,
+                    'data-sources': data_sources,
+                    'compute-data-filepaths': compute_data_filepaths,
+                    'sweep-param-vals': sweep_param_vals}
+
+        # the input folder is only archived with the results (--step_upload),
+        # otherwise the data files are made as they are uploaded
+        write_data = args.upload
+
+        for exp_i in definition.experiments:
+            base_entity_filename = exp_i.import_files.entity_filename
+            base_data_filenames = exp_i.import_files.data_filenames
+
+            exp_ll_data_filepaths = list(
+                map(self.experiment_utils.runpath,
+                    exp_i.load_local_data_filenames)
             )
 
-            if 'parameter-sweeps' not in exp_i or (
-                    len(exp_i['parameter-sweeps']) == 0):
+            if len(exp_i.parameter_sweeps) == 0:
                 print("No parameters to sweep, just run once.")
-                exp_entity_filepath, exp_data_filepaths = (
+                entity_document, exp_data_filepaths, data_sources = (
                     self.create_all_input_files(base_entity_filename,
-                                                base_data_filenames)
+                                                base_data_filenames,
+                                                write_data)
                 )
-                run_parameterset_partial(entity_filepath=exp_entity_filepath,
-                                         data_filepaths=exp_data_filepaths)
+                yield parameter_set(entity_document.write(),
+                                    exp_data_filepaths, data_sources,
+                                    exp_ll_data_filepaths)
             else:
                 # array of sweep definitions
-                for param_sweep in exp_i['parameter-sweeps']:
+                for param_sweep in exp_i.parameter_sweeps:
                     counters = self.setup_parameter_sweepers(param_sweep)
                     while True:
-                        exp_entity_filepath, exp_data_filepaths = (
+                        entity_document, exp_data_filepaths, data_sources = (
                             self.create_all_input_files(
                                 base_entity_filename,
-                                base_data_filenames)
+                                base_data_filenames,
+                                write_data)
                         )
                         reset, sweep_param_vals = self.inc_parameter_set(
                             compute_node, args,
-                            exp_entity_filepath,
+                            entity_document,
                             counters
                         )
                         if reset:
                             break
-                        run_parameterset_partial(
-                            entity_filepath=exp_entity_filepath,
-                            data_filepaths=exp_data_filepaths,
-                            sweep_param_vals=sweep_param_vals
-                        )
+                        yield parameter_set(entity_document.filepath,
+                                            exp_data_filepaths, data_sources,
+                                            exp_ll_data_filepaths,
+                                            sweep_param_vals)
+
+    @staticmethod
+    def apply_parameters(compute_node, updates):
+        """
+        Set all the (entity_name, param_path, value) updates on the Compute
+        node. All updates are attempted, then if any failed, raise with the
+        full list of failures.
+        """
+
+        errors = compute_node.set_parameters_db(updates)
+
+        if errors:
+            msg = "ERROR: Could not set " + str(len(errors)) + " of " + \
+                  str(len(updates)) + " parameters:"
+            for entity_name, param_path, value, error in errors:
+                msg += "\n\t" + entity_name + "." + param_path + " = " + \
+                       str(value) + ": " + error
+            raise Exception(msg)
 
     def set_entity_params(self, compute_node):
         print("\n....... Set Entity Parameters")
 
-        with open(self.experiment_utils.experiment_def_file()) as (
-                data_exps_file):
-            data = json.load(data_exps_file)
-
-        for exp_i in data['experiments']:
-            for param in exp_i['entity-parameters']:
-                entity_name = param['entity-name']
-                param_path = param['parameter-path']
-                value = param['value']
+        updates = []
+        for exp_i in self.experiment_utils.definition().experiments:
+            for param in exp_i.entity_parameters:
+                entity_name = param.entity_name
+                param_path = param.param_path
+                value = param.value
 
                 if utils.is_valid_filename(value):
                     value = value.replace(self.TEMPLATE_OUTPUT_PREFIX,
                                           self.prefix())
                     value = self.experiment_utils.runpath(value)
 
-                compute_node.set_parameter_db(
-                    self.entity_with_prefix(entity_name),
-                    param_path,
-                    value
-                )
+                updates.append((self.entity_with_prefix(entity_name),
+                                param_path,
+                                value))
+
+        self.apply_parameters(compute_node, updates)
 
     def set_dataset(self, compute_node):
         """
@@ -499,16 +808,13 @@ class Experiment:
 
         print("\n....... Set Dataset")
 
-        with open(self.experiment_utils.experiment_def_file()) as (
-                data_exps_file):
-            data = json.load(data_exps_file)
-
-        for exp_i in data['experiments']:
+        updates = []
+        for exp_i in self.experiment_utils.definition().experiments:
             # array of sweep definitions
-            for param in exp_i['dataset-parameters']:
-                entity_name = param['entity-name']
-                param_path = param['parameter-path']
-                data_filenames = param['value']
+            for param in exp_i.dataset_parameters:
+                entity_name = param.entity_name
+                param_path = param.param_path
+                data_filenames = param.value
 
                 data_filenames_arr = data_filenames.split(',')
 
@@ -521,10 +827,11 @@ class Experiment:
                         data_paths += ","
                     data_paths += self.experiment_utils.datapath(data_filename)
 
-                compute_node.set_parameter_db(
-                    self.entity_with_prefix(entity_name),
-                    param_path, data_paths
-                )
+                updates.append((self.entity_with_prefix(entity_name),
+                                param_path,
+                                data_paths))
+
+        self.apply_parameters(compute_node, updates)
 
     def generate_input_files_locally(self, compute_node):
         entity_filepath, data_filepaths = (
@@ -552,11 +859,15 @@ class Experiment:
         print("\n...... Uploading results to S3")
 
         # upload /input folder (contains input files entity.json, data.json)
+        # the generated inputs that are the same for every prefix are only
+        # uploaded once, then copied within s3
         folder_path = self.experiment_utils.inputfile(self.prefix(), "")
-        self.upload_experiment_file(cloud,
-                                    self.prefix(),
-                                    "input",
-                                    folder_path)
+        self.upload_experiment_file(
+            cloud,
+            self.prefix(),
+            "input",
+            folder_path,
+            self.experiment_utils.generated_inputs().entry)
 
         # upload experiments definition file (if it exists)
         self.upload_experiment_file(
@@ -593,16 +904,22 @@ class Experiment:
         elif self.no_compress is False:
             folder_path_big = self.experiment_utils.runpath("output-big/")
 
-            # locate the output data file
-            output_data_filepath = utils.match_file_by_name(folder_path,
-                                                            'data')
-
-            if output_data_filepath is None:
+            # locate the output data file, or the index and all the shards
+            # of a sharded export (--export_shards)
+            output_data_filepaths = exportshards.sharded_export_filepaths(
+                folder_path)
+            if not output_data_filepaths:
+                output_data_filepath = utils.match_file_by_name(folder_path,
+                                                                'data')
+                if output_data_filepath is not None:
+                    output_data_filepaths = [output_data_filepath]
+
+            if not output_data_filepaths:
                 logging.warning("No data file found. This should only " +
                                 "happen if you are running remote via ssh, " +
                                 "and exporting data by saving on compute.")
             else:
-                files_to_compress = [output_data_filepath]
+                files_to_compress = list(output_data_filepaths)
                 archive_filename = self.experiment_utils.outputfile(
                                         self.prefix(),
                                         "data.zip")
@@ -623,7 +940,9 @@ class Experiment:
                 utils.compress_files(archive_filename, files_to_compress)
 
                 # Move uncompressed files to /output-big directory
-                utils.move_file(output_data_filepath, folder_path_big, True)
+                for output_data_filepath in output_data_filepaths:
+                    utils.move_file(output_data_filepath, folder_path_big,
+                                    True)
                 if self.csv_output:
                     utils.move_file(output_labels_filepath, folder_path_big,
                                     True)
@@ -638,7 +957,8 @@ class Experiment:
                                     folder_path)
 
     @staticmethod
-    def upload_experiment_file(cloud, prefix, dest_name, source_path):
+    def upload_experiment_file(cloud, prefix, dest_name, source_path,
+                               content_key=None):
         """
         Upload experiment to s3.
         :param prefix: experiment prefix (used in the full name of
@@ -646,6 +966,8 @@ class Experiment:
         :param dest_name: the name for the eventual uploaded s3 object
                           (it can be file or folder)
         :param source_path: the file or folder to be uploaded
+        :param content_key: function(filepath) that identifies the contents
+                            of a file, or None, see Cloud.upload_file_s3
         :type cloud: Cloud
         :return:
         """
@@ -658,9 +980,12 @@ class Experiment:
         key = "experiment-output/" + prefix + "/" + dest_name
 
         if os.path.isfile(source_path):
-            cloud.upload_file_s3(bucket_name, key, source_path)
+            cloud.upload_file_s3(
+                bucket_name, key, source_path,
+                content_key(source_path) if content_key else None)
         else:
-            cloud.upload_folder_s3(bucket_name, key, source_path)
+            cloud.upload_folder_s3(bucket_name, key, source_path,
+                                   content_key)
 
     def append_runtime(self, runtime):
         info_filepath = self.experiment_utils.outputfile(
@@ -671,3 +996,59 @@ class Experiment:
         with open(info_filepath, 'a') as data:
             data.write("\nExperiment Runtime: %d days, %d hr, %d min, %d s" %
                        tuple(runtime))
+
+    def write_metrics(self):
+        """
+        Save the latency and bytes of the requests to Compute of the run in
+        progress (see metrics.scope()), next to the experiment info.
+        """
+        run_metrics = metrics.current()
+        if run_metrics is None:
+            return
+
+        metrics_filepath = self.experiment_utils.outputfile(
+                               self.prefix(),
+                               self.METRICS_FILENAME)
+        try:
+            run_metrics.write(metrics_filepath)
+        except IOError as e:
+            logging.warning("Could not save the Compute request metrics: %s",
+                            e)
+
+    def write_session_metrics(self, session_metrics):
+        """ Save and print the request metrics of all runs """
+        metrics_filepath = self.experiment_utils.runpath(
+                               self.METRICS_FILENAME)
+        try:
+            session_metrics.write(metrics_filepath)
+        except IOError as e:
+            logging.warning("Could not save the Compute request metrics: %s",
+                            e)
+
+        print("\nRequests to Compute, by endpoint (" + metrics_filepath + "):")
+        for line in session_metrics.summary_lines():
+            print("  " + line)
+
+    def write_progress(self, compute_node):
+        """
+        Save the age/runTime series of the run to the output folder, and
+        its throughput to the experiment info, to compare Compute nodes and
+        configurations.
+        """
+        progress = compute_node.progress
+
+        progress_filepath = self.experiment_utils.outputfile(
+                                self.prefix(),
+                                self.PROGRESS_FILENAME)
+        progress.write(progress_filepath)
+
+        info_filepath = self.experiment_utils.outputfile(
+                            self.prefix(),
+                            "experiment-info.txt"
+                        )
+
+        with open(info_filepath, 'a') as data:
+            data.write("\n" + progress.summary() + ", on " +
+                       compute_node.base_url())
+
+        print(progress.summary())
@@ -0,0 +1,308 @@
+import json
+import numbers
+
+from agief_experiment.valueseries import ValueSeries
+
+
+class DefinitionError(Exception):
+    """ The experiments definition file is malformed or incomplete """
+    pass
+
+
+def strip_comments(text):
+    """
+    Remove // comments (to the end of the line) from json text, as used in
+    resources/experiments-format.json. '//' inside strings is kept.
+    """
+    lines = []
+    for line in text.splitlines():
+        in_string = False
+        escape = False
+        for i, char in enumerate(line):
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = in_string
+            elif char == '"':
+                in_string = not in_string
+            elif char == '/' and not in_string and line[i + 1:i + 2] == '/':
+                line = line[:i]
+                break
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+class InputFiles:
+    """ 'file-entities' and 'file-data' of 'import-files' or 'gen-files' """
+
+    def __init__(self, entity_filename, data_filenames):
+        self.entity_filename = entity_filename
+        self.data_filenames = data_filenames
+
+
+class ParameterValue:
+    """ An item of 'entity-parameters' or 'dataset-parameters' """
+
+    def __init__(self, entity_name, param_path, value):
+        self.entity_name = entity_name
+        self.param_path = param_path
+        self.value = value
+
+
+class SweepParameter:
+    """ An item of a 'parameter-set', the values a parameter is swept over """
+
+    def __init__(self, entity_name, param_path, val_series=None,
+                 val_begin=None, val_end=None, val_inc=None):
+        self.entity_name = entity_name
+        self.param_path = param_path
+        self.val_series = val_series
+        self.val_begin = val_begin
+        self.val_end = val_end
+        self.val_inc = val_inc
+
+    def value_series(self):
+        """ A new ValueSeries of the values, val-series if defined """
+        if self.val_series is not None:
+            return ValueSeries(self.val_series)
+        return ValueSeries.from_range(minv=self.val_begin,
+                                      maxv=self.val_end,
+                                      deltav=self.val_inc)
+
+
+class ExperimentSpec:
+    """ One item of 'experiments' """
+
+    def __init__(self, import_files, gen_files=None,
+                 load_local_data_filenames=None, entity_parameters=None,
+                 dataset_parameters=None, parameter_sweeps=None):
+        """
+        :param parameter_sweeps: list of sweeps, each a list of
+                                 SweepParameter that are swept together
+        """
+        self.import_files = import_files
+        self.gen_files = gen_files
+        self.load_local_data_filenames = load_local_data_filenames or []
+        self.entity_parameters = entity_parameters or []
+        self.dataset_parameters = dataset_parameters or []
+        self.parameter_sweeps = parameter_sweeps or []
+
+
+class ExperimentDefinition:
+    """
+        The experiments definition file (experiments.json), parsed and
+        checked in full once, so that mistakes in it are reported before
+        anything is launched, rather than part way through a sweep.
+
+        See resources/experiments-format.json for the format (// comments
+        are allowed).
+    """
+
+    def __init__(self, experiments, filepath=None):
+        self.experiments = experiments
+        self.filepath = filepath
+
+    @classmethod
+    def load(cls, filepath):
+        """
+        :raises DefinitionError: if the file can't be read, or is not a
+                                 valid definition
+        """
+        try:
+            with open(filepath) as exps_file:
+                text = exps_file.read()
+        except (IOError, OSError) as e:
+            raise DefinitionError("Could not read the experiments "
+                                  "definition " + str(filepath) + ": " +
+                                  str(e))
+        return cls.parse(text, filepath)
+
+    @classmethod
+    def parse(cls, text, filepath=None):
+        try:
+            filedata = json.loads(strip_comments(text))
+        except ValueError as e:
+            raise DefinitionError("The experiments definition " +
+                                  str(filepath) + " is not valid json: " +
+                                  str(e))
+
+        parser = _Parser()
+        experiments = parser.experiments(filedata)
+        if parser.errors:
+            raise DefinitionError(
+                "The experiments definition " + str(filepath) + " is not "
+                "valid:\n\t" + "\n\t".join(parser.errors))
+        return cls(experiments, filepath)
+
+
+class _Parser:
+    """ Builds the definition, collecting every error along the way """
+
+    def __init__(self):
+        self.errors = []
+
+    def error(self, path, message):
+        self.errors.append(path + ": " + message)
+
+    def typed(self, container, key, path, types, type_name, required=True):
+        """ container[key] if it is one of 'types', otherwise None """
+        if key not in container:
+            if required:
+                self.error(path, "'" + key + "' is missing")
+            return None
+
+        value = container[key]
+        # json true/false are bools, which python also counts as numbers
+        if not isinstance(value, types) or (
+                isinstance(value, bool) and types is numbers.Number):
+            self.error(path + "." + key, "should be " + type_name)
+            return None
+        return value
+
+    def experiments(self, filedata):
+        if not isinstance(filedata, dict):
+            self.error("(top level)", "should be an object")
+            return []
+
+        items = self.typed(filedata, 'experiments', "(top level)", list,
+                           "a list")
+        if items is not None and not items:
+            self.error("experiments", "should not be empty")
+
+        experiments = []
+        for i, item in enumerate(items or []):
+            path = "experiments[%d]" % i
+            if not isinstance(item, dict):
+                self.error(path, "should be an object")
+                continue
+            experiments.append(self.experiment(item, path))
+        return experiments
+
+    def experiment(self, item, path):
+        import_files = self.input_files(item, 'import-files', path, True)
+        gen_files = self.input_files(item, 'gen-files', path, False)
+
+        load_local_data_filenames = []
+        load_local = self.typed(item, 'load-local-files', path, dict,
+                                "an object", False)
+        if load_local is not None:
+            load_local_data_filenames = self.filenames(
+                load_local, 'file-data', path + ".load-local-files", False)
+
+        # 'entity-parameters' is optional, as the format file has none,
+        # but every experiment says which dataset it uses (may be empty)
+        return ExperimentSpec(
+            import_files, gen_files, load_local_data_filenames,
+            self.parameter_values(item, 'entity-parameters', path, False,
+                                  required=False),
+            self.parameter_values(item, 'dataset-parameters', path, True,
+                                  required=True),
+            self.parameter_sweeps(item, path))
+
+    def input_files(self, item, key, path, required):
+        files = self.typed(item, key, path, dict, "an object", required)
+        if files is None:
+            return None
+
+        path += "." + key
+        entity_filename = self.typed(files, 'file-entities', path,
+                                     _STRING_TYPES, "a filename")
+        data_filenames = self.filenames(files, 'file-data', path, True)
+        return InputFiles(entity_filename, data_filenames)
+
+    def filenames(self, container, key, path, required):
+        """ A list of filenames, a single filename is a list of one """
+        value = self.typed(container, key, path, (list,) + _STRING_TYPES,
+                           "a list of filenames", required)
+        if value is None:
+            return []
+        if isinstance(value, _STRING_TYPES):
+            return [value]
+
+        if not value and required:
+            self.error(path + "." + key, "should not be empty")
+        for i, filename in enumerate(value):
+            if not isinstance(filename, _STRING_TYPES):
+                self.error("%s.%s[%d]" % (path, key, i), "should be a "
+                           "filename")
+        return value
+
+    def parameter_values(self, item, key, path, is_string_value,
+                         required):
+        """ entity-parameters (any value), dataset-parameters (strings) """
+        params = self.typed(item, key, path, list, "a list", required)
+
+        values = []
+        for i, param in enumerate(params or []):
+            param_path = "%s.%s[%d]" % (path, key, i)
+            if not isinstance(param, dict):
+                self.error(param_path, "should be an object")
+                continue
+
+            entity_name = self.typed(param, 'entity-name', param_path,
+                                     _STRING_TYPES, "a string")
+            parameter_path = self.typed(param, 'parameter-path', param_path,
+                                        _STRING_TYPES, "a string")
+            if 'value' not in param:
+                self.error(param_path, "'value' is missing")
+            elif is_string_value and not isinstance(param['value'],
+                                                    _STRING_TYPES):
+                self.error(param_path + ".value", "should be a string of "
+                           "comma separated paths")
+            values.append(ParameterValue(entity_name, parameter_path,
+                                         param.get('value')))
+        return values
+
+    def parameter_sweeps(self, item, path):
+        sweeps_items = self.typed(item, 'parameter-sweeps', path, list,
+                                  "a list", False)
+
+        sweeps = []
+        for i, sweep_item in enumerate(sweeps_items or []):
+            sweep_path = "%s.parameter-sweeps[%d]" % (path, i)
+            if not isinstance(sweep_item, dict):
+                self.error(sweep_path, "should be an object")
+                continue
+
+            params = self.typed(sweep_item, 'parameter-set', sweep_path,
+                                list, "a list")
+            if params is not None and not params:
+                self.error(sweep_path + ".parameter-set", "should not be "
+                           "empty")
+
+            sweep = []
+            for j, param in enumerate(params or []):
+                param_path = "%s.parameter-set[%d]" % (sweep_path, j)
+                if not isinstance(param, dict):
+                    self.error(param_path, "should be an object")
+                    continue
+                sweep.append(self.sweep_parameter(param, param_path))
+            sweeps.append(sweep)
+        return sweeps
+
+    def sweep_parameter(self, param, path):
+        entity_name = self.typed(param, 'entity-name', path, _STRING_TYPES,
+                                 "a string")
+        param_path = self.typed(param, 'parameter-path', path, _STRING_TYPES,
+                                "a string")
+
+        # val-series takes precedence over the range, if defined
+        if 'val-series' in param:
+            series = self.typed(param, 'val-series', path, list, "a list")
+            if series is not None and not series:
+                self.error(path + ".val-series", "should not be empty")
+            return SweepParameter(entity_name, param_path, val_series=series)
+
+        begin, end, inc = [self.typed(param, key, path, numbers.Number,
+                                      "a number")
+                           for key in ('val-begin', 'val-end', 'val-inc')]
+        if inc == 0:
+            self.error(path + ".val-inc", "should not be 0")
+        return SweepParameter(entity_name, param_path, val_begin=begin,
+                              val_end=end, val_inc=inc)
+
+
+try:
+    _STRING_TYPES = (str, unicode)  # noqa: F821 (python 2)
+except NameError:
+    _STRING_TYPES = (str,)
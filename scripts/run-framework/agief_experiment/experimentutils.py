@@ -1,10 +1,13 @@
-import json
 import os
-import shutil
 import subprocess
 import logging
 
 from agief_experiment import utils
+from agief_experiment import environment
+from agief_experiment.entitydocument import EntityDocument
+from agief_experiment.generatedinputs import GeneratedInputs
+from agief_experiment.substitution import SubstitutedFile
+from agief_experiment.experimentdefinition import ExperimentDefinition
 
 
 class ExperimentUtils:
@@ -17,33 +20,52 @@ class ExperimentUtils:
     agi_data_exp_home = "AGI_EXP_HOME"
     variables_file = "VARIABLES_FILE"
 
-    def __init__(self, experiments_def_filename):
+    def __init__(self, experiments_def_filename,
+                 generated_inputs_max_size=GeneratedInputs.DEFAULT_MAX_SIZE):
         """"
             Helper class for Experiments.
             All things related to filenames and paths.
         """
 
         self.experiments_def_filename = experiments_def_filename
+        self.generated_inputs_max_size = generated_inputs_max_size
+        self._definition = None
+        self._generated_inputs = None
+
+    def definition(self):
+        """
+        The ExperimentDefinition of the experiments definition file, parsed
+        and validated on first use, then kept for the session.
+
+        :raises DefinitionError: if the file is missing or not valid
+        """
+        if self._definition is None:
+            self._definition = ExperimentDefinition.load(
+                self.experiment_def_file())
+        return self._definition
+
+    def generated_inputs(self):
+        """ The GeneratedInputs cache, in the experiment's input folder """
+        if self._generated_inputs is None:
+            self._generated_inputs = GeneratedInputs(
+                self.inputfile_base(GeneratedInputs.FOLDER),
+                self.generated_inputs_max_size)
+        return self._generated_inputs
 
     def filepath_from_exp_variable(self, filename, path_env):
+        """
+        Path of 'filename' in the folder given by the variable 'path_env' of
+        the variables file. The file is only sourced again when it changes,
+        see environment.VariablesResolver.
+        """
 
         variables_file = self.variables_filepath()
 
         if variables_file == "" or variables_file is None:
             logging.warning("unable to locate variables file.")
 
-        logging.debug("experiment:filepath_from_env_variable: "
-                      "variables file = %s", variables_file)
-
-        cmd = "source " + variables_file + " && echo $" + path_env
-        output, error = subprocess.Popen(cmd,
-                                         shell=True,
-                                         stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE,
-                                         executable="/bin/bash").communicate()
-
-        file_path = utils.cleanpath(output, filename)
-        return file_path
+        return environment.resolver_for(variables_file).path(filename,
+                                                             path_env)
 
     def githash(self):
         """ return githash of experiment-definitions """
@@ -57,6 +79,8 @@ class ExperimentUtils:
                                          stderr=subprocess.PIPE,
                                          executable="/bin/bash").communicate()
 
+        if isinstance(commit, bytes):
+            commit = commit.decode('utf-8')
         return commit
 
     def inputfiles_for_generation(self):
@@ -85,28 +109,18 @@ class ExperimentUtils:
         :return: entityfilename, datafilenames
         """
 
-        exps_filename = self.experiment_def_file()
-
-        with open(exps_filename) as exps_file:
-            filedata = json.load(exps_file)
-
-        for exp_i in filedata['experiments']:
+        for exp_i in self.definition().experiments:
 
             if is_import_files:
-                key = 'import-files'
+                input_files = exp_i.import_files
             else:
-                key = 'gen-files'
-
-            input_files = exp_i[key]  # import files dictionary
+                input_files = exp_i.gen_files
 
-            logging.debug("Input Files Dictionary = %s",
-                          json.dumps(input_files, indent=4))
+            if input_files is None:
+                raise Exception("ERROR: the experiments definition has no "
+                                "'gen-files'.")
 
-            # get experiment file-names, and expand to full path
-            base_entity_filename = input_files['file-entities']
-            base_data_filenames = input_files['file-data']
-
-            return base_entity_filename, base_data_filenames
+            return input_files.entity_filename, input_files.data_filenames
 
     def inputfile_base(self, filename):
         """
@@ -185,7 +199,8 @@ class ExperimentUtils:
         """
         return self.filepath_from_exp_variable(path, self.agi_home + "/bin/")
 
-    def create_input_files(self, prefix, template_prefix, base_filenames):
+    def create_input_files(self, prefix, template_prefix, base_filenames,
+                           sources=None):
         """
         Create 'experiment input files' from the 'base input files'.
 
@@ -201,6 +216,9 @@ class ExperimentUtils:
         :param base_filenames: array of filenames (not full path) to be copied
         and prefix changed internally
         :param template_prefix:
+        :param sources: if given, the files are not written, but made from
+        the base files as they are read: their substitution.SubstitutedFile
+        is added to this dict, by filepath
         :return: array of modified filepaths (full path)
         """
 
@@ -214,30 +232,71 @@ class ExperimentUtils:
                               "\nCANNOT CONTINUE.")
                 exit(1)
 
-            # get the containing folder, and it's parent folder
-            # full dirname
-            full_dirname = os.path.dirname(os.path.normpath(base_filepath))
-            # take just the last part - next subfolder up
-            full_parentpath, dirname = os.path.split(full_dirname)
-            # take just the last part - subfolder
-            parent_dirname = os.path.basename(full_parentpath)
-
-            if dirname != "output" and parent_dirname != "output":
+            if not self.is_output_file(base_filepath):
                 filename = utils.append_before_ext(base_filename, "_" + prefix)
                 filepath = self.inputfile(prefix, filename)
-                # create path if it doesn't exist
-                utils.create_folder(filepath)
-                # create new input files with prefix in the name
-                shutil.copyfile(base_filepath, filepath)
-                # search replace contents for PREFIX and replace with 'prefix'
-                utils.replace_in_file(template_prefix, prefix,
-                                      filepath)
+                # new input files with prefix in the name, and PREFIX
+                # replaced with 'prefix' in their contents
+                source = SubstitutedFile(base_filepath, filepath,
+                                         template_prefix, prefix)
+                if sources is not None:
+                    sources[filepath] = source
+                elif source.is_identity():
+                    # the same for every prefix, a hard link to the cache
+                    self.generated_inputs().place(filepath, base_filepath,
+                                                  template_prefix, prefix)
+                else:
+                    source.write()
                 filenames.append(filepath)
             else:
                 filenames.append(base_filepath)
 
         return filenames
 
+    def create_entity_document(self, prefix, template_prefix,
+                               base_filename):
+        """
+        The 'experiment input file' of the entities, as create_input_files
+        would make it, but held in memory so that parameters can be set in it
+        before it is written (see EntityDocument.write).
+
+        :return: EntityDocument, to be written to the prefix input folder, or
+        in place if the base file is in the /output subfolder
+        """
+
+        base_filepath = self.inputfile_base(base_filename)
+
+        if not os.path.isfile(base_filepath):
+            logging.error("The file does not exist" + base_filepath +
+                          "\nCANNOT CONTINUE.")
+            exit(1)
+
+        if self.is_output_file(base_filepath):
+            return EntityDocument.from_file(base_filepath)
+
+        filename = utils.append_before_ext(base_filename, "_" + prefix)
+        return EntityDocument.from_file(
+            base_filepath, template_prefix, prefix,
+            dest_filepath=self.inputfile(prefix, filename),
+            generated_inputs=self.generated_inputs())
+
+    @staticmethod
+    def is_output_file(filepath):
+        """
+        True if the file is in an /output folder (or a subfolder of one),
+        i.e. the output of a previous run, used as input as it is
+        """
+
+        # get the containing folder, and it's parent folder
+        # full dirname
+        full_dirname = os.path.dirname(os.path.normpath(filepath))
+        # take just the last part - next subfolder up
+        full_parentpath, dirname = os.path.split(full_dirname)
+        # take just the last part - subfolder
+        parent_dirname = os.path.basename(full_parentpath)
+
+        return dirname == "output" or parent_dirname == "output"
+
     def variables_filepath(self):
         """
         Return full filename with path, of the file being used for
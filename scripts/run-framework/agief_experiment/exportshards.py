@@ -0,0 +1,89 @@
+import os
+import gzip
+import json
+
+# exported data files that are an index of shards end with this
+INDEX_SUFFIX = '.index.json'
+
+
+def open_export(filepath, mode='r'):
+    """ Open an exported file, gzip compressed or not """
+    if filepath.endswith('.gz'):
+        return gzip.open(filepath, mode + 't' if 'b' not in mode else mode)
+    return open(filepath, mode)
+
+
+def entity_names(entity_filepath):
+    """ Names of the entities in an exported entity file """
+    with open_export(entity_filepath) as entity_file:
+        return [entity['name'] for entity in json.load(entity_file)]
+
+
+def index_filepath(data_filepath):
+    return os.path.splitext(data_filepath)[0] + INDEX_SUFFIX
+
+
+def shard_filepath(data_filepath, index):
+    base, extension = os.path.splitext(data_filepath)
+    return "%s.shard-%04d%s" % (base, index, extension)
+
+
+def is_empty(shard_filepath):
+    """ True if the shard holds no data at all (an empty json list) """
+    if os.path.getsize(shard_filepath) > 64:
+        return False
+    with open_export(shard_filepath) as shard_file:
+        return shard_file.read().strip() == '[]'
+
+
+def write_index(data_filepath, root_entity, shards):
+    """
+    Write the index of a sharded data export, next to the shards.
+
+    :param shards: list of (entity name, shard filepath)
+    :return: path of the index file
+    """
+    filepath = index_filepath(data_filepath)
+    index = {
+        'entity': root_entity,
+        # as 'file-data' of an experiment definition, relative to the index
+        'file-data': [os.path.basename(shard) for _, shard in shards],
+        'shards': dict((entity_name, os.path.basename(shard))
+                       for entity_name, shard in shards)
+    }
+    with open(filepath, 'w') as index_file:
+        index_file.write(json.dumps(index, indent=4))
+    return filepath
+
+
+def sharded_export_filepaths(folder_path):
+    """
+    The files of the sharded data exports in a folder, i.e. each index and
+    all of its shards, or an empty list if there are none.
+    """
+    filepaths = []
+    for filename in sorted(os.listdir(folder_path)):
+        if filename.endswith(INDEX_SUFFIX):
+            filepath = os.path.join(folder_path, filename)
+            filepaths.append(filepath)
+            filepaths.extend(expand_data_filepaths([filepath]))
+    return filepaths
+
+
+def expand_data_filepaths(data_filepaths):
+    """
+    Replace each index of a sharded export by the paths of its shards, so a
+    sharded export can be imported as a multi-file 'file-data' list.
+    """
+    expanded = []
+    for data_filepath in data_filepaths:
+        if not data_filepath.endswith(INDEX_SUFFIX):
+            expanded.append(data_filepath)
+            continue
+
+        with open(data_filepath) as index_file:
+            index = json.load(index_file)
+        folder = os.path.dirname(data_filepath)
+        expanded.extend(os.path.join(folder, shard)
+                        for shard in index['file-data'])
+    return expanded
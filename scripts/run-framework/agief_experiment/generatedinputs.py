@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+
+from agief_experiment import utils
+from agief_experiment.substitution import SubstitutedFile
+
+
+class GeneratedInputs:
+    """
+        Content addressed cache of generated input files, in a folder of the
+        experiment's input folder.
+
+        A generated file is stored once, before the template prefix is
+        replaced, under the sha256 of its base file's contents, the template
+        prefix and the parameters set in it. Parameter sets that repeat the
+        same values (repeated val-series values, reruns, overlapping sweeps)
+        are made from the cache rather than generated again.
+
+        A file without the template prefix in it is the same for every
+        prefix: its copies in the prefix input folders are hard links to the
+        cache, and take no space. Otherwise the prefix is replaced as the
+        copy is written. The import and upload stages find the cache entry
+        of such a copy with entry(), so that its contents are transferred
+        once (see Compute._import_cached and Cloud.upload_file_s3).
+
+        Once the cache holds more than max_size bytes, the entries that were
+        used least recently are removed. Copies that are hard links keep
+        their contents.
+    """
+
+    FOLDER = 'generated'
+
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    DEFAULT_MAX_SIZE = 10 * 1024 * 1024 * 1024
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        """
+        :param max_size: bytes the cache is kept to (0 for no limit)
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+        # (filepath, size, mtime) -> digest, so files are hashed once
+        self._digests = {}
+        self._lock = threading.Lock()
+
+        # input file -> the cache entry it is a copy of, for the files that
+        # are the same for every prefix
+        self._entries = {}
+
+        # files made from the cache, and generated into it
+        self.hits = 0
+        self.misses = 0
+
+    def digest(self, filepath):
+        stat = os.stat(filepath)
+        key = (os.path.abspath(filepath), stat.st_size, stat.st_mtime)
+
+        with self._lock:
+            if key in self._digests:
+                return self._digests[key]
+
+        sha256 = hashlib.sha256()
+        with open(filepath, 'rb') as input_file:
+            for chunk in iter(lambda: input_file.read(self.HASH_CHUNK_SIZE),
+                              b''):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+
+        with self._lock:
+            self._digests[key] = digest
+        return digest
+
+    def key(self, source_filepath, template_prefix, parameters=()):
+        """
+        :param parameters: (entity_name, param_path, value) set in the file,
+                           with the template prefix in the entity names
+        """
+        sha256 = hashlib.sha256()
+        sha256.update(self.digest(source_filepath).encode('utf-8'))
+        sha256.update(b'\0' + template_prefix.encode('utf-8') + b'\0')
+        sha256.update(json.dumps(list(parameters), sort_keys=True,
+                                 default=str).encode('utf-8'))
+        return sha256.hexdigest()
+
+    def cached_filepath(self, key, filepath):
+        """ Path of the entry in the cache (keeping the file's extension) """
+        extension = os.path.splitext(filepath)[1]
+        return os.path.join(self.cache_dir, key + extension)
+
+    def place(self, filepath, source_filepath, template_prefix, prefix,
+              parameters=(), generate=None):
+        """
+        Make the input file 'filepath' from the cache, generating the entry
+        first if the base file with these parameters is not in it yet.
+
+        :param generate: generate(output_file) writes the file, before the
+                         template prefix is replaced, to a binary file. By
+                         default it is the base file as it is.
+        :return: True if the entry was in the cache
+        """
+        cached_filepath = self.cached_filepath(
+            self.key(source_filepath, template_prefix, parameters), filepath)
+
+        is_hit = os.path.isfile(cached_filepath)
+        if is_hit:
+            # last use, for evict() (the mtime is kept, as the digests of
+            # the entry and its hard links depend on it)
+            os.utime(cached_filepath,
+                     (time.time(), os.stat(cached_filepath).st_mtime))
+        else:
+            utils.create_folder(cached_filepath)
+            part_filepath = cached_filepath + '.' + uuid.uuid4().hex + '.part'
+            try:
+                with open(part_filepath, 'wb') as output_file:
+                    if generate is not None:
+                        generate(output_file)
+                    else:
+                        with open(source_filepath, 'rb') as input_file:
+                            shutil.copyfileobj(input_file, output_file)
+            except Exception:
+                utils.remove_file(part_filepath, True)
+                raise
+            os.rename(part_filepath, cached_filepath)
+
+        with self._lock:
+            if is_hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        source = SubstitutedFile(cached_filepath, filepath, template_prefix,
+                                 prefix)
+        if source.is_identity():
+            self.link(cached_filepath, filepath)
+            with self._lock:
+                self._entries[os.path.abspath(filepath)] = cached_filepath
+        else:
+            source.write()
+
+        if not is_hit:
+            self.evict(keep=cached_filepath)
+        return is_hit
+
+    def entry(self, filepath):
+        """
+        The cache entry that the input file 'filepath' is a copy of (e.g. a
+        hard link to), or None. Its name is the key of its contents.
+        """
+        with self._lock:
+            cached_filepath = self._entries.get(os.path.abspath(filepath))
+        if cached_filepath is None or not os.path.isfile(cached_filepath):
+            return None
+        return cached_filepath
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries, until the cache holds at
+        most max_size bytes.
+
+        :param keep: an entry that is not removed (the one just made)
+        """
+        if not self.max_size or not os.path.isdir(self.cache_dir):
+            return
+
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith('.part'):
+                continue
+            cached_filepath = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(cached_filepath)
+            except OSError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, cached_filepath))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, cached_filepath in sorted(entries):
+            if size <= self.max_size:
+                break
+            if cached_filepath == keep:
+                continue
+            utils.remove_file(cached_filepath, True)
+            size -= entry_size
+            logging.debug("Generated inputs: evicted %s", cached_filepath)
+
+        with self._lock:
+            self._entries = dict(
+                (filepath, cached_filepath)
+                for filepath, cached_filepath in self._entries.items()
+                if os.path.isfile(cached_filepath))
+
+    @staticmethod
+    def link(cached_filepath, filepath):
+        """ Hard link 'filepath' to the cache, or copy if it can't be """
+        utils.create_folder(filepath)
+        part_filepath = filepath + '.' + uuid.uuid4().hex + '.part'
+        try:
+            os.link(cached_filepath, part_filepath)
+        except (OSError, AttributeError) as e:
+            # e.g. another file system, or no hard links on it
+            logging.debug("Could not hard link %s (%s), copying it",
+                          cached_filepath, e)
+            shutil.copyfile(cached_filepath, part_filepath)
+        os.rename(part_filepath, filepath)
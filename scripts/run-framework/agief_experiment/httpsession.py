@@ -0,0 +1,239 @@
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from agief_experiment import metrics
+from agief_experiment.circuitbreaker import CircuitBreaker
+
+
+class CircuitOpen(requests.exceptions.ConnectionError):
+    """ A request was refused, as the node's circuit breaker is open """
+    pass
+
+
+class ComputeSession:
+    """
+        A connection-pooled, keep-alive HTTP session to one Compute node
+        (host and port). All Compute REST calls for that node share the
+        same session, so TCP connections are reused across calls instead
+        of being opened and torn down for every request.
+
+        Keeps simple counters so that connection reuse and request latency
+        can be reported at the end of a session, and a CircuitBreaker that
+        refuses requests once too many of them have failed. Each request is
+        also recorded in the metrics scopes of the calling thread (latency
+        and bytes by endpoint, see metrics.scope()).
+    """
+
+    # statuses that are safe to retry at the transport level
+    RETRY_STATUSES = (502, 503, 504)
+
+    def __init__(self, base_url, pool_size=10, max_retries=3,
+                 backoff_factor=0.3, keep_alive=True, breaker_error_rate=0.5,
+                 breaker_slow_seconds=None, breaker_reset_seconds=30):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.keep_alive = keep_alive
+
+        self._session = self._create_session(max_retries)
+        self._probe_session = None
+
+        self.breaker = CircuitBreaker(max_error_rate=breaker_error_rate,
+                                      slow_seconds=breaker_slow_seconds,
+                                      reset_seconds=breaker_reset_seconds)
+
+        self._lock = threading.Lock()
+        self._num_requests = 0
+        self._num_errors = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+
+    def _retry_policy(self, max_retries):
+        """
+        Retry on connection errors for any method (the request never reached
+        the node), but only retry on read errors / bad statuses for idempotent
+        methods - a POST to /config or /import must not be sent twice.
+        """
+        kwargs = dict(total=max_retries,
+                      connect=max_retries,
+                      read=max_retries,
+                      status=max_retries,
+                      backoff_factor=self.backoff_factor,
+                      status_forcelist=self.RETRY_STATUSES,
+                      raise_on_status=False)
+        try:
+            return Retry(allowed_methods=frozenset(['GET']), **kwargs)
+        except TypeError:
+            # urllib3 < 1.26
+            return Retry(method_whitelist=frozenset(['GET']), **kwargs)
+
+    def _create_session(self, max_retries):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.pool_size,
+                              max_retries=self._retry_policy(max_retries),
+                              pool_block=False)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+
+        return session
+
+    def request(self, method, path, probe=False, fast=False, **kwargs):
+        """
+        Send a request to the node, with path relative to the base url.
+
+        :param probe: if True, do not retry at the transport level (used when
+                      polling to see if the node is up, where a refused
+                      connection is the expected answer). Probes are sent
+                      even if the circuit breaker is open.
+        :param fast: the node should answer right away (e.g. /version), so a
+                     slow answer counts against it in the circuit breaker
+        :raises CircuitOpen: if the circuit breaker is open
+        """
+
+        if not probe and not self.breaker.allow():
+            raise CircuitOpen("Circuit breaker of " + self.base_url +
+                              " is open, request not sent: " + method + " " +
+                              path)
+
+        if probe:
+            if self._probe_session is None:
+                self._probe_session = self._create_session(0)
+            session = self._probe_session
+        else:
+            session = self._session
+
+        start = time.time()
+        try:
+            response = session.request(method, self.base_url + path,
+                                       **kwargs)
+        except requests.exceptions.RequestException:
+            latency = time.time() - start
+            self._record(latency, True)
+            self.breaker.record(latency, True, fast, probe)
+            metrics.record(method, path, latency, True)
+            raise
+
+        latency = time.time() - start
+        self._record(latency, response.status_code >= 400)
+        metrics.record(method, path, latency, response.status_code >= 400,
+                       self._body_size(response.request.body),
+                       self._response_size(response, kwargs.get('stream')))
+        # 4xx are answers about the request (e.g. an unknown entity), not a
+        # sign of an unhealthy node
+        self.breaker.record(latency, response.status_code >= 500, fast, probe)
+        return response
+
+    @staticmethod
+    def _body_size(body):
+        if body is None:
+            return 0
+        if hasattr(body, 'wire_bytes'):
+            # an upload stream, see upload.py
+            return body.wire_bytes
+        try:
+            return len(body)
+        except TypeError:
+            return 0
+
+    @staticmethod
+    def _response_size(response, is_stream):
+        if is_stream:
+            # not read yet, see metrics.record_transfer()
+            return 0
+        return len(response.content)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def _record(self, latency, is_error):
+        with self._lock:
+            self._num_requests += 1
+            self._total_latency += latency
+            self._max_latency = max(self._max_latency, latency)
+            if is_error:
+                self._num_errors += 1
+
+    def _connections_opened(self):
+        """ Number of TCP connections opened by the underlying pools """
+
+        opened = 0
+        for session in (self._session, self._probe_session):
+            if session is None:
+                continue
+            adapter = session.get_adapter(self.base_url)
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    opened += pool.num_connections
+        return opened
+
+    def stats(self):
+        with self._lock:
+            num_requests = self._num_requests
+            num_errors = self._num_errors
+            total_latency = self._total_latency
+            max_latency = self._max_latency
+
+        opened = self._connections_opened()
+        mean_latency = total_latency / num_requests if num_requests else 0.0
+
+        return {
+            'url': self.base_url,
+            'requests': num_requests,
+            'errors': num_errors,
+            'connections_opened': opened,
+            'connections_reused': max(num_requests - opened, 0),
+            'mean_latency_ms': round(mean_latency * 1000, 2),
+            'max_latency_ms': round(max_latency * 1000, 2),
+            'breaker': self.breaker.describe()
+        }
+
+    def close(self):
+        self._session.close()
+        if self._probe_session is not None:
+            self._probe_session.close()
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def session_for(base_url, **options):
+    """
+    Return the session shared by all Compute objects talking to base_url,
+    creating it (with 'options') if it does not exist yet.
+    """
+    with _sessions_lock:
+        session = _sessions.get(base_url)
+        if session is None:
+            session = ComputeSession(base_url, **options)
+            _sessions[base_url] = session
+    return session
+
+
+def all_stats():
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+    return [session.stats() for session in sessions]
+
+
+def close_all():
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+
+    for session in sessions:
+        session.close()
@@ -0,0 +1,107 @@
+import os
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+
+from agief_experiment import utils
+
+
+class InputCache:
+    """
+        Content addressed cache of input files, in a folder on the Compute
+        host (e.g. AGI_RUN_HOME/input-cache). Each file is stored once, under
+        the sha256 of its contents, and Compute loads it from there with
+        /import-local, rather than it being uploaded with every run.
+    """
+
+    # folder of the cache, in the run folder
+    CACHE_FOLDER = 'input-cache'
+
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, host_node, cache_dir, min_size=16 * 1024 * 1024):
+        """
+        :param host_node: the machine Compute runs on
+        :param cache_dir: the cache folder, as a path on that machine. None
+                          for CACHE_FOLDER in the run folder of a remote
+                          machine (AGI_RUN_HOME of its variables file),
+                          looked up the first time it is needed
+        :param min_size: smaller files are not worth hashing and checking
+                         for, and are uploaded as usual
+        """
+        self.host_node = host_node
+        self.cache_dir = cache_dir
+        self.min_size = min_size
+
+        # (filepath, size, mtime) -> digest, so files are hashed once
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def applies(self, filepath):
+        return os.path.getsize(filepath) >= self.min_size
+
+    def digest(self, filepath):
+        stat = os.stat(filepath)
+        key = (os.path.abspath(filepath), stat.st_size, stat.st_mtime)
+
+        with self._lock:
+            if key in self._digests:
+                return self._digests[key]
+
+        sha256 = hashlib.sha256()
+        with open(filepath, 'rb') as input_file:
+            for chunk in iter(lambda: input_file.read(self.HASH_CHUNK_SIZE),
+                              b''):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+
+        with self._lock:
+            self._digests[key] = digest
+        return digest
+
+    def _cache_dir(self):
+        with self._lock:
+            if self.cache_dir is None:
+                run_home = utils.remote_variable(self.host_node,
+                                                 'AGI_RUN_HOME')
+                self.cache_dir = os.path.join(run_home, self.CACHE_FOLDER)
+            return self.cache_dir
+
+    def cached_filepath(self, filepath):
+        """ Path of the file in the cache (keeping its extension) """
+        extension = os.path.splitext(filepath)[1]
+        return os.path.join(self._cache_dir(),
+                            self.digest(filepath) + extension)
+
+    def place(self, filepath):
+        """
+        Make sure the file is in the cache on the Compute host, transferring
+        it if it isn't there yet. A remote host is checked over SFTP for the
+        file, rather than trusting that it is there.
+
+        :return: (path of the file on the Compute host, True if it had to be
+                 transferred)
+        """
+        cached_filepath = self.cached_filepath(filepath)
+
+        if self.host_node.remote():
+            if utils.remote_file_exists(self.host_node, cached_filepath):
+                return cached_filepath, False
+            utils.remote_put_file(self.host_node, filepath, cached_filepath)
+            return cached_filepath, True
+
+        if os.path.isfile(cached_filepath):
+            return cached_filepath, False
+
+        utils.create_folder(cached_filepath)
+        part_filepath = cached_filepath + '.' + uuid.uuid4().hex + '.part'
+        # a copy rather than a hard link, so that the cached file can't
+        # change if the input file is later written to in place
+        shutil.copyfile(filepath, part_filepath)
+        os.rename(part_filepath, cached_filepath)
+
+        logging.debug("Input cache: %s stored as %s", filepath,
+                      cached_filepath)
+        return cached_filepath, True
@@ -0,0 +1,198 @@
+import re
+
+
+class JsonStreamChecker:
+    """
+        Check that a stream of bytes is a single, well formed json array or
+        object, chunk by chunk, without parsing or holding it in memory.
+
+        Only the structure is checked: strings are terminated, brackets and
+        braces are balanced and matched, and nothing follows the top level
+        value. Scalars between the structural characters are not validated.
+    """
+
+    _STRUCTURAL = re.compile(br'[\\"\[\]{}]')
+    _WHITESPACE = b' \t\r\n'
+    _CLOSING = {b']'[0]: b'['[0], b'}'[0]: b'{'[0]}
+
+    def __init__(self):
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.complete = False
+        self.error = None
+        self.num_bytes = 0
+
+    def feed(self, chunk):
+        if self.error is not None or not chunk:
+            return
+        offset = self.num_bytes
+        self.num_bytes += len(chunk)
+
+        if self.complete:
+            self._check_trailing(chunk, 0, offset)
+            return
+
+        pos = 0
+        if not self.started:
+            stripped = chunk.lstrip(self._WHITESPACE)
+            if not stripped:
+                return
+            if stripped[:1] not in (b'[', b'{'):
+                self._fail(offset, "does not start with '[' or '{'")
+                return
+            self.started = True
+            pos = len(chunk) - len(stripped)
+
+        if self.escape:
+            # the escaped character is the first one in this chunk
+            self.escape = False
+            pos += 1
+
+        skip = -1
+        for match in self._STRUCTURAL.finditer(chunk, pos):
+            index = match.start()
+            if index == skip:
+                continue
+
+            char = chunk[index]
+            if self.in_string:
+                if char == b'\\'[0]:
+                    skip = index + 1
+                    if skip == len(chunk):
+                        self.escape = True
+                elif char == b'"'[0]:
+                    self.in_string = False
+            elif char == b'"'[0]:
+                self.in_string = True
+            elif char in self._CLOSING:
+                if not self.stack or self.stack.pop() != self._CLOSING[char]:
+                    self._fail(offset + index, "unbalanced '" +
+                               chr(char) + "'")
+                    return
+                if not self.stack:
+                    self.complete = True
+                    self._check_trailing(chunk, index + 1, offset)
+                    return
+            elif char == b'\\'[0]:
+                self._fail(offset + index, "escape outside of a string")
+                return
+            else:
+                self.stack.append(char)
+
+    def _check_trailing(self, chunk, start, offset):
+        rest = chunk[start:]
+        if rest.strip(self._WHITESPACE):
+            self._fail(offset + start, "data after the end of the json")
+
+    def _fail(self, position, reason):
+        self.error = reason + " (at byte " + str(position) + ")"
+
+    def finish(self):
+        """
+        Call at the end of the stream.
+        :return: None if the stream was well formed, otherwise the reason
+        """
+        if self.error is None:
+            if not self.started:
+                self.error = "empty"
+            elif not self.complete:
+                self.error = "truncated, " + str(len(self.stack)) + \
+                             " unclosed bracket(s)"
+        return self.error
+
+
+class JsonArraySplitter:
+    """
+        Split a stream of bytes of a json array into the raw bytes of its
+        items, chunk by chunk, without parsing them. Only the top level array
+        is split, its items are returned as they are (less surrounding
+        whitespace). The array is assumed to be well formed, see
+        JsonStreamChecker.
+    """
+
+    _STRUCTURAL = re.compile(br'[\\",\[\]{}]')
+    _WHITESPACE = b' \t\r\n'
+    _OPENING = (b'['[0], b'{'[0])
+    _CLOSING = (b']'[0], b'}'[0])
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.complete = False
+        self._item = []
+
+    def feed(self, chunk):
+        """
+        :return: list of the items completed by this chunk
+        :raises ValueError: if the stream is not a json array
+        """
+        items = []
+        if self.complete or not chunk:
+            return items
+
+        pos = 0
+        if not self.started:
+            stripped = chunk.lstrip(self._WHITESPACE)
+            if not stripped:
+                return items
+            if stripped[:1] != b'[':
+                raise ValueError("not a json array")
+            self.started = True
+            self.depth = 1
+            pos = len(chunk) - len(stripped) + 1
+
+        item_start = pos
+        if self.escape:
+            # the escaped character is the first one in this chunk
+            self.escape = False
+            pos += 1
+
+        skip = -1
+        for match in self._STRUCTURAL.finditer(chunk, pos):
+            index = match.start()
+            if index == skip:
+                continue
+
+            char = chunk[index]
+            if self.in_string:
+                if char == b'\\'[0]:
+                    skip = index + 1
+                    if skip == len(chunk):
+                        self.escape = True
+                elif char == b'"'[0]:
+                    self.in_string = False
+            elif char == b'"'[0]:
+                self.in_string = True
+            elif char in self._OPENING:
+                self.depth += 1
+            elif char in self._CLOSING:
+                self.depth -= 1
+                if self.depth == 0:
+                    self._end_item(chunk, item_start, index, items)
+                    self.complete = True
+                    return items
+            elif char == b','[0] and self.depth == 1:
+                self._end_item(chunk, item_start, index, items)
+                item_start = index + 1
+
+        self._item.append(chunk[item_start:])
+        return items
+
+    def _end_item(self, chunk, start, end, items):
+        self._item.append(chunk[start:end])
+        item = b''.join(self._item).strip(self._WHITESPACE)
+        self._item = []
+        if item:
+            items.append(item)
+
+    def finish(self):
+        """
+        Call at the end of the stream.
+        :raises ValueError: if the array was not closed
+        """
+        if not self.complete:
+            raise ValueError("truncated json array")
@@ -0,0 +1,83 @@
+import os
+import re
+
+from agief_experiment import utils
+
+
+class LaunchLog:
+    """
+        Watch the process and log files of a local Compute launch, to report
+        a failed launch as soon as it shows up, rather than after waiting out
+        the full start up timeout.
+    """
+
+    # lines that mean Compute will not come up. Missing files and commands
+    # only count when bash itself reports them, i.e. the launch script could
+    # not be run, not when they turn up in Compute's own output.
+    FATAL_PATTERNS = re.compile(r'Exception in thread "main"|'
+                                r'Error: Could not find or load main class|'
+                                r'OutOfMemoryError|'
+                                r'Address already in use|'
+                                r'^docker: Error|'
+                                r'^(/bin/)?bash: .*(No such file or directory|'
+                                r'command not found)$')
+
+    # lines that mean the REST server has started
+    STARTED_PATTERNS = re.compile(r'Started ServerConnector|Server started')
+
+    def __init__(self, process, log_filepaths):
+        """
+        :param process: the subprocess.Popen of the launch command
+        :param log_filepaths: files the launch command writes its output to,
+                              which must not hold the output of an earlier
+                              launch (see remove_logs)
+        """
+        self.process = process
+        self.offsets = dict((filepath, 0) for filepath in log_filepaths)
+        self.partial = dict((filepath, '') for filepath in log_filepaths)
+        self.started = False
+
+    @staticmethod
+    def remove_logs(log_filepaths):
+        """
+        Remove the log files of an earlier launch, before launching, so that
+        its output is not read as that of the new launch
+        """
+        for filepath in log_filepaths:
+            utils.remove_file(filepath, True)
+
+    def _new_lines(self):
+        for filepath in self.offsets:
+            if not os.path.isfile(filepath):
+                continue
+
+            with open(filepath, 'r') as log_file:
+                log_file.seek(self.offsets[filepath])
+                text = log_file.read()
+                self.offsets[filepath] = log_file.tell()
+
+            lines = (self.partial[filepath] + text).split('\n')
+            # the last line may be incomplete, keep it for the next read
+            self.partial[filepath] = lines.pop()
+            for line in lines:
+                yield filepath, line
+
+    def fatal_error(self):
+        """
+        Read any new output of the launch.
+        :return: description of the error if the launch has failed, or None
+        """
+
+        for filepath, line in self._new_lines():
+            if self.STARTED_PATTERNS.search(line):
+                self.started = True
+            if self.FATAL_PATTERNS.search(line):
+                return os.path.basename(filepath) + ": " + line.strip()
+
+        # the launch script may exit once it has started Compute (e.g. in a
+        # detached docker container), but not with an error
+        status = self.process.poll()
+        if status is not None and status != 0:
+            return "launch command exited with status " + str(status)
+
+        return None
@@ -4,9 +4,17 @@ from enum import Enum
 class LaunchMode(Enum):
     per_experiment = 1
     per_session = 2
+    # launched once, and cleared of the previous run's entities between runs
+    warm_reset = 3
 
     @classmethod
     def from_args(cls, args):
+        if args.launch_warm_reset:
+            return cls.warm_reset
         return (cls.per_session
                 if args.launch_per_session
                 else cls.per_experiment)
+
+    def is_launched_once(self):
+        """ True if Compute is launched at the start of the session """
+        return self is not LaunchMode.per_experiment
@@ -0,0 +1,240 @@
+import json
+import bisect
+import threading
+from contextlib import contextmanager
+
+
+class Histogram:
+    """
+        Latency histogram with fixed, roughly logarithmic buckets, cheap
+        enough to update on every request and to merge across runs.
+    """
+
+    # upper bounds of the buckets, in seconds (the last bucket is unbounded)
+    BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5,
+              10, 30, 60, 300)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """
+        Upper bound of the bucket the q-th percentile falls in (at most the
+        max), or None if there are no samples.
+        """
+        if not self.count:
+            return None
+        rank = q / 100.0 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count and i < len(self.BOUNDS):
+                return min(self.BOUNDS[i], self.max)
+        return self.max
+
+    def to_dict(self):
+        buckets = {}
+        for i, count in enumerate(self.counts):
+            if count:
+                label = "<=%gms" % (1000 * self.BOUNDS[i]) if (
+                    i < len(self.BOUNDS)) else ">%gms" % (
+                    1000 * self.BOUNDS[-1])
+                buckets[label] = count
+        return {
+            'count': self.count,
+            'mean_ms': round(1000 * self.total / self.count, 2)
+            if self.count else None,
+            'p50_ms': _ms(self.percentile(50)),
+            'p95_ms': _ms(self.percentile(95)),
+            'max_ms': round(1000 * self.max, 2),
+            'buckets': buckets
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(1000 * seconds, 2)
+
+
+class EndpointStats:
+    """ Latency and bytes of the requests to an endpoint, e.g. POST /config """
+
+    def __init__(self):
+        self.ok = Histogram()
+        self.error = Histogram()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # time spent reading streamed response bodies, after the latency
+        self.transfer_seconds = 0.0
+
+    def add(self, seconds, is_error, bytes_sent, bytes_received):
+        (self.error if is_error else self.ok).add(seconds)
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+
+    def add_transfer(self, seconds, bytes_received):
+        self.transfer_seconds += seconds
+        self.bytes_received += bytes_received
+
+    def merge(self, other):
+        self.ok.merge(other.ok)
+        self.error.merge(other.error)
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+        self.transfer_seconds += other.transfer_seconds
+
+    def all(self):
+        histogram = Histogram()
+        histogram.merge(self.ok)
+        histogram.merge(self.error)
+        return histogram
+
+    def to_dict(self):
+        return {
+            'requests': self.ok.count + self.error.count,
+            'errors': self.error.count,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'transfer_seconds': round(self.transfer_seconds, 3),
+            'all': self.all().to_dict(),
+            'ok': self.ok.to_dict(),
+            'error': self.error.to_dict()
+        }
+
+
+class RequestMetrics:
+    """
+        EndpointStats of the requests to Compute, by method and path. One is
+        collected per run (see scope()), and they are merged for the session.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def _stats(self, method, path):
+        key = method + " " + path
+        stats = self._endpoints.get(key)
+        if stats is None:
+            stats = self._endpoints[key] = EndpointStats()
+        return stats
+
+    def record(self, method, path, seconds, is_error, bytes_sent=0,
+               bytes_received=0):
+        """
+        A request, 'seconds' from sending it to the response headers (the
+        body of a streamed response is recorded with record_transfer())
+        """
+        with self._lock:
+            self._stats(method, path).add(seconds, is_error, bytes_sent,
+                                          bytes_received)
+
+    def record_transfer(self, method, path, seconds, bytes_received):
+        """ Reading the body of a streamed response """
+        with self._lock:
+            self._stats(method, path).add_transfer(seconds, bytes_received)
+
+    def merge(self, other):
+        with other._lock:  # pylint: disable=W0212
+            endpoints = list(other._endpoints.items())  # pylint: disable=W0212
+        with self._lock:
+            for key, other_stats in endpoints:
+                method, _, path = key.partition(" ")
+                self._stats(method, path).merge(other_stats)
+
+    def to_dict(self):
+        with self._lock:
+            return dict((key, stats.to_dict())
+                        for key, stats in sorted(self._endpoints.items()))
+
+    def write(self, filepath):
+        with open(filepath, 'w') as metrics_file:
+            metrics_file.write(json.dumps(self.to_dict(), indent=4))
+
+    def summary_lines(self):
+        """ One line per endpoint, for the console """
+        lines = []
+        for key, stats in sorted(self.to_dict().items()):
+            latency = stats['all']
+            lines.append("%-16s %6d requests, %4d errors, p50 %s ms, p95 %s "
+                         "ms, max %.1f ms, %.2f MB sent, %.2f MB received" %
+                         (key, stats['requests'], stats['errors'],
+                          latency['p50_ms'], latency['p95_ms'],
+                          latency['max_ms'], stats['bytes_sent'] / 1e6,
+                          stats['bytes_received'] / 1e6))
+        return lines
+
+
+_scopes = threading.local()
+
+
+@contextmanager
+def scope(metrics=None):
+    """
+    Record the requests made on the current thread into 'metrics' (a new
+    RequestMetrics by default) for the duration of the 'with' block, e.g.
+    those of one run. Scopes nest, a request is recorded in all of them.
+    """
+    if metrics is None:
+        metrics = RequestMetrics()
+
+    stack = getattr(_scopes, 'stack', None)
+    if stack is None:
+        stack = _scopes.stack = []
+
+    stack.append(metrics)
+    try:
+        yield metrics
+    finally:
+        stack.remove(metrics)
+
+
+def current():
+    """ The innermost RequestMetrics of the current thread, or None """
+    stack = getattr(_scopes, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def propagate(function):
+    """
+    Wrap 'function' to record into the scopes of the calling thread, when
+    it is called on another thread (e.g. by a ThreadPoolExecutor)
+    """
+    stack = list(getattr(_scopes, 'stack', None) or ())
+
+    def in_scopes(*args, **kwargs):
+        previous = getattr(_scopes, 'stack', None)
+        _scopes.stack = stack
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _scopes.stack = previous
+
+    return in_scopes
+
+
+def record(method, path, seconds, is_error, bytes_sent=0, bytes_received=0):
+    """ Record a request in the scopes of the current thread, if any """
+    for metrics in getattr(_scopes, 'stack', None) or ():
+        metrics.record(method, path, seconds, is_error, bytes_sent,
+                       bytes_received)
+
+
+def record_transfer(method, path, seconds, bytes_received):
+    """ Record reading a streamed response body, see record() """
+    for metrics in getattr(_scopes, 'stack', None) or ():
+        metrics.record_transfer(method, path, seconds, bytes_received)
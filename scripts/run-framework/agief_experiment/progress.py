@@ -0,0 +1,131 @@
+import csv
+import time
+
+
+class ComputeStalled(Exception):
+    """ The age of a run has stopped advancing, see RunProgress.stalled() """
+    pass
+
+
+class RunProgress:
+    """
+        Time series of (wall clock, age, runTime) samples of one run, taken
+        by Compute.wait_till_param on every poll, with the throughput (age
+        steps per second) and projected completion time worked out from it.
+    """
+
+    # samples used for the current throughput, older ones are ignored so
+    # that the projection follows changes of speed during the run
+    WINDOW = 20
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.start = clock()
+        self.samples = []
+        self.termination_age = None
+
+    def sample(self, age, runtime, termination_age=None):
+        if age is None:
+            return
+        # only keep samples where something happened, a long run polled
+        # every few seconds would otherwise fill up with duplicates
+        if self.samples and self.samples[-1][1] == age:
+            return
+        self.samples.append((self.clock(), age, runtime))
+        if termination_age:
+            self.termination_age = termination_age
+
+    def _rate(self, samples):
+        if len(samples) < 2:
+            return None
+        t0, age0, _ = samples[0]
+        t1, age1, _ = samples[-1]
+        if t1 <= t0:
+            return None
+        return (age1 - age0) / (t1 - t0)
+
+    def steps_per_second(self):
+        """ Throughput over the whole run, or None if not yet known """
+        return self._rate(self.samples)
+
+    def current_steps_per_second(self):
+        """ Throughput over the last WINDOW samples """
+        return self._rate(self.samples[-self.WINDOW:])
+
+    def step_interval(self):
+        """ Mean seconds between changes of age, or None if not yet known """
+        if len(self.samples) < 2:
+            return None
+        return (self.samples[-1][0] - self.samples[0][0]) / (
+            len(self.samples) - 1)
+
+    def stalled(self, multiple, min_seconds):
+        """
+        :param multiple: age is stalled if it hasn't changed for 'multiple'
+                         times the usual interval between changes
+        :param min_seconds: but never before this many seconds
+        :return: seconds since age last changed if the run has stalled,
+                 otherwise None
+        """
+        if not multiple:
+            return None
+
+        now = self.clock()
+        last_change = self.samples[-1][0] if self.samples else self.start
+        idle = now - last_change
+
+        # before the interval is known, only min_seconds applies
+        limit = min_seconds
+        interval = self.step_interval()
+        if interval is not None:
+            limit = max(limit, multiple * interval)
+
+        return idle if idle > limit else None
+
+    def eta(self):
+        """
+        :return: projected wall clock time (seconds since the epoch) at which
+                 age reaches terminationAge, or None if it can't be projected
+        """
+        rate = self.current_steps_per_second()
+        if not self.termination_age or not rate or rate <= 0:
+            return None
+        t, age, _ = self.samples[-1]
+        return t + max(self.termination_age - age, 0) / rate
+
+    def describe(self):
+        """ Short progress line for the console, e.g. in the wait loop """
+        if not self.samples:
+            return ""
+
+        description = ""
+        rate = self.current_steps_per_second()
+        if rate is not None:
+            description += ", %.2f steps/s" % rate
+
+        eta = self.eta()
+        if eta is not None:
+            description += ", %d / %d, eta %s (in %d s)" % (
+                self.samples[-1][1], self.termination_age,
+                time.strftime("%H:%M:%S", time.localtime(eta)),
+                max(eta - self.clock(), 0))
+        return description
+
+    def summary(self):
+        """ Throughput of the run, for the experiment info """
+        rate = self.steps_per_second()
+        if rate is None:
+            return "Throughput: unknown"
+
+        t0, age0, _ = self.samples[0]
+        t1, age1, _ = self.samples[-1]
+        return "Throughput: %.2f steps/s (age %d to %d in %.1f s)" % (
+            rate, age0, age1, t1 - t0)
+
+    def write(self, filepath):
+        """ Write the series as csv """
+        with open(filepath, 'w') as progress_file:
+            writer = csv.writer(progress_file)
+            writer.writerow(['time', 'age', 'runTime'])
+            for t, age, runtime in self.samples:
+                writer.writerow(['%.3f' % t, age, runtime])
@@ -0,0 +1,11 @@
+from enum import Enum
+
+
+class RunStatus(Enum):
+    succeeded = 1
+    # the parameter set failed, but the Compute node is still healthy
+    failed = 2
+    # the Compute node stopped responding, the run can be retried elsewhere
+    node_failed = 3
+    # the run stopped making progress, and was given up
+    stalled = 4
@@ -0,0 +1,126 @@
+import os
+import uuid
+import threading
+
+from agief_experiment import utils
+
+
+class StreamReplacer:
+    """
+        Replace 'old' by 'new' in a stream of byte chunks, as bytes.replace
+        would on the whole stream, including occurrences split across chunks.
+    """
+
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+        self.count = 0
+        self._pending = b''
+
+    def feed(self, chunk):
+        """ :return: the bytes of the output that are complete """
+        data = self._pending + chunk
+        output = []
+
+        position = 0
+        while True:
+            index = data.find(self.old, position)
+            if index == -1:
+                break
+            output.append(data[position:index])
+            output.append(self.new)
+            position = index + len(self.old)
+            self.count += 1
+
+        # the end could be the start of an occurrence, keep it for the next
+        # chunk
+        keep = max(position, len(data) - len(self.old) + 1)
+        output.append(data[position:keep])
+        self._pending = data[keep:]
+        return b''.join(output)
+
+    def finish(self):
+        """ :return: the rest of the output """
+        pending, self._pending = self._pending, b''
+        return pending
+
+
+_counts = {}
+_counts_lock = threading.Lock()
+
+
+def count_occurrences(filepath, old, chunk_size=1024 * 1024):
+    """
+    Number of (non overlapping) occurrences of 'old' in the file. Memoised
+    by the file's size and modification time, as the same base files are
+    counted for every parameter set.
+    """
+    stat = os.stat(filepath)
+    key = (os.path.abspath(filepath), stat.st_size, stat.st_mtime, old)
+
+    with _counts_lock:
+        if key in _counts:
+            return _counts[key]
+
+    replacer = StreamReplacer(old, b'')
+    with open(filepath, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(chunk_size), b''):
+            replacer.feed(chunk)
+
+    with _counts_lock:
+        _counts[key] = replacer.count
+    return replacer.count
+
+
+class SubstitutedFile:
+    """
+        An input file that is a base file with a string replaced (the
+        template prefix, by the prefix of the run), without a copy on disk:
+        the replacement is made on the fly as the file is read, e.g. by the
+        upload to Compute. It is only written to 'filepath' if the file
+        itself is needed, e.g. to archive the input folder.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, source_filepath, filepath, old, new):
+        """
+        :param source_filepath: the base file
+        :param filepath: the path the file would have if it were written
+        """
+        self.source_filepath = source_filepath
+        self.filepath = filepath
+        self.old = old.encode('utf-8')
+        self.new = new.encode('utf-8')
+
+    def size(self):
+        """ Size of the file with the replacements made, in bytes """
+        return os.path.getsize(self.source_filepath) + (
+            count_occurrences(self.source_filepath, self.old) *
+            (len(self.new) - len(self.old)))
+
+    def is_identity(self):
+        """ True if there is nothing to replace, it is the base file """
+        return count_occurrences(self.source_filepath, self.old) == 0
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """ The content, with the replacements made, in chunks """
+        replacer = StreamReplacer(self.old, self.new)
+        with open(self.source_filepath, 'rb') as input_file:
+            for chunk in iter(lambda: input_file.read(chunk_size), b''):
+                output = replacer.feed(chunk)
+                if output:
+                    yield output
+        output = replacer.finish()
+        if output:
+            yield output
+
+    def write(self):
+        """ Write the file to 'filepath' (complete, or not at all) """
+        utils.create_folder(self.filepath)
+        part_filepath = self.filepath + '.' + uuid.uuid4().hex + '.part'
+        with open(part_filepath, 'wb') as output_file:
+            for chunk in self.chunks():
+                output_file.write(chunk)
+        os.rename(part_filepath, self.filepath)
+        return self.filepath
@@ -0,0 +1,124 @@
+import os
+import time
+import uuid
+import zlib
+
+
+class _MultipartStream:
+    """
+        A multipart/form-data request body with a single file field, read
+        from disk chunk by chunk as it is sent, so the file is never held in
+        memory. Same layout as requests' own encoding for files={name: file}.
+
+        The file can also be a substitution.SubstitutedFile ('source'), read
+        from its base file with the replacement made on the fly.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, field_name, filepath, chunk_size=CHUNK_SIZE,
+                 source=None):
+        self.field_name = field_name
+        self.filepath = filepath
+        self.chunk_size = chunk_size
+        self.source = source
+
+        self.boundary = uuid.uuid4().hex
+        self.head = ('--' + self.boundary + '\r\n' +
+                     'Content-Disposition: form-data; name="' + field_name +
+                     '"; filename="' + os.path.basename(filepath) + '"' +
+                     '\r\n\r\n').encode('utf-8')
+        self.tail = ('\r\n--' + self.boundary + '--\r\n').encode('utf-8')
+
+        # bytes read from the file, and bytes sent on the wire
+        self.file_bytes = 0
+        self.wire_bytes = 0
+
+    def headers(self):
+        return {'Content-Type':
+                'multipart/form-data; boundary=' + self.boundary}
+
+    def _file_size(self):
+        if self.source is not None:
+            return self.source.size()
+        return os.path.getsize(self.filepath)
+
+    def _raw_chunks(self):
+        yield self.head
+        if self.source is not None:
+            for chunk in self.source.chunks(self.chunk_size):
+                self.file_bytes += len(chunk)
+                yield chunk
+            yield self.tail
+            return
+
+        with open(self.filepath, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                self.file_bytes += len(chunk)
+                yield chunk
+        yield self.tail
+
+
+class MultipartFileStream(_MultipartStream):
+    """
+        The file sent as is. Sized (via __len__) so that it is sent with a
+        Content-Length, as the buffered upload was.
+    """
+
+    def __len__(self):
+        return len(self.head) + self._file_size() + len(self.tail)
+
+    def __iter__(self):
+        for chunk in self._raw_chunks():
+            self.wire_bytes += len(chunk)
+            yield chunk
+
+
+class GzipMultipartFileStream(_MultipartStream):
+    """
+        The body gzip compressed on the fly (Content-Encoding: gzip). The
+        compressed size is unknown up front, so it is sent with chunked
+        transfer encoding.
+    """
+
+    def headers(self):
+        headers = _MultipartStream.headers(self)
+        headers['Content-Encoding'] = 'gzip'
+        return headers
+
+    def __iter__(self):
+        # wbits = 16 + MAX_WBITS for a gzip header and trailer
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+        for chunk in self._raw_chunks():
+            compressed = compressor.compress(chunk)
+            if compressed:
+                self.wire_bytes += len(compressed)
+                yield compressed
+
+        compressed = compressor.flush()
+        self.wire_bytes += len(compressed)
+        yield compressed
+
+
+class UploadTimer:
+    """ Measure the throughput of one upload. """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.start = time.time()
+        self.duration = None
+
+    def stop(self):
+        self.duration = time.time() - self.start
+
+    def summary(self):
+        megabytes = self.stream.file_bytes / (1024.0 * 1024.0)
+        wire_megabytes = self.stream.wire_bytes / (1024.0 * 1024.0)
+        duration = max(self.duration or 0, 1e-6)
+        return ("%s: %.2f MB in %.2f s (%.2f MB/s), %.2f MB sent" %
+                (os.path.basename(self.stream.filepath), megabytes, duration,
+                 megabytes / duration, wire_megabytes))
@@ -16,6 +16,7 @@
 """Utilities and helper methods."""
 
 import json
+import re
 import subprocess
 import os
 import errno
@@ -29,6 +30,7 @@ import itertools
 import select
 import socket
 import io
+import uuid
 
 import paramiko
 
@@ -67,19 +69,31 @@ def getbaseurl(host, port):
 
 
 def filepath_from_env_variable(filename, path_env):
-  cmd = "echo $" + path_env
-  output, _ = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                               executable="/bin/bash").communicate()
-
-  file_path = cleanpath(output, filename)
+  # the environment of this process is what a child 'echo $' would see
+  file_path = cleanpath(expand_variable(path_env, os.environ), filename)
   return file_path
 
 
+def expand_variable(expression, variables):
+  """
+  The value of '$' + expression in a shell with 'variables', e.g. 'HOME' or
+  'AGI_HOME/bin/'. Unset variables are empty, as in the shell.
+  """
+  match = re.match(r'([A-Za-z_][A-Za-z0-9_]*)(.*)$', expression, re.DOTALL)
+  if match is None:
+    return '$' + expression
+  return variables.get(match.group(1), '') + match.group(2)
+
+
 def cleanpath(path, filename):
   """
   Given a path and a filename, return the fully qualified filename with path
   """
 
+  # output of a subprocess is bytes in python 3
+  if isinstance(path, bytes):
+    path = path.decode('utf-8')
+
   path_from_env = path.strip()
   filename = filename.strip()
   filename = filename.lstrip('/')
@@ -348,16 +362,13 @@ def docker_stop(container_id=None):
   return exit_status
 
 
-def remote_run(host_node, cmd, timeout=3600, max_repeats=15, wait_period=5):
+def ssh_connect(host_node, max_repeats=15, wait_period=5):
   """
-  Runs a set of commands on a remote machine over SSH using paramiko.
+  Connect to the remote machine over SSH using paramiko, retrying on failure.
 
   :param host_node: HostNode object
-  :param cmd: The commands to be executed
+  :return: the paramiko.SSHClient, to be closed by the caller
   """
-  stdout_chunks = []
-  exit_status_code = -1
-
   client = paramiko.SSHClient()
   client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
@@ -374,6 +385,81 @@ def remote_run(host_node, cmd, timeout=3600, max_repeats=15, wait_period=5):
             paramiko.ssh_exception.socket.error):
       time.sleep(wait_period)
 
+  return client
+
+
+def remote_file_exists(host_node, filepath):
+  """
+  Check whether a file exists on the remote machine, over SFTP.
+  """
+  client = ssh_connect(host_node)
+  try:
+    sftp = client.open_sftp()
+    try:
+      sftp.stat(filepath)
+      return True
+    except IOError:
+      return False
+    finally:
+      sftp.close()
+  finally:
+    client.close()
+
+
+def remote_variable(host_node, name):
+  """
+  The value of a variable of the VARIABLES_FILE on the remote machine,
+  e.g. AGI_RUN_HOME.
+  """
+  cmd = ('source ' + host_node.remote_variables_file +
+         ' > /dev/null && echo "$' + name + '"')
+  output = ''.join(remote_run(host_node, cmd)).strip()
+  if not output:
+    raise ValueError('Variable ' + name + ' is not set in ' +
+                     host_node.remote_variables_file)
+  # the last line, after anything the variables file printed
+  return output.splitlines()[-1].strip()
+
+
+def remote_put_file(host_node, source_filepath, dest_filepath):
+  """
+  Copy a local file to the remote machine, over SFTP. The file is written
+  under a temporary name and then renamed, so it is never seen half written.
+  """
+  client = ssh_connect(host_node)
+  try:
+    sftp = client.open_sftp()
+    try:
+      # create the destination folder, one level at a time
+      folder = ''
+      for part in os.path.dirname(dest_filepath).split('/'):
+        folder += part + '/'
+        try:
+          sftp.stat(folder)
+        except IOError:
+          sftp.mkdir(folder)
+
+      part_filepath = dest_filepath + '.' + uuid.uuid4().hex + '.part'
+      sftp.put(source_filepath, part_filepath)
+      sftp.posix_rename(part_filepath, dest_filepath)
+    finally:
+      sftp.close()
+  finally:
+    client.close()
+
+
+def remote_run(host_node, cmd, timeout=3600, max_repeats=15, wait_period=5):
+  """
+  Runs a set of commands on a remote machine over SSH using paramiko.
+
+  :param host_node: HostNode object
+  :param cmd: The commands to be executed
+  """
+  stdout_chunks = []
+  exit_status_code = -1
+
+  client = ssh_connect(host_node, max_repeats, wait_period)
+
   try:
     logging.debug("Executing command remotely = %s", cmd)
 
@@ -11,7 +11,8 @@ class ValueSeries:
 
     @classmethod
     def from_range(cls, minv, maxv, deltav):
-        series = numpy.arange(minv, maxv, deltav)
+        # as python numbers, numpy's can't be serialised to json
+        series = numpy.arange(minv, maxv, deltav).tolist()
         return cls(series)
 
     def value(self):
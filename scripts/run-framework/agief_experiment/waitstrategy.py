@@ -0,0 +1,185 @@
+import time
+import random
+
+
+class WaitStrategy:
+    """
+        Decides how long Compute.wait_till_param sleeps between polls of the
+        entity config. The wait loop calls reset() at the start of each wait,
+        observe() after every successful poll, next_interval() before
+        sleeping and finished() once the parameter has reached its value.
+    """
+
+    name = None
+
+    # if True, the wait loop asks the node to hold the /config request until
+    # the parameter reaches its value (only used if the node supports it)
+    long_poll = False
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+
+    def reset(self):
+        pass
+
+    def observe(self, age, runtime, termination_age):
+        """
+        :param age: value.age of the entity being waited on
+        :param runtime: value.runTime (ms) of the entity being waited on
+        :param termination_age: value.terminationAge, or None if not set
+        """
+        pass
+
+    def next_interval(self):
+        raise NotImplementedError()
+
+    def finished(self):
+        pass
+
+    def describe(self):
+        return self.name
+
+
+class FixedWaitStrategy(WaitStrategy):
+    """ Poll every 'period' seconds (the original behaviour). """
+
+    name = 'fixed'
+
+    def __init__(self, period=10, clock=time.time):
+        WaitStrategy.__init__(self, clock)
+        self.period = period
+
+    def next_interval(self):
+        return self.period
+
+    def describe(self):
+        return "try every " + str(self.period) + "s"
+
+
+class AdaptiveWaitStrategy(WaitStrategy):
+    """
+        Poll often near the expected end of the run, and back off
+        (exponentially, with jitter) while the end is far away.
+
+        The remaining time is projected from the progress of 'age' towards
+        'terminationAge'. If the entity has no termination age, the wall
+        clock duration of previous runs is used as the expected duration.
+        Without either, it falls back to plain exponential backoff.
+    """
+
+    name = 'adaptive'
+
+    def __init__(self, min_interval=0.25, max_interval=10, backoff=1.5,
+                 jitter=0.1, near_fraction=0.5, clock=time.time,
+                 rng=random.random):
+        """
+        :param min_interval: shortest sleep between polls (seconds)
+        :param max_interval: longest sleep between polls (seconds)
+        :param backoff: growth factor of the interval while far from done
+        :param jitter: relative jitter applied to the backoff interval
+        :param near_fraction: sleep at most this fraction of the projected
+                              remaining time, so polls tighten towards the end
+        """
+        WaitStrategy.__init__(self, clock)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.near_fraction = near_fraction
+        self.rng = rng
+
+        # learned across runs: exponentially weighted mean run duration
+        self.expected_duration = None
+
+        self.reset()
+
+    def reset(self):
+        self.start_time = self.clock()
+        self.first_sample = None
+        self.remaining = None
+        self.overdue = False
+        self.interval = self.min_interval
+
+    def observe(self, age, runtime, termination_age):
+        now = self.clock()
+
+        if age is None:
+            return
+
+        if self.first_sample is None:
+            self.first_sample = (now, age)
+
+        self.remaining = None
+
+        t0, age0 = self.first_sample
+        rate = (age - age0) / (now - t0) if now > t0 else 0
+
+        if termination_age and rate > 0:
+            self.remaining = max(termination_age - age, 0) / rate
+        elif self.expected_duration is not None:
+            elapsed = now - self.start_time
+            self.remaining = max(self.expected_duration - elapsed, 0)
+
+        # past the projected end, the projection was wrong: start backing off
+        # again from the shortest interval, rather than polling at it forever
+        if self.remaining == 0:
+            if not self.overdue:
+                self.overdue = True
+                self.interval = self.min_interval
+            self.remaining = None
+
+    def next_interval(self):
+        # exponential backoff, with jitter so many runs don't poll in step
+        interval = self.interval
+        self.interval = min(self.interval * self.backoff, self.max_interval)
+        interval *= 1 + self.jitter * (2 * self.rng() - 1)
+
+        # but never sleep past the projected end of the run
+        if self.remaining is not None:
+            interval = min(interval, self.remaining * self.near_fraction)
+
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def finished(self):
+        duration = self.clock() - self.start_time
+        if self.expected_duration is None:
+            self.expected_duration = duration
+        else:
+            self.expected_duration = (0.7 * self.expected_duration +
+                                      0.3 * duration)
+
+    def describe(self):
+        return "adaptive, every %gs to %gs" % (self.min_interval,
+                                               self.max_interval)
+
+
+class LongPollWaitStrategy(AdaptiveWaitStrategy):
+    """
+        Ask the node to block the /config request until the parameter
+        reaches its value, or 'timeout' seconds have passed. Behaves as the
+        adaptive strategy on nodes that do not support long polling.
+    """
+
+    name = 'long-poll'
+    long_poll = True
+
+    def __init__(self, timeout=30, **kwargs):
+        AdaptiveWaitStrategy.__init__(self, **kwargs)
+        self.timeout = timeout
+
+    def describe(self):
+        return "long-poll, up to %gs per request" % self.timeout
+
+
+STRATEGIES = {
+    FixedWaitStrategy.name: FixedWaitStrategy,
+    AdaptiveWaitStrategy.name: AdaptiveWaitStrategy,
+    LongPollWaitStrategy.name: LongPollWaitStrategy
+}
+
+
+def from_name(name):
+    if name not in STRATEGIES:
+        raise ValueError("ERROR: unknown wait strategy '" + str(name) +
+                         "', options are: " + ", ".join(sorted(STRATEGIES)))
+    return STRATEGIES[name]()
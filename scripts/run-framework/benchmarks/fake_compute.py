@@ -0,0 +1,375 @@
+"""
+A stand-in for the Compute REST API, to exercise run-framework without an
+AGIEF Compute node (and its JVM).
+
+Implements /version, /config (GET and POST), /import, /import-local,
+/update, /export (including 'export-shallow' of the data of one entity, if
+advertised), /delete (if 'delete' is advertised) and /stop. Entities are
+kept in memory, as imported from entity files. After /update of an entity, its age advances
+linearly to its terminationAge over 'run_duration' seconds, and then it is
+terminated. Data files are accepted and counted, but not kept.
+
+Run a server from scripts/run-framework, e.g.
+    python -m benchmarks.fake_compute --port 8491 --run_duration 5
+or start one in process with FakeCompute(...).start(), as the benchmarks do.
+"""
+
+from __future__ import print_function
+
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from collections import Counter
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeCompute:
+    """ The state of the fake node, and the server that exposes it. """
+
+    DEFAULT_TERMINATION_AGE = 1000
+
+    def __init__(self, host='localhost', port=0, latency=0.0,
+                 run_duration=1.0, export_size=1024 * 1024,
+                 capabilities=(), error_rate=0.0):
+        """
+        :param port: 0 to pick a free port, see port() once started
+        :param latency: seconds added to every response
+        :param run_duration: seconds from /update of an entity until it is
+                             terminated
+        :param export_size: approximate size in bytes of a 'data' export
+        :param capabilities: capabilities advertised by /version
+        :param error_rate: fraction of requests answered with a 503, as a
+                           flaky node would (can be changed while running)
+        """
+        self.host = host
+        self.latency = latency
+        self.run_duration = run_duration
+        self.export_size = export_size
+        self.capabilities = list(capabilities)
+        self.error_rate = error_rate
+
+        self.lock = threading.Lock()
+        # entity name -> (entity, config dict)
+        self.entities = {}
+        # entity name -> wall clock time of its /update
+        self.started = {}
+        # number of requests per path, and bytes received by /import
+        self.requests = Counter()
+        self.import_bytes = 0
+
+        self.server = _ThreadingHTTPServer((host, port), _Handler)
+        self.server.fake = self
+        self._thread = None
+
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def import_entities(self, entities):
+        with self.lock:
+            for entity in entities:
+                config = entity.get('config') or '{}'
+                # configs are json in a string, sometimes escaped twice
+                while not isinstance(config, dict):
+                    config = json.loads(config)
+                self.entities[entity['name']] = (entity, config)
+
+    def config(self, entity_name):
+        """ The config of the entity, with age and terminated up to date """
+        with self.lock:
+            if entity_name not in self.entities:
+                return None
+            _, config = self.entities[entity_name]
+
+            if entity_name in self.started:
+                elapsed = time.time() - self.started[entity_name]
+                termination_age = int(config.get('terminationAge') or
+                                      self.DEFAULT_TERMINATION_AGE)
+                fraction = min(elapsed / max(self.run_duration, 1e-6), 1.0)
+                config['age'] = int(termination_age * fraction)
+                config['runTime'] = int(elapsed * 1000)
+                if fraction >= 1.0:
+                    config['terminated'] = True
+                    del self.started[entity_name]
+
+            return dict(config)
+
+    def set_config(self, entity_name, path, value):
+        with self.lock:
+            if entity_name not in self.entities:
+                return False
+            config = self.entities[entity_name][1]
+            keys = path.split('.')
+            for key in keys[:-1]:
+                config = config.setdefault(key, {})
+            try:
+                config[keys[-1]] = json.loads(value)
+            except ValueError:
+                config[keys[-1]] = value
+            return True
+
+    def update(self, entity_name):
+        with self.lock:
+            if entity_name not in self.entities:
+                return False
+            self.entities[entity_name][1]['terminated'] = False
+            self.started[entity_name] = time.time()
+            return True
+
+    def delete(self, entity_name):
+        """ Remove the entity and all others with the same prefix """
+        prefix = entity_name.split('--')[0] + '--'
+        with self.lock:
+            for name in list(self.entities):
+                if name == entity_name or name.startswith(prefix):
+                    del self.entities[name]
+                    self.started.pop(name, None)
+
+    def export_entities(self, root_entity):
+        prefix = root_entity.split('--')[0] + '--'
+        with self.lock:
+            entities = [dict(entity, config=json.dumps(config))
+                        for name, (entity, config) in self.entities.items()
+                        if name == root_entity or name.startswith(prefix)]
+        return json.dumps(entities).encode('utf-8')
+
+    def export_data_chunks(self, root_entity, shallow=False):
+        """
+        :return: (size in bytes, generator of the chunks) of a data export
+                 of about export_size bytes, or an even share of it for the
+                 data of a single entity ('shallow')
+        """
+        export_size = self.export_size
+        if shallow:
+            prefix = root_entity.split('--')[0] + '--'
+            with self.lock:
+                num_entities = len([name for name in self.entities
+                                    if name.startswith(prefix)])
+            export_size //= max(num_entities, 1)
+
+        item = json.dumps({'name': root_entity + '-output',
+                           'refKeys': None,
+                           'sizes': '[1000]',
+                           'elements': '[' + ','.join(['0.5'] * 1000) + ']'})
+        item = item.encode('utf-8')
+        count = max(export_size // (len(item) + 1), 1)
+        size = 2 + count * len(item) + (count - 1)
+
+        def chunks():
+            yield b'['
+            batch = 64
+            for start in range(0, count, batch):
+                n = min(batch, count - start)
+                chunk = b','.join([item] * n)
+                yield chunk if start == 0 else b',' + chunk
+            yield b']'
+
+        return size, chunks()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # buffer each response, so the headers and body go out in one write
+    # (flushed once the request is handled), and don't wait on delayed
+    # acks of the keep-alive connection. Otherwise Nagle's algorithm adds
+    # ~40 ms to every request, and the benchmarks measure that rather than
+    # run-framework.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def _params(self):
+        query = parse_qs(urlparse(self.path).query)
+        return dict((key, values[0]) for key, values in query.items())
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if self.headers.get('Content-Encoding', '') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        return body
+
+    def _send(self, status, body=b'', content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self, method):
+        path = urlparse(self.path).path
+        with self.fake.lock:
+            self.fake.requests[path] += 1
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        if self.fake.error_rate and random.random() < self.fake.error_rate:
+            if method == 'post':
+                self._read_body()
+            self._send(503, b'unavailable', 'text/plain')
+            return
+
+        handler = getattr(self, method + path.replace('/', '_').replace(
+            '-', '_'), None)
+        if handler is None:
+            self._send(404, b'not found', 'text/plain')
+        else:
+            handler(self._params())
+
+    def do_GET(self):
+        self._route('get')
+
+    def do_POST(self):
+        self._route('post')
+
+    def get_version(self, params):
+        self._send(200, {'version': 'fake-compute',
+                         'capabilities': self.fake.capabilities})
+
+    def get_config(self, params):
+        config = self.fake.config(params.get('entity'))
+        if config is None:
+            self._send(400, b'unknown entity', 'text/plain')
+        else:
+            self._send(200, {'name': params.get('entity'), 'value': config})
+
+    def post_config(self, params):
+        self._read_body()
+        if self.fake.set_config(params.get('entity'), params.get('path', ''),
+                                params.get('value')):
+            self._send(200, b'{}')
+        else:
+            self._send(400, b'unknown entity', 'text/plain')
+
+    def post_import(self, params):
+        body = self._read_body()
+        with self.fake.lock:
+            self.fake.import_bytes += len(body)
+
+        content_type = self.headers.get('Content-Type', '')
+        boundary = content_type.split('boundary=')[-1].encode('utf-8')
+        for part in body.split(b'--' + boundary):
+            head, _, content = part.partition(b'\r\n\r\n')
+            if b'name="entity-file"' in head:
+                content = content[:content.rfind(b'\r\n')]
+                try:
+                    self.fake.import_entities(json.loads(
+                        content.decode('utf-8')))
+                except ValueError:
+                    self._send(400, b'invalid entity file', 'text/plain')
+                    return
+        self._send(200, b'{}')
+
+    def get_import_local(self, params):
+        self._send(200, b'{}')
+
+    def get_update(self, params):
+        if self.fake.update(params.get('entity')):
+            self._send(200, b'{}')
+        else:
+            self._send(400, b'unknown entity', 'text/plain')
+
+    def get_export(self, params):
+        root_entity = params.get('entity', '')
+        if params.get('export-location'):
+            self._send(200, b'saved', 'text/plain')
+        elif params.get('type') == 'data':
+            size, chunks = self.fake.export_data_chunks(
+                root_entity, params.get('export-shallow') == 'true')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            for chunk in chunks:
+                self.wfile.write(chunk)
+        else:
+            self._send(200, self.fake.export_entities(root_entity))
+
+    def get_delete(self, params):
+        if 'delete' not in self.fake.capabilities:
+            self._send(404, b'not found', 'text/plain')
+            return
+        self.fake.delete(params.get('entity', ''))
+        self._send(200, b'{}')
+
+    def get_stop(self, params):
+        self._send(200, b'{}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8491)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every response '
+                             '(default=%(default)s)')
+    parser.add_argument('--run_duration', type=float, default=1.0,
+                        help='Seconds for a run to reach its termination age '
+                             '(default=%(default)s)')
+    parser.add_argument('--export_size', type=int, default=1024 * 1024,
+                        help='Bytes in a data export (default=%(default)s)')
+    parser.add_argument('--capabilities', default='',
+                        help='Comma separated capabilities to advertise')
+    parser.add_argument('--error_rate', type=float, default=0.0,
+                        help='Fraction of requests answered with a 503 '
+                             '(default=%(default)s)')
+    args = parser.parse_args()
+
+    fake = FakeCompute(port=args.port, latency=args.latency,
+                       run_duration=args.run_duration,
+                       export_size=args.export_size,
+                       capabilities=[c for c in args.capabilities.split(',')
+                                     if c],
+                       error_rate=args.error_rate)
+    print("Fake Compute on port %d" % fake.port())
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Count the processes run-framework forks for each parameter set, e.g. the
+bash shells that resolve paths from the variables file, and the path
+lookups that would each have needed one before they were resolved by
+environment.VariablesResolver.
+
+Experiment.run_sweeps is driven against an in-process fake Compute node,
+as in benchmarks.run_sweeps, and every subprocess.Popen is counted by its
+command.
+
+Run from scripts/run-framework:
+    python -m benchmarks.forks --param_sets 10
+"""
+
+from __future__ import print_function
+
+import os
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+import threading
+from collections import Counter
+
+from agief_experiment import environment
+from agief_experiment import httpsession
+from agief_experiment.compute import Compute
+from agief_experiment.computepool import ComputePool
+from agief_experiment.experiment import Experiment
+from agief_experiment.host_node import HostNode
+from agief_experiment.launchmode import LaunchMode
+
+from benchmarks.fake_compute import FakeCompute
+from benchmarks.run_sweeps import create_experiment_folder, sweep_args
+
+
+class PopenCounter:
+    """ Counts the processes started with subprocess.Popen, by command """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = Counter()
+        self._popen = None
+
+    def __enter__(self):
+        self._popen = subprocess.Popen
+        counter = self
+
+        class CountedPopen(self._popen):
+            def __init__(self, args, *popen_args, **kwargs):
+                command = args if isinstance(args, str) else " ".join(args)
+                with counter.lock:
+                    counter.commands[command.split(' && ')[-1]] += 1
+                super(CountedPopen, self).__init__(args, *popen_args,
+                                                   **kwargs)
+
+        subprocess.Popen = CountedPopen
+        return self
+
+    def __exit__(self, *exc_info):
+        subprocess.Popen = self._popen
+
+    def total(self):
+        with self.lock:
+            return sum(self.commands.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('--param_sets', type=int, default=10,
+                        help='Number of parameter sets (default=%(default)s)')
+    parser.add_argument('--run_duration', type=float, default=0.05,
+                        help='Seconds each run takes on the fake node '
+                             '(default=%(default)s)')
+    parser.add_argument('--no_export', action='store_true',
+                        help='Do not export at the end of each run')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    folder = tempfile.mkdtemp(prefix='run-framework-benchmark-')
+    fake = FakeCompute(run_duration=args.run_duration).start()
+    try:
+        variables_filepath = create_experiment_folder(folder, args.param_sets,
+                                                      64 * 1024)
+        os.environ['VARIABLES_FILE'] = variables_filepath
+
+        compute = Compute(HostNode(), str(fake.port()))
+        experiment = Experiment(False, LaunchMode.per_session,
+                                'experiments.json', True, False)
+
+        start = time.time()
+        with PopenCounter() as counter:
+            results = experiment.run_sweeps(ComputePool([compute]), None,
+                                            sweep_args(not args.no_export))
+        wall_time = time.time() - start
+
+        resolver = environment.resolver_for(variables_filepath)
+        num_sets = max(len(results), 1)
+
+        print("\n%d parameter sets in %.2f s" % (len(results), wall_time))
+        print("Processes forked: %d (%.1f per parameter set)" %
+              (counter.total(), counter.total() / float(num_sets)))
+        for command, count in counter.commands.most_common():
+            print("  %5d  %s" % (count, command))
+        print("Path lookups from the variables file: %d (%.1f per parameter "
+              "set), which sourced it %d time(s). Sourcing it for every "
+              "lookup would fork %d shells." %
+              (resolver.lookups, resolver.lookups / float(num_sets),
+               resolver.loads, resolver.lookups))
+    finally:
+        fake.stop()
+        httpsession.close_all()
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
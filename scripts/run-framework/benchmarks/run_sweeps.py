@@ -0,0 +1,309 @@
+"""
+Benchmark the overhead run-framework adds to each parameter set, i.e. the
+time spent outside of the runs themselves.
+
+Experiment.run_sweeps is driven end to end against in-process fake Compute
+nodes (see benchmarks.fake_compute), with a generated experiment folder in
+a temporary directory. Each phase of a parameter set is timed: generating
+the input files, import, setting parameters, the run (less the time the
+fake node takes to run it) and export.
+
+Run from scripts/run-framework:
+    python -m benchmarks.run_sweeps --param_sets 20 --latency 0.005
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+
+from agief_experiment import httpsession
+from agief_experiment import waitstrategy
+from agief_experiment.compute import Compute
+from agief_experiment.computepool import ComputePool
+from agief_experiment.experiment import Experiment
+from agief_experiment.host_node import HostNode
+from agief_experiment.launchmode import LaunchMode
+
+from benchmarks.fake_compute import FakeCompute
+
+
+PHASES = ('generate', 'import', 'parameters', 'run', 'export', 'other')
+
+
+class PhaseTimer:
+    """ Wall clock time of each phase, by parameter set prefix. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.times = defaultdict(lambda: defaultdict(float))
+        self._local = threading.local()
+
+    def bind(self, prefix):
+        self._local.prefix = prefix
+
+    def add(self, phase, seconds, prefix=None):
+        if prefix is None:
+            prefix = getattr(self._local, 'prefix', None)
+        with self.lock:
+            self.times[prefix][phase] += seconds
+
+    def timed(self, phase, function, *args, **kwargs):
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.add(phase, time.time() - start)
+
+
+class TimedCompute(Compute):
+    def __init__(self, timer, run_duration, *args, **kwargs):
+        Compute.__init__(self, *args, **kwargs)
+        self.timer = timer
+        self.run_duration = run_duration
+
+    def import_experiment(self, *args, **kwargs):
+        return self.timer.timed('import', Compute.import_experiment, self,
+                                *args, **kwargs)
+
+    def import_compute_experiment(self, *args, **kwargs):
+        return self.timer.timed('import',
+                                Compute.import_compute_experiment, self,
+                                *args, **kwargs)
+
+    def set_parameters_db(self, *args, **kwargs):
+        return self.timer.timed('parameters', Compute.set_parameters_db,
+                                self, *args, **kwargs)
+
+    def run_experiment(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return Compute.run_experiment(self, *args, **kwargs)
+        finally:
+            # only the time past the end of the run is overhead
+            self.timer.add('run', time.time() - start - self.run_duration)
+            self.timer.add('running', self.run_duration)
+
+    def export_subtree(self, *args, **kwargs):
+        return self.timer.timed('export', Compute.export_subtree, self,
+                                *args, **kwargs)
+
+
+class TimedExperiment(Experiment):
+    def __init__(self, timer, *args, **kwargs):
+        Experiment.__init__(self, *args, **kwargs)
+        self.timer = timer
+        self._generate_start = None
+
+    def create_all_input_files(self, *args, **kwargs):
+        self._generate_start = time.time()
+        return Experiment.create_all_input_files(self, *args, **kwargs)
+
+    def inc_parameter_set(self, *args, **kwargs):
+        result = Experiment.inc_parameter_set(self, *args, **kwargs)
+        # the input files of the next parameter set are generated on the
+        # calling thread, under the prefix that has just been created
+        self.timer.add('generate', time.time() - self._generate_start,
+                       self.prefix())
+        return result
+
+    def run_parameterset(self, *args, **kwargs):
+        self.timer.bind(self.prefix())
+        start = time.time()
+        try:
+            return Experiment.run_parameterset(self, *args, **kwargs)
+        finally:
+            self.timer.add('total', time.time() - start)
+            self.timer.bind(None)
+
+
+def create_experiment_folder(folder, param_sets, data_size):
+    """ A variables file, experiments definition and input files """
+
+    exp_home = os.path.join(folder, 'experiment')
+    run_home = os.path.join(folder, 'run')
+    for path in (os.path.join(exp_home, 'input'), run_home):
+        os.makedirs(path)
+
+    variables_filepath = os.path.join(folder, 'variables.sh')
+    with open(variables_filepath, 'w') as variables_file:
+        variables_file.write("export AGI_HOME=%s\n"
+                             "export AGI_EXP_HOME=%s\n"
+                             "export AGI_RUN_HOME=%s\n"
+                             "export AGI_DATA_RUN_HOME=%s\n" %
+                             (folder, exp_home, run_home, run_home))
+
+    experiments = {'experiments': [{
+        'import-files': {'file-entities': 'entities.json',
+                         'file-data': ['data.json']},
+        'entity-parameters': [],
+        'dataset-parameters': [],
+        'parameter-sweeps': [{'parameter-set': [{
+            'entity-name': 'experiment',
+            'parameter-path': 'terminationAge',
+            'val-begin': 1000,
+            'val-end': 1000 + param_sets,
+            'val-inc': 1}]}]
+    }]}
+    with open(os.path.join(exp_home, 'experiments.json'), 'w') as exps_file:
+        json.dump(experiments, exps_file, indent=4)
+
+    entities = [
+        {'name': Experiment.TEMPLATE_PREFIX + '--experiment',
+         'type': 'experiment', 'node': 'node', 'parent': None,
+         'config': json.dumps({'age': 0, 'terminated': False,
+                               'terminationAge': 1000})},
+        {'name': Experiment.TEMPLATE_PREFIX + '--model',
+         'type': 'model', 'node': 'node',
+         'parent': Experiment.TEMPLATE_PREFIX + '--experiment',
+         'config': json.dumps({'age': 0, 'learn': True})}
+    ]
+    with open(os.path.join(exp_home, 'input', 'entities.json'),
+              'w') as entity_file:
+        json.dump(entities, entity_file, indent=4)
+
+    elements = '[' + ','.join(['0.5'] * 1000) + ']'
+    data = [{'name': Experiment.TEMPLATE_PREFIX + '--model-output-%d' % i,
+             'refKeys': None, 'sizes': '[1000]', 'elements': elements}
+            for i in range(max(data_size // (len(elements) + 100), 1))]
+    with open(os.path.join(exp_home, 'input', 'data.json'), 'w') as data_file:
+        json.dump(data, data_file, indent=4)
+
+    return variables_filepath
+
+
+def sweep_args(export):
+    return argparse.Namespace(launch_compute=False, export=export,
+                              export_compute=False, upload=False,
+                              no_docker=True, stall_action='skip',
+                              logging='warning')
+
+
+def report(timer, wall_time, run_duration):
+    sets = [prefix for prefix in timer.times if prefix is not None and
+            'total' in timer.times[prefix]]
+    if not sets:
+        print("No parameter set was run.")
+        return
+
+    by_phase = defaultdict(list)
+    for prefix in sets:
+        times = timer.times[prefix]
+        accounted = sum(times[phase] for phase in PHASES if phase not in
+                        ('generate', 'other'))
+        times['other'] = (times['total'] - times['running'] - accounted)
+        for phase in PHASES:
+            by_phase[phase].append(times[phase])
+        by_phase['overhead'].append(times['total'] - times['running'] +
+                                    times['generate'])
+
+    print("\n%d parameter sets, run duration %gs, %.2f s in total "
+          "(%.2f sets/s)" % (len(sets), run_duration, wall_time,
+                             len(sets) / wall_time))
+    print("%-12s %12s %12s %12s" % ("phase", "mean (ms)", "median (ms)",
+                                    "max (ms)"))
+    for phase in PHASES + ('overhead',):
+        values = sorted(by_phase[phase])
+        print("%-12s %12.1f %12.1f %12.1f" % (
+            phase, 1000 * sum(values) / len(values),
+            1000 * values[len(values) // 2], 1000 * values[-1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('--param_sets', type=int, default=10,
+                        help='Number of parameter sets (default=%(default)s)')
+    parser.add_argument('--nodes', type=int, default=1,
+                        help='Number of fake Compute nodes '
+                             '(default=%(default)s)')
+    parser.add_argument('--slots', type=int, default=1,
+                        help='Parameter sets run at the same time on each '
+                             'node (default=%(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every response '
+                             '(default=%(default)s)')
+    parser.add_argument('--run_duration', type=float, default=0.5,
+                        help='Seconds each run takes on the fake node '
+                             '(default=%(default)s)')
+    parser.add_argument('--data_size', type=int, default=1024 * 1024,
+                        help='Bytes in the input data file '
+                             '(default=%(default)s)')
+    parser.add_argument('--data_chunk_mb', type=float, default=0,
+                        help='Split the data file into chunks of this size '
+                             '(default=%(default)s)')
+    parser.add_argument('--import_workers', type=int, default=1,
+                        help='Data files imported at the same time '
+                             '(default=%(default)s)')
+    parser.add_argument('--export_size', type=int, default=1024 * 1024,
+                        help='Bytes in a data export (default=%(default)s)')
+    parser.add_argument('--no_export', action='store_true',
+                        help='Do not export at the end of each run')
+    parser.add_argument('--wait_strategy', default='adaptive',
+                        choices=sorted(waitstrategy.STRATEGIES))
+    parser.add_argument('--upload_mode', default='stream',
+                        choices=Compute.UPLOAD_MODES)
+    parser.add_argument('--export_mode', default='stream',
+                        choices=Compute.EXPORT_MODES)
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the temporary experiment folder')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    folder = tempfile.mkdtemp(prefix='run-framework-benchmark-')
+    fakes = []
+    try:
+        os.environ['VARIABLES_FILE'] = create_experiment_folder(
+            folder, args.param_sets, args.data_size)
+
+        timer = PhaseTimer()
+        computes = []
+        for _ in range(args.nodes):
+            fake = FakeCompute(latency=args.latency,
+                               run_duration=args.run_duration,
+                               export_size=args.export_size).start()
+            fakes.append(fake)
+            computes.append(TimedCompute(
+                timer, args.run_duration, HostNode(), str(fake.port()),
+                wait_strategy=waitstrategy.from_name(args.wait_strategy),
+                upload_mode=args.upload_mode,
+                import_workers=args.import_workers,
+                export_mode=args.export_mode))
+            computes[-1].slots = args.slots
+
+        experiment = TimedExperiment(
+            timer, False, LaunchMode.per_session, 'experiments.json', True,
+            False, int(args.data_chunk_mb * 1024 * 1024))
+
+        start = time.time()
+        experiment.run_sweeps(ComputePool(computes), None,
+                              sweep_args(not args.no_export))
+        wall_time = time.time() - start
+
+        report(timer, wall_time, args.run_duration)
+
+        print("\nRequests per node:")
+        for fake in fakes:
+            print("  port %d: %s" % (fake.port(), ", ".join(
+                "%s %d" % item for item in sorted(fake.requests.items()))))
+    finally:
+        for fake in fakes:
+            fake.stop()
+        httpsession.close_all()
+        if args.keep:
+            print("Experiment folder: " + folder)
+        else:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark the idle time that each wait strategy adds to a run, i.e. the time
+between the experiment entity terminating and Compute.wait_till_param
+noticing it.
+
+Runs are simulated on a virtual clock (the entity's age advances linearly to
+terminationAge), so no Compute node is needed and the benchmark is fast.
+
+Run from scripts/run-framework:
+    python -m benchmarks.wait_strategy
+"""
+
+from __future__ import print_function
+
+import random
+import argparse
+
+from agief_experiment import waitstrategy
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def simulate_run(strategy, clock, duration, termination_age,
+                 with_termination_age=True):
+    """
+    Simulate waiting on one run that lasts 'duration' seconds.
+    :return: (idle seconds after termination, number of polls)
+    """
+
+    start = clock.now
+    strategy.reset()
+
+    polls = 0
+    while True:
+        polls += 1
+        elapsed = clock.now - start
+        age = int(termination_age * min(elapsed / duration, 1.0))
+        strategy.observe(age, elapsed * 1000,
+                         termination_age if with_termination_age else None)
+
+        if elapsed >= duration:
+            break
+
+        clock.now += strategy.next_interval()
+
+    strategy.finished()
+    return clock.now - start - duration, polls
+
+
+def benchmark(name, durations, termination_age, with_termination_age):
+    clock = VirtualClock()
+    if name == waitstrategy.FixedWaitStrategy.name:
+        strategy = waitstrategy.FixedWaitStrategy(clock=clock)
+    else:
+        strategy = waitstrategy.AdaptiveWaitStrategy(clock=clock)
+
+    idle = []
+    polls = []
+    for duration in durations:
+        run_idle, run_polls = simulate_run(strategy, clock, duration,
+                                           termination_age,
+                                           with_termination_age)
+        idle.append(run_idle)
+        polls.append(run_polls)
+
+    return sum(idle) / len(idle), max(idle), sum(polls) / float(len(polls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=200,
+                        help='Number of runs to simulate '
+                             '(default=%(default)s)')
+    parser.add_argument('--min_duration', type=float, default=5,
+                        help='Shortest run, in seconds (default=%(default)s)')
+    parser.add_argument('--max_duration', type=float, default=120,
+                        help='Longest run, in seconds (default=%(default)s)')
+    parser.add_argument('--termination_age', type=int, default=10000,
+                        help='Age at which runs terminate '
+                             '(default=%(default)s)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    durations = [rng.uniform(args.min_duration, args.max_duration)
+                 for _ in range(args.runs)]
+
+    print("%d runs of %g-%gs" % (args.runs, args.min_duration,
+                                 args.max_duration))
+    print("%-10s %-22s %14s %14s %12s" % ("strategy", "terminationAge",
+                                          "mean idle (s)", "max idle (s)",
+                                          "polls/run"))
+
+    for name in (waitstrategy.FixedWaitStrategy.name,
+                 waitstrategy.AdaptiveWaitStrategy.name):
+        for with_termination_age in (True, False):
+            mean_idle, max_idle, mean_polls = benchmark(
+                name, durations, args.termination_age, with_termination_age)
+            print("%-10s %-22s %14.2f %14.2f %12.1f" % (
+                name,
+                "known" if with_termination_age else "unknown (learned)",
+                mean_idle, max_idle, mean_polls))
+
+
+if __name__ == '__main__':
+    main()
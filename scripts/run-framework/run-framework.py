@@ -2,15 +2,22 @@ from __future__ import print_function
 
 import os
 import sys
+import copy
 import logging
 import traceback
 from datetime import datetime
 
 from agief_experiment.host_node import HostNode
 from agief_experiment.compute import Compute
+from agief_experiment.computepool import ComputePool
+from agief_experiment.inputcache import InputCache
+from agief_experiment.generatedinputs import GeneratedInputs
 from agief_experiment.cloud import Cloud
 from agief_experiment.experiment import Experiment
+from agief_experiment.experimentdefinition import DefinitionError
 from agief_experiment.launchmode import LaunchMode
+from agief_experiment import httpsession
+from agief_experiment import waitstrategy
 from agief_experiment import utils
 
 HELP_GENERIC = """
@@ -83,7 +90,8 @@ def setup_arg_parsing():
     parser.add_argument('--step_shutdown', dest='shutdown',
                         action='store_true',
                         help='Shutdown instances and Compute '
-                             '(if --launch_per_session) after other stages.')
+                             '(if --launch_per_session or '
+                             '--launch_warm_reset) after other stages.')
     parser.add_argument('--step_export', dest='export', action='store_true',
                         help='Export entity tree and data at the end of '
                              'each experiment.')
@@ -109,6 +117,38 @@ def setup_arg_parsing():
     parser.add_argument('--port', dest='port', required=False,
                         help='Port where the Compute node will be running '
                              '(default=%(default)s).')
+    parser.add_argument('--compute_endpoints', dest='compute_endpoints',
+                        required=False,
+                        help='Additional Compute nodes to run parameter sets '
+                             'on, at the same time as the node at --host, '
+                             'as a comma separated list of host:port. '
+                             'Remote nodes share the --user, --ssh_keypath, '
+                             '--ssh_port and --remote_variables_file of '
+                             '--host (default=%(default)s).')
+    parser.add_argument('--standby_endpoints', dest='standby_endpoints',
+                        required=False,
+                        help='Compute nodes that only take parameter sets '
+                             'once a node has failed (e.g. its circuit '
+                             'breaker has tripped), and pass a health check. '
+                             'A comma separated list of host:port, as for '
+                             '--compute_endpoints (default=%(default)s).')
+    parser.add_argument('--compute_slots', dest='compute_slots',
+                        required=False,
+                        help='Number of parameter sets run at the same time '
+                             'on each Compute node, each under its own '
+                             'prefix. "auto" sizes it to the cores and '
+                             'memory of each node\'s machine, see '
+                             '--slot_cores and --slot_memory. Not possible '
+                             'if Compute is launched per experiment '
+                             '(default=%(default)s).')
+    parser.add_argument('--slot_cores', dest='slot_cores', type=int,
+                        required=False,
+                        help='Cores per run for --compute_slots auto '
+                             '(default=%(default)s).')
+    parser.add_argument('--slot_memory', dest='slot_memory', type=float,
+                        required=False,
+                        help='GB of memory per run for --compute_slots auto '
+                             '(default=%(default)s).')
     parser.add_argument('--user', dest='user', required=False,
                         help='If remote, the "user" on the remote '
                              'Compute node (default=%(default)s).')
@@ -121,6 +161,151 @@ def setup_arg_parsing():
                              'VARIABLES_FILE to use on the remote '
                              'Compute node (default=%(default)s).')
 
+    # http connection to the Compute node
+    parser.add_argument('--http_pool_size', dest='http_pool_size',
+                        type=int, required=False,
+                        help='Max number of pooled (keep-alive) connections '
+                             'to each Compute node (default=%(default)s).')
+    parser.add_argument('--http_retries', dest='http_retries', type=int,
+                        required=False,
+                        help='Number of transport level retries for requests '
+                             'to the Compute node, on connection errors and '
+                             '5xx responses (default=%(default)s).')
+    parser.add_argument('--no_keep_alive', dest='no_keep_alive',
+                        action='store_true',
+                        help='If set, then open a new connection for every '
+                             'request to the Compute node '
+                             '(default=%(default)s).')
+    parser.add_argument('--breaker_error_rate', dest='breaker_error_rate',
+                        type=float, required=False,
+                        help='Trip the circuit breaker of a Compute node, '
+                             'and fail its runs over to another node, when '
+                             'at least this fraction of its recent requests '
+                             'failed. 0 to never trip (default=%(default)s).')
+    parser.add_argument('--breaker_slow_seconds',
+                        dest='breaker_slow_seconds', type=float,
+                        required=False,
+                        help='Quick requests (/version, /config reads) that '
+                             'take longer than this count as failed for the '
+                             'circuit breaker (default=%(default)s).')
+    parser.add_argument('--breaker_reset_seconds',
+                        dest='breaker_reset_seconds', type=float,
+                        required=False,
+                        help='Seconds a tripped circuit breaker refuses '
+                             'requests before the node is tried again '
+                             '(default=%(default)s).')
+
+    parser.add_argument('--config_workers', dest='config_workers',
+                        type=int, required=False,
+                        help='Max number of concurrent requests used to set '
+                             'the entity and dataset parameters of a run '
+                             '(default=%(default)s).')
+    parser.add_argument('--upload_mode', dest='upload_mode',
+                        required=False, choices=Compute.UPLOAD_MODES,
+                        help='How input files are uploaded to the Compute '
+                             'node. "multipart" reads the whole file into '
+                             'memory first, "stream" sends it in chunks, '
+                             '"stream-gzip" also compresses it on the fly, '
+                             'if the node supports gzip requests '
+                             '(default=%(default)s).')
+    parser.add_argument('--import_workers', dest='import_workers',
+                        type=int, required=False,
+                        help='Max number of data files imported into the '
+                             'Compute node at the same time, after the '
+                             'entity file (default=%(default)s).')
+    parser.add_argument('--data_chunk_mb', dest='data_chunk_mb', type=float,
+                        required=False,
+                        help='Split data files larger than this into chunks '
+                             'of about this size, imported as separate data '
+                             'files, --import_workers at a time. The chunks '
+                             'are made once and reused until the file '
+                             'changes. 0 to import data files whole '
+                             '(default=%(default)s).')
+    parser.add_argument('--generated_inputs_max_mb',
+                        dest='generated_inputs_max_mb', type=float,
+                        required=False,
+                        help='Size the cache of generated input files '
+                             '(input/generated) is kept to, by removing the '
+                             'least recently used files. 0 for no limit '
+                             '(default=%(default)s).')
+    parser.add_argument('--export_mode', dest='export_mode',
+                        required=False, choices=Compute.EXPORT_MODES,
+                        help='How exported entity trees and data are '
+                             'written (with --step_export). "pretty" '
+                             'parses and indents the json, "stream" writes '
+                             'it to file as it is received, "stream-gzip" '
+                             'also compresses it (default=%(default)s).')
+    parser.add_argument('--export_shards', dest='export_shards',
+                        action='store_true',
+                        help='Export the data of each entity of the '
+                             'experiment to its own file, concurrently, with '
+                             'an index (.index.json) that can be imported in '
+                             'place of a data file. Needs a Compute node '
+                             'that supports "export-shallow" '
+                             '(default=%(default)s).')
+    parser.add_argument('--export_workers', dest='export_workers', type=int,
+                        required=False,
+                        help='Max concurrent exports with --export_shards '
+                             '(default=%(default)s).')
+    parser.add_argument('--wait_strategy', dest='wait_strategy',
+                        required=False,
+                        choices=sorted(waitstrategy.STRATEGIES),
+                        help='How to poll the Compute node for the end of a '
+                             'run. "fixed" polls every 10s, "adaptive" '
+                             'polls more often as the run nears its '
+                             'termination age, "long-poll" lets the node '
+                             'hold the request if it supports it '
+                             '(default=%(default)s).')
+
+    parser.add_argument('--input_cache', dest='input_cache',
+                        action='store_true',
+                        help='Store large data files once in a content '
+                             'addressed cache on the Compute host, and load '
+                             'them from there, rather than uploading them '
+                             'with every run. Files that Compute can not load '
+                             'from the cache are uploaded '
+                             '(default=%(default)s).')
+    parser.add_argument('--input_cache_dir', dest='input_cache_dir',
+                        required=False,
+                        help='The input cache folder, as a path on the '
+                             'Compute host, and as Compute sees it (e.g. '
+                             'inside its docker container). By default '
+                             'input-cache in the run folder of the Compute '
+                             'host: AGI_RUN_HOME of --remote_variables_file '
+                             'on a remote host, or of the local variables '
+                             'file. That is only right if Compute runs '
+                             'outside docker.')
+    parser.add_argument('--input_cache_min_mb', dest='input_cache_min_mb',
+                        type=float, required=False,
+                        help='Data files smaller than this are always '
+                             'uploaded (default=%(default)s).')
+    parser.add_argument('--no_config_cache', dest='no_config_cache',
+                        action='store_true',
+                        help='Send every parameter to Compute, even if it is '
+                             'known to have the value already, from the '
+                             'imported entity file or an earlier run '
+                             '(default=%(default)s).')
+    parser.add_argument('--stall_multiple', dest='stall_multiple',
+                        type=float, required=False,
+                        help='A run is considered stalled if the age of the '
+                             'experiment has not advanced for this many times '
+                             'its usual step interval. 0 to disable, as it '
+                             'is by default (default=%(default)s).')
+    parser.add_argument('--stall_min_seconds', dest='stall_min_seconds',
+                        type=float, required=False,
+                        help='A run is never considered stalled before its '
+                             'age has been still for this many seconds '
+                             '(default=%(default)s).')
+    parser.add_argument('--stall_action', dest='stall_action',
+                        required=False, choices=('relaunch', 'skip'),
+                        help='What to do once a run has stalled (its partial '
+                             'state is exported first). "relaunch" relaunches '
+                             'Compute (with --step_compute), "skip" unloads '
+                             'the run and moves on to the next parameter set '
+                             'on the same node. If Compute can\'t unload it, '
+                             'it is relaunched where possible '
+                             '(default=%(default)s).')
+
     # launch mode
     parser.add_argument('--launch_per_session', dest='launch_per_session',
                         action='store_true',
@@ -129,6 +314,16 @@ def setup_arg_parsing():
                              '--step_shutdown. Otherwise, it is launched '
                              'and shut per experiment.')
 
+    parser.add_argument('--launch_warm_reset', dest='launch_warm_reset',
+                        action='store_true',
+                        help='Compute node is launched once at the start, '
+                             'as with --launch_per_session, but the '
+                             'entities and data of each experiment are '
+                             'unloaded once it is over (if Compute '
+                             'advertises \'delete\', otherwise they are left '
+                             'loaded). Compute is only relaunched if it '
+                             'becomes unhealthy, or can\'t be cleared.')
+
     parser.add_argument('--no_docker', dest='no_docker', action='store_true',
                         help='If set, then DO NOT launch in a docker '
                              'container. Applies to LOCAL usage only. '
@@ -189,9 +384,35 @@ def setup_arg_parsing():
     )
     parser.set_defaults(ami_ram='6')
     parser.set_defaults(no_docker=False)
+    parser.set_defaults(launch_warm_reset=False)
     parser.set_defaults(logging="warning")
     parser.set_defaults(no_compress=False)
     parser.set_defaults(csv_output=False)
+    parser.set_defaults(http_pool_size=10)
+    parser.set_defaults(http_retries=3)
+    parser.set_defaults(no_keep_alive=False)
+    parser.set_defaults(breaker_error_rate=0.5)
+    parser.set_defaults(breaker_slow_seconds=None)
+    parser.set_defaults(breaker_reset_seconds=30)
+    parser.set_defaults(wait_strategy='adaptive')
+    parser.set_defaults(config_workers=8)
+    parser.set_defaults(upload_mode='stream')
+    parser.set_defaults(import_workers=1)
+    parser.set_defaults(data_chunk_mb=0)
+    parser.set_defaults(generated_inputs_max_mb=(
+        GeneratedInputs.DEFAULT_MAX_SIZE // (1024 * 1024)))
+    parser.set_defaults(export_mode=Compute.DEFAULT_EXPORT_MODE)
+    parser.set_defaults(stall_multiple=0)
+    parser.set_defaults(stall_min_seconds=300)
+    parser.set_defaults(stall_action='relaunch')
+    parser.set_defaults(no_config_cache=False)
+    parser.set_defaults(export_shards=False)
+    parser.set_defaults(export_workers=4)
+    parser.set_defaults(input_cache=False)
+    parser.set_defaults(input_cache_min_mb=16)
+    parser.set_defaults(compute_slots='1')
+    parser.set_defaults(slot_cores=2)
+    parser.set_defaults(slot_memory=4)
 
     return parser.parse_args()
 
@@ -224,12 +445,81 @@ def check_args(args, compute_node):
                       "running on a remote machine (use param --step_remote)")
         exit(1)
 
+    if args.compute_slots != 'auto' and (
+            not args.compute_slots.isdigit() or int(args.compute_slots) < 1):
+        logging.error("--compute_slots should be a number above 0, or "
+                      "'auto'.")
+        exit(1)
+
+    if args.compute_slots != '1' and args.launch_compute and (
+            not LaunchMode.from_args(args).is_launched_once()):
+        logging.error("Several runs at a time on a Compute node "
+                      "(--compute_slots) needs Compute to be launched once "
+                      "for all of them: use --launch_per_session or "
+                      "--launch_warm_reset.")
+        exit(1)
+
     if args.exps_file and not args.launch_compute:
         logging.warning("You have elected to run experiment without launching "
                         "a Compute node. For success, you'll have to have one "
                         "running already, or use param --step_compute)")
 
 
+def compute_pool_nodes(args, compute_node):
+    """
+    The Compute node at --host, followed by one Compute for each of the
+    --compute_endpoints
+    """
+    return [compute_node] + endpoint_nodes(args, compute_node,
+                                           args.compute_endpoints)
+
+
+def endpoint_nodes(args, compute_node, endpoints):
+    """
+    One Compute for each host:port in the comma separated 'endpoints'
+    (the port defaults to --port), on hosts set up as the one of
+    'compute_node'
+    """
+    compute_nodes = []
+
+    if endpoints:
+        for endpoint in endpoints.split(','):
+            host, _, port = endpoint.strip().rpartition(':')
+            if not host:
+                host, port = port, args.port
+
+            host_node = copy.copy(compute_node.host_node)
+            host_node.host = host
+            compute_nodes.append(Compute(host_node, port,
+                                         **compute_options(args)))
+
+    return compute_nodes
+
+
+def compute_options(args):
+    """
+    Keyword arguments for Compute, from the commandline arguments
+    """
+    return {
+        'pool_size': args.http_pool_size,
+        'max_retries': args.http_retries,
+        'keep_alive': not args.no_keep_alive,
+        'wait_strategy': waitstrategy.from_name(args.wait_strategy),
+        'config_workers': args.config_workers,
+        'upload_mode': args.upload_mode,
+        'import_workers': args.import_workers,
+        'export_mode': args.export_mode,
+        'stall_multiple': args.stall_multiple,
+        'stall_min_seconds': args.stall_min_seconds,
+        'config_cache': not args.no_config_cache,
+        'export_shards': args.export_shards,
+        'export_workers': args.export_workers,
+        'breaker_error_rate': args.breaker_error_rate,
+        'breaker_slow_seconds': args.breaker_slow_seconds,
+        'breaker_reset_seconds': args.breaker_reset_seconds
+    }
+
+
 def main():
     """
     The main scope of the run-framework containing the high level code
@@ -255,11 +545,22 @@ def main():
 
     exps_file = args.exps_file if args.exps_file else ""
     experiment = Experiment(args.debug_no_run, LaunchMode.from_args(args),
-                            exps_file, args.no_compress, args.csv_output)
+                            exps_file, args.no_compress, args.csv_output,
+                            int(args.data_chunk_mb * 1024 * 1024),
+                            int(args.generated_inputs_max_mb * 1024 * 1024))
+
+    # Check the whole experiments definition before anything is launched
+    if args.exps_file:
+        try:
+            experiment.experiment_utils.definition()
+        except DefinitionError as e:
+            logging.error(e)
+            exit(1)
 
     # 1) Generate input files
     if args.main_class:
-        compute_node = Compute(host_node=HostNode(), port=args.port)
+        compute_node = Compute(host_node=HostNode(), port=args.port,
+                               **compute_options(args))
         compute_node.launch(experiment, main_class=args.main_class,
                             no_local_docker=args.no_docker)
         experiment.generate_input_files_locally(compute_node)
@@ -282,7 +583,12 @@ def main():
     else:
         host_node = HostNode(args.host, args.user)
 
-    compute_node = Compute(host_node, args.port)
+    compute_node = Compute(host_node, args.port, **compute_options(args))
+    compute_pool = ComputePool(
+        compute_pool_nodes(args, compute_node),
+        standbys=endpoint_nodes(args, compute_node, args.standby_endpoints),
+        check_standbys=(LaunchMode.from_args(args).is_launched_once() or
+                        not args.launch_compute))
 
     check_args(args, compute_node)
 
@@ -334,27 +640,50 @@ def main():
 
         # 3) Sync code and run-home
         if args.sync:
-            cloud.sync_experiment(compute_node.host_node)
+            for pool_node in compute_pool:
+                cloud.sync_experiment(pool_node.host_node)
 
         # 3.5) Prepare data and sync from S3 if necessary
         # This is typically used to download output files from
         # a previous experiment to be used as input
         if args.prepare_data_from_prefix:
-            cloud.remote_download_output(args.prepare_data_from_prefix,
-                                         compute_node.host_node)
+            for pool_node in compute_pool:
+                cloud.remote_download_output(args.prepare_data_from_prefix,
+                                             pool_node.host_node)
 
         # 4) Launch Compute (remote or local)
         # *** IF Mode == 'Per Session' ***
-        if ((LaunchMode.from_args(args) is LaunchMode.per_session) and
+        if (LaunchMode.from_args(args).is_launched_once() and
                 args.launch_compute):
-            compute_node.launch(experiment, cloud=cloud,
-                                main_class=args.main_class,
-                                no_local_docker=args.no_docker)
+            for pool_node in compute_pool:
+                pool_node.launch(experiment, cloud=cloud,
+                                 main_class=args.main_class,
+                                 no_local_docker=args.no_docker)
 
         # 5) Run experiments
         # This includes per experiment 'export results' and 'upload results'
+        for pool_node in compute_pool:
+            if args.compute_slots == 'auto':
+                pool_node.slots = pool_node.concurrent_runs(args.slot_cores,
+                                                            args.slot_memory)
+            else:
+                pool_node.slots = int(args.compute_slots)
+
+            if args.input_cache:
+                # the run folder of a remote host is looked up on it, once
+                # it is up
+                cache_dir = args.input_cache_dir
+                if cache_dir is None and not pool_node.remote():
+                    cache_dir = experiment.experiment_utils.runpath(
+                        InputCache.CACHE_FOLDER)
+                pool_node.input_cache = InputCache(
+                    pool_node.host_node, cache_dir,
+                    int(args.input_cache_min_mb * 1024 * 1024))
+                pool_node.generated_inputs = (
+                    experiment.experiment_utils.generated_inputs())
+
         if args.exps_file:
-            experiment.run_sweeps(compute_node, cloud, args)
+            experiment.run_sweeps(compute_pool, cloud, args)
             experiment.persist_prefix_history(cloud)
 
     except Exception as err:  # pylint: disable=W0703
@@ -380,8 +709,14 @@ def main():
 
     # 6) Shutdown framework
     if args.shutdown:
-        if LaunchMode.from_args(args) is LaunchMode.per_session:
-            compute_node.terminate()
+        if LaunchMode.from_args(args).is_launched_once():
+            # all of them, standbys and retired nodes were launched too
+            for pool_node in compute_pool:
+                try:
+                    pool_node.terminate()
+                except Exception as e:  # pylint: disable=W0703
+                    logging.warning("Could not terminate Compute %s: %s",
+                                    pool_node.base_url(), e)
 
         # Shutdown infrastructure
         if args.remote_type == "aws":
@@ -390,6 +725,16 @@ def main():
             if is_pg_ec2:
                 cloud.ec2_stop(args.pg_instance)
 
+    # Report how the pooled connections to Compute were used
+    for stats in httpsession.all_stats():
+        print("HTTP session to %(url)s: %(requests)d requests, "
+              "%(connections_opened)d connections opened, "
+              "%(connections_reused)d reused, %(errors)d errors, "
+              "mean latency %(mean_latency_ms).1f ms, "
+              "max latency %(max_latency_ms).1f ms, "
+              "circuit breaker %(breaker)s" % stats)
+    httpsession.close_all()
+
     # Record experiment end time
     exp_end_time = datetime.now()
 